@@ -0,0 +1,76 @@
+"""
+Benchmark suite.
+
+    python -m benchmarks run [--only format|proxy] [--quick] [--output FILE]
+    python -m benchmarks compare BASELINE CURRENT [--threshold PERCENT]
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+
+from . import compare, format_bench, proxy_bench
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+
+
+def run(args) -> int:
+    results = {}
+    if args.only in (None, "format"):
+        sizes = ["1KB", "100KB"] if args.quick else None
+        results.update(format_bench.run(sizes=sizes, min_time=0.2 if args.quick else 1.0))
+    if args.only in (None, "proxy"):
+        duration = 2.0 if args.quick else args.duration
+        results.update(proxy_bench.run(concurrency=args.concurrency, duration=duration, log_sink=args.log_sink))
+    output = args.output or os.path.join(BASELINE_DIR, time.strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    document = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "quick": args.quick,
+        },
+        "results": results,
+    }
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(document, f, indent=2)
+    print(f"\nResults saved to {output}")
+    return 0
+
+
+def run_compare(args) -> int:
+    rows = compare.compare(compare.load(args.baseline), compare.load(args.current), args.threshold)
+    return 1 if compare.print_report(rows, args.threshold) else 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="echo-proxy benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the benchmarks and save the results as JSON")
+    run_parser.add_argument("--only", choices=["format", "proxy"], help="run only one group")
+    run_parser.add_argument("--quick", action="store_true", help="skip the 10MB payloads and shorten the proxy runs")
+    run_parser.add_argument("--output", help=f"results file (default: a timestamped file in {BASELINE_DIR})")
+    run_parser.add_argument("--concurrency", type=int, default=10, help="concurrent proxy clients (default: 10)")
+    run_parser.add_argument("--duration", type=float, default=10.0, help="seconds per proxy mode (default: 10)")
+    run_parser.add_argument("--log-sink", default="none", help="LOG_SINK of the proxy under test (default: none)")
+    run_parser.set_defaults(handler=run)
+
+    compare_parser = commands.add_parser("compare", help="compare two results files and flag regressions")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=10.0,
+                                help="percent change that counts as a regression (default: 10)")
+    compare_parser.set_defaults(handler=run_compare)
+
+    args = parser.parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
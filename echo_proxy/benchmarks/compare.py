@@ -0,0 +1,44 @@
+"""Compare two benchmark result files and flag regressions"""
+
+import json
+
+# Metrics that are compared; the rest (run counts, MB/s, ...) are informational
+COMPARED = {"median_ms", "rps", "p50_ms", "p99_ms"}
+# Compared metrics where a larger value is better; the others are "lower is better"
+HIGHER_IS_BETTER = {"rps"}
+
+
+def load(path: str) -> dict:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def compare(baseline: dict, current: dict, threshold: float = 10.0):
+    """
+    Rows of (benchmark, metric, baseline, current, change %, regressed) for every
+    metric present in both; change is positive when the result got worse.
+    """
+    rows = []
+    for name, base_metrics in baseline["results"].items():
+        current_metrics = current["results"].get(name)
+        if current_metrics is None:
+            continue
+        for metric, base_value in base_metrics.items():
+            if metric not in COMPARED or metric not in current_metrics or not base_value:
+                continue
+            value = current_metrics[metric]
+            change = (value - base_value) / base_value * 100
+            if metric in HIGHER_IS_BETTER:
+                change = -change
+            rows.append((name, metric, base_value, value, change, change > threshold))
+    return rows
+
+
+def print_report(rows, threshold: float):
+    print(f"{'benchmark':<28} {'metric':<10} {'baseline':>12} {'current':>12} {'change':>9}")
+    for name, metric, base_value, value, change, regressed in rows:
+        flag = "  REGRESSION" if regressed else ""
+        print(f"{name:<28} {metric:<10} {base_value:>12.3f} {value:>12.3f} {change:>+8.1f}%{flag}")
+    regressions = sum(1 for row in rows if row[-1])
+    print(f"\n{regressions} regression(s) beyond {threshold:g}% ({len(rows)} metrics compared; positive change is worse)")
+    return regressions
@@ -0,0 +1,41 @@
+"""Microbenchmarks of format_body per payload kind and size"""
+
+import time
+import statistics
+
+from echo_proxy.formatter import format_body
+
+from .payloads import CONTENT_TYPES, GENERATORS, SIZES
+
+
+def time_call(func, min_time: float = 1.0, max_runs: int = 1000, warmup: int = 1):
+    """Run `func` until `min_time` seconds or `max_runs` runs have passed; returns the run times"""
+    for _ in range(warmup):
+        func()
+    times = []
+    started = time.perf_counter()
+    while len(times) < max_runs and (not times or time.perf_counter() - started < min_time):
+        run_started = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - run_started)
+    return times
+
+
+def run(kinds=None, sizes=None, min_time: float = 1.0, progress=print) -> dict:
+    results = {}
+    for kind in kinds or GENERATORS:
+        content_type = CONTENT_TYPES[kind]
+        for size_name in sizes or SIZES:
+            body = GENERATORS[kind](SIZES[size_name])
+            # The endpoint lets protobuf reuse its cached layout, as it would for repeated traffic
+            times = time_call(lambda: format_body(body, content_type, f"bench {kind}"), min_time=min_time)
+            median = statistics.median(times)
+            name = f"format/{kind}/{size_name}"
+            results[name] = {
+                "runs": len(times),
+                "median_ms": round(median * 1000, 4),
+                "min_ms": round(min(times) * 1000, 4),
+                "mb_per_s": round(len(body) / median / 1e6, 2) if median else 0.0,
+            }
+            progress(f"{name:<28} {results[name]['median_ms']:>10.3f} ms  {results[name]['mb_per_s']:>9.2f} MB/s  ({len(times)} runs)")
+    return results
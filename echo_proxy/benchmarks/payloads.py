@@ -0,0 +1,95 @@
+"""Deterministic request/response bodies of a given size for the benchmarks"""
+
+import json
+import random
+
+SIZES = {"1KB": 1024, "100KB": 100 * 1024, "10MB": 10 * 1024 * 1024}
+
+CONTENT_TYPES = {
+    "json": "application/json",
+    "xml": "application/xml",
+    "protobuf": "application/x-protobuf",
+    "binary": "application/octet-stream",
+    "text": "text/plain",
+}
+
+WORDS = "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt".split()
+
+
+def _repeat_to(size: int, make_item, join: bytes = b"", prefix: bytes = b"", suffix: bytes = b"") -> bytes:
+    items = []
+    total = len(prefix) + len(suffix)
+    i = 0
+    while total < size:
+        item = make_item(i)
+        items.append(item)
+        total += len(item) + len(join)
+        i += 1
+    return prefix + join.join(items) + suffix
+
+
+def json_payload(size: int) -> bytes:
+    rng = random.Random(1)
+
+    def item(i):
+        return json.dumps({
+            "id": i,
+            "name": " ".join(rng.choice(WORDS) for _ in range(3)),
+            "price": round(rng.random() * 100, 2),
+            "tags": [rng.choice(WORDS) for _ in range(2)],
+            "active": i % 2 == 0,
+        }, separators=(",", ":")).encode()
+
+    return _repeat_to(size, item, join=b",", prefix=b'{"items":[', suffix=b"]}")
+
+
+def xml_payload(size: int) -> bytes:
+    rng = random.Random(2)
+
+    def item(i):
+        name = " ".join(rng.choice(WORDS) for _ in range(3))
+        return f'<item id="{i}"><name>{name}</name><price>{rng.random() * 100:.2f}</price></item>'.encode()
+
+    return _repeat_to(size, item, prefix=b'<?xml version="1.0"?><items>', suffix=b"</items>")
+
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def protobuf_payload(size: int) -> bytes:
+    """Message with a repeated sub-message field (1) of {1: varint, 2: string, 3: varint}"""
+    rng = random.Random(3)
+
+    def item(i):
+        name = " ".join(rng.choice(WORDS) for _ in range(3)).encode()
+        inner = b"\x08" + _varint(i) + b"\x12" + _varint(len(name)) + name + b"\x18" + _varint(rng.randrange(1 << 20))
+        return b"\x0a" + _varint(len(inner)) + inner
+
+    return _repeat_to(size, item)
+
+
+def binary_payload(size: int) -> bytes:
+    return random.Random(4).randbytes(size)
+
+
+def text_payload(size: int) -> bytes:
+    rng = random.Random(5)
+    return _repeat_to(size, lambda i: (" ".join(rng.choice(WORDS) for _ in range(12)) + "\n").encode())
+
+
+GENERATORS = {
+    "json": json_payload,
+    "xml": xml_payload,
+    "protobuf": protobuf_payload,
+    "binary": binary_payload,
+    "text": text_payload,
+}
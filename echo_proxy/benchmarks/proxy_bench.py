@@ -0,0 +1,140 @@
+"""
+End-to-end proxy throughput and latency.
+
+A stub upstream runs in this process on a background thread; the proxy runs
+as a subprocess (its configuration is read from the environment at import),
+and a closed-loop httpx load generator drives it for a fixed duration.
+"""
+
+import os
+import sys
+import time
+import socket
+import asyncio
+import threading
+import subprocess
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request, Response
+
+from echo_proxy.replay import ReplayStats
+
+# What the stub upstream returns
+RESPONSE_BODY = b'{"ok":true,"items":[1,2,3]}'
+# What the load generator sends
+REQUEST_BODY = b'{"name":"bench","values":[1,2,3,4,5,6,7,8]}'
+
+stub_app = FastAPI()
+
+
+@stub_app.api_route("/{path:path}", methods=["GET", "POST"])
+async def stub(request: Request, path: str):
+    await request.body()
+    return Response(RESPONSE_BODY, media_type="application/json")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class StubUpstream:
+    """uvicorn serving the stub app on a daemon thread"""
+
+    def __init__(self):
+        self.port = free_port()
+        config = uvicorn.Config(stub_app, host="127.0.0.1", port=self.port, log_level="warning", access_log=False)
+        self.server = uvicorn.Server(config)
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        wait_for_port(self.port)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join(5)
+
+
+def wait_for_port(port: int, timeout: float = 15):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"Nothing listening on port {port} after {timeout}s")
+
+
+def start_proxy(port: int, env: dict) -> subprocess.Popen:
+    project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    process = subprocess.Popen(
+        [sys.executable, "-m", "echo_proxy.main"],
+        cwd=project_dir,
+        env={**os.environ, "HOST": "127.0.0.1", "PORT": str(port), **env},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_for_port(port)
+    except RuntimeError:
+        process.kill()
+        raise
+    return process
+
+
+async def load(url: str, concurrency: int, duration: float) -> ReplayStats:
+    stats = ReplayStats()
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    headers = {"content-type": "application/json"}
+    async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+        # Open the connections before measuring
+        await asyncio.gather(*(client.post(url, content=REQUEST_BODY, headers=headers) for _ in range(concurrency)))
+        stats.started = time.monotonic()
+        deadline = stats.started + duration
+
+        async def worker():
+            while time.monotonic() < deadline:
+                started = time.monotonic()
+                try:
+                    response = await client.post(url, content=REQUEST_BODY, headers=headers)
+                    stats.record(time.monotonic() - started, status=response.status_code)
+                except httpx.HTTPError as e:
+                    stats.record(time.monotonic() - started, error=type(e).__name__)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        stats.finished = time.monotonic()
+    return stats
+
+
+def run(modes=("echo", "forward"), concurrency: int = 10, duration: float = 10.0,
+        log_sink: str = "none", progress=print) -> dict:
+    results = {}
+    with StubUpstream() as upstream:
+        for mode in modes:
+            env = {"LOG_SINK": log_sink, "TARGET_URL": f"http://127.0.0.1:{upstream.port}"}
+            if mode == "echo":
+                env["ECHO_MODE"] = "true"
+            port = free_port()
+            proxy = start_proxy(port, env)
+            try:
+                stats = asyncio.run(load(f"http://127.0.0.1:{port}/bench", concurrency, duration))
+            finally:
+                proxy.terminate()
+                proxy.wait(10)
+            summary = stats.summary()
+            name = f"proxy/{mode}/c{concurrency}"
+            results[name] = {
+                "requests": summary["requests"],
+                "rps": summary["throughput_rps"],
+                "p50_ms": summary["latency_ms"]["p50"],
+                "p99_ms": summary["latency_ms"]["p99"],
+                "error_rate": summary["error_rate"],
+            }
+            r = results[name]
+            progress(f"{name:<28} {r['rps']:>10.1f} req/s  p50 {r['p50_ms']:.2f} ms  p99 {r['p99_ms']:.2f} ms  errors {r['error_rate']:.2%}")
+    return results
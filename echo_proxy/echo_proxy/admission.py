@@ -0,0 +1,173 @@
+"""
+Admission control.
+
+Caps how many requests are handled at once, globally and per route, so a
+burst is absorbed by the proxy instead of the upstream. A request over a cap
+waits in a bounded FIFO queue; when the queue is full, or the request has
+waited ADMISSION_QUEUE_TIMEOUT seconds, it is refused right away with a 503
+and Retry-After. A finishing request hands its slot straight to the oldest
+waiter, so queued requests are served in arrival order.
+"""
+
+import os
+import json
+import time
+import asyncio
+from collections import deque
+
+from fastapi import Response
+
+from .metrics import compile_path_template, metrics
+
+# Requests handled at once across all routes (0 is unlimited)
+ADMISSION_MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", "0"))
+# Per-route caps as path template=limit pairs, e.g. "/api/search/*=10,/users/{id}=5"
+ADMISSION_ROUTE_LIMITS = os.getenv("ADMISSION_ROUTE_LIMITS", "")
+# Requests that may wait for each cap before new ones are refused
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "100"))
+# Seconds a request may wait in total before it is refused
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "1"))
+# Retry-After sent with refusals, in seconds
+ADMISSION_RETRY_AFTER = os.getenv("ADMISSION_RETRY_AFTER", "1")
+
+
+class Rejected(Exception):
+    def __init__(self, limiter: "Limiter", reason: str):
+        super().__init__(f"{limiter.name}: {reason}")
+        self.limiter = limiter
+        self.reason = reason
+
+
+class Limiter:
+    """A concurrency cap with a bounded FIFO queue of waiting requests"""
+
+    def __init__(self, name: str, capacity: int, queue_size: int = ADMISSION_QUEUE_SIZE):
+        self.name = name
+        self.capacity = capacity
+        self.queue_size = queue_size
+        self.in_use = 0
+        self.waiters = deque()
+
+    async def acquire(self, deadline: float):
+        if self.in_use < self.capacity and not self.waiters:
+            self.in_use += 1
+            return
+        if len(self.waiters) >= self.queue_size:
+            raise Rejected(self, "queue_full")
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            # The slot is handed over by release()
+            await asyncio.wait_for(waiter, max(deadline - time.monotonic(), 0))
+        except asyncio.TimeoutError:
+            if waiter.done() and not waiter.cancelled():
+                # Handed over just as the deadline passed
+                return
+            self._remove(waiter)
+            raise Rejected(self, "queue_timeout") from None
+        except BaseException:
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            else:
+                self._remove(waiter)
+            raise
+
+    def _remove(self, waiter):
+        try:
+            self.waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def release(self):
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                # in_use stays the same: the slot passes to the waiter
+                waiter.set_result(None)
+                return
+        self.in_use -= 1
+
+
+class Admission:
+    def __init__(self, max_concurrency: int = ADMISSION_MAX_CONCURRENCY, route_limits: str = ADMISSION_ROUTE_LIMITS,
+                 queue_size: int = ADMISSION_QUEUE_SIZE, queue_timeout: float = ADMISSION_QUEUE_TIMEOUT,
+                 retry_after: str = ADMISSION_RETRY_AFTER):
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.routes = []
+        for item in (i.strip() for i in route_limits.split(",")):
+            if not item:
+                continue
+            template, _, limit = item.rpartition("=")
+            if not template or not limit.isdigit():
+                raise ValueError(f"Invalid ADMISSION_ROUTE_LIMITS entry: {item!r} (expected template=limit)")
+            self.routes.append((compile_path_template(template)[0], Limiter(template, int(limit), queue_size)))
+        self.limiter = Limiter("global", max_concurrency, queue_size) if max_concurrency else None
+
+    @property
+    def enabled(self) -> bool:
+        return self.limiter is not None or bool(self.routes)
+
+    def limiters_for(self, path: str):
+        """The route cap (first matching template) and the global cap that apply to a path"""
+        limiters = []
+        for pattern, limiter in self.routes:
+            if pattern.match(path):
+                limiters.append(limiter)
+                break
+        if self.limiter is not None:
+            limiters.append(self.limiter)
+        return limiters
+
+    async def admit(self, path: str):
+        """
+        Wait for a slot under every cap that applies. Returns the limiters to
+        release and the time spent waiting; raises Rejected when refused.
+        """
+        limiters = self.limiters_for(path)
+        started = time.monotonic()
+        deadline = started + self.queue_timeout
+        acquired = []
+        try:
+            for limiter in limiters:
+                await limiter.acquire(deadline)
+                acquired.append(limiter)
+        except Rejected as e:
+            for limiter in acquired:
+                limiter.release()
+            metrics.observe_admission(e.limiter.name, time.monotonic() - started, e.reason)
+            raise
+        except BaseException:
+            for limiter in acquired:
+                limiter.release()
+            raise
+        waited = time.monotonic() - started
+        for limiter in limiters:
+            metrics.observe_admission(limiter.name, waited)
+        return acquired, waited
+
+    @staticmethod
+    def release(acquired):
+        for limiter in acquired:
+            limiter.release()
+
+    def rejection(self, error: Rejected) -> Response:
+        return Response(
+            content=json.dumps({"error": f"Too many requests in flight ({error.limiter.name} limit, {error.reason.replace('_', ' ')})"}, indent=2),
+            status_code=503,
+            headers={"content-type": "application/json", "retry-after": self.retry_after},
+        )
+
+    def gauges(self) -> dict:
+        limiters = [limiter for _, limiter in self.routes] + ([self.limiter] if self.limiter else [])
+        return {
+            "echo_proxy_admission_in_flight": (
+                "gauge", "Requests holding a slot, per limit",
+                {(("limit", l.name),): l.in_use for l in limiters}),
+            "echo_proxy_admission_queue_depth": (
+                "gauge", "Requests waiting for a slot, per limit",
+                {(("limit", l.name),): len(l.waiters) for l in limiters}),
+            "echo_proxy_admission_capacity": (
+                "gauge", "Configured concurrency cap, per limit",
+                {(("limit", l.name),): l.capacity for l in limiters}),
+        }
@@ -0,0 +1,210 @@
+"""
+Log aggregation for multi-worker mode.
+
+Each worker process formats its log records and sends them in batches over a
+multiprocessing connection to a single aggregator process. The aggregator
+holds the records of an exchange until it is complete and then writes them
+together, so the console output of concurrent workers does not interleave and
+the idle-gap separator sees requests from all workers.
+"""
+
+import os
+import sys
+import time
+import queue
+import signal
+import threading
+import multiprocessing
+from multiprocessing.connection import Client, Listener
+
+from colorama import Fore, Style
+
+from .log_pipeline import create_sinks, format_record_body
+
+# Set in worker processes: where to send log records
+LOG_AGGREGATOR_ADDRESS = os.getenv("LOG_AGGREGATOR_ADDRESS", "")
+LOG_AGGREGATOR_AUTHKEY = os.getenv("LOG_AGGREGATOR_AUTHKEY", "")
+# Seconds an incomplete exchange is held back before its records are written anyway
+LOG_GROUP_TIMEOUT = float(os.getenv("LOG_GROUP_TIMEOUT", "5"))
+
+# Record types that end an exchange
+FINAL_TYPES = {"response_body", "error", "echo", "mock_miss", "fault"}
+# Record types whose body the console shows
+BODY_TYPES = {"request", "response", "response_body", "ws_frame"}
+
+
+def is_final(record: dict) -> bool:
+    return record["type"] in FINAL_TYPES or (record["type"] == "response" and not record.get("streamed"))
+
+
+class ForwardingSink:
+    """
+    Worker-side sink that formats bodies locally and sends records to the aggregator.
+
+    Formatting stays in the workers so it scales with them; raw bodies are only
+    sent along when an aggregator sink needs them.
+    """
+
+    def __init__(self, address: str = LOG_AGGREGATOR_ADDRESS, authkey: str = LOG_AGGREGATOR_AUTHKEY,
+                 keep_body: bool = False):
+        self.connection = Client(parse_address(address), authkey=bytes.fromhex(authkey))
+        self.keep_body = keep_body
+        self.batch = []
+
+    def write(self, record: dict):
+        if record["type"] in BODY_TYPES:
+            record = dict(record, formatted_body=format_record_body(record))
+            if not self.keep_body:
+                record.pop("body", None)
+        self.batch.append(record)
+
+    def flush(self):
+        if self.batch:
+            self.connection.send((os.getpid(), self.batch))
+            self.batch = []
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+
+class LogAggregator:
+    """Writes records from all workers to the sinks, one complete exchange at a time"""
+
+    def __init__(self, sinks, group_timeout: float = LOG_GROUP_TIMEOUT):
+        self.sinks = sinks
+        self.group_timeout = group_timeout
+        # (worker pid, exchange id) -> (first seen, records), in arrival order
+        self.pending = {}
+
+    def add(self, pid: int, records):
+        for record in records:
+            key = (pid, record.get("id"))
+            if record["type"] == "request":
+                self.pending[key] = (time.monotonic(), [record])
+                continue
+            group = self.pending.get(key)
+            if group is None:
+                # The exchange timed out and was written already
+                self._write([record])
+                continue
+            group[1].append(record)
+            if is_final(record):
+                del self.pending[key]
+                self._write(group[1])
+
+    def expire(self, force: bool = False):
+        now = time.monotonic()
+        for key in list(self.pending):
+            started, records = self.pending[key]
+            if force or now - started > self.group_timeout:
+                del self.pending[key]
+                self._write(records)
+
+    def _write(self, records):
+        for sink in self.sinks:
+            for record in records:
+                try:
+                    sink.write(record)
+                except Exception as e:
+                    print(f"{Fore.RED}Log sink {type(sink).__name__} failed: {e}{Style.RESET_ALL}")
+
+    def flush(self):
+        for sink in self.sinks:
+            sink.flush()
+
+    def close(self):
+        self.expire(force=True)
+        for sink in self.sinks:
+            sink.close()
+
+
+def _receive(connection, inbox: queue.Queue):
+    try:
+        while True:
+            inbox.put(connection.recv())
+    except (EOFError, OSError):
+        pass
+    finally:
+        connection.close()
+
+
+def _accept(listener: Listener, inbox: queue.Queue, receivers: list):
+    while True:
+        try:
+            connection = listener.accept()
+        except OSError:
+            return
+        receiver = threading.Thread(target=_receive, args=(connection, inbox), daemon=True)
+        receiver.start()
+        receivers.append(receiver)
+
+
+def run_aggregator(ready, authkey: bytes, sink_names: str):
+    """Aggregator process entry point; sends its listening address through `ready`"""
+    # Ctrl+C reaches the whole process group; keep running until the parent says stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    listener = Listener(("127.0.0.1", 0), authkey=authkey)
+    ready.send(listener.address)
+    ready.close()
+    aggregator = LogAggregator(create_sinks(sink_names))
+    inbox = queue.Queue()
+    receivers = []
+    threading.Thread(target=_accept, args=(listener, inbox, receivers), daemon=True).start()
+    try:
+        while True:
+            try:
+                message = inbox.get(timeout=1)
+            except queue.Empty:
+                aggregator.expire()
+                aggregator.flush()
+                continue
+            if message is None:
+                break
+            aggregator.add(*message)
+            aggregator.expire()
+            if inbox.empty():
+                aggregator.flush()
+        # Workers have exited; take what is still buffered on their connections
+        for receiver in list(receivers):
+            receiver.join(5)
+        while not inbox.empty():
+            message = inbox.get_nowait()
+            if message is not None:
+                aggregator.add(*message)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        aggregator.close()
+        listener.close()
+
+
+def start_aggregator(sink_names: str):
+    """Start the aggregator process and export its address to the workers started after it"""
+    authkey = os.urandom(16)
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=run_aggregator, args=(sender, authkey, sink_names), daemon=True)
+    process.start()
+    host, port = receiver.recv()
+    os.environ["LOG_AGGREGATOR_ADDRESS"] = f"{host}:{port}"
+    os.environ["LOG_AGGREGATOR_AUTHKEY"] = authkey.hex()
+    return process
+
+
+def stop_aggregator(process, timeout: float = 10):
+    """Let the aggregator write what it still holds, then wait for it to exit"""
+    try:
+        connection = Client(parse_address(os.environ["LOG_AGGREGATOR_ADDRESS"]),
+                            authkey=bytes.fromhex(os.environ["LOG_AGGREGATOR_AUTHKEY"]))
+        connection.send(None)
+        connection.close()
+    except OSError as e:
+        print(f"{Fore.YELLOW}Could not reach log aggregator: {e}{Style.RESET_ALL}", file=sys.stderr)
+    process.join(timeout)
+    if process.is_alive():
+        process.terminate()
+
+
+def parse_address(address: str):
+    host, port = address.rsplit(":", 1)
+    return host, int(port)
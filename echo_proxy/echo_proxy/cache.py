@@ -0,0 +1,259 @@
+"""
+Shared response cache for GET requests.
+
+Responses are stored when the upstream allows it (Cache-Control, Expires) and
+served while fresh. Once stale, an entry with an ETag or Last-Modified is
+revalidated with a conditional request, and a 304 renews it without
+transferring the body again. The cache is an LRU bounded both by entry count
+and by total body bytes. Identical requests that miss at the same time share
+one upstream call: the first one fetches, the others wait for its result.
+
+Bodies are stored as the upstream sent them, still content-encoded, and the
+upstream's Vary header decides which request headers are part of the key.
+"""
+
+import os
+import time
+import asyncio
+from collections import Counter, OrderedDict
+from email.utils import parsedate_to_datetime
+
+import httpx
+
+from .headers import get_header
+
+# Cache GET responses from the upstream
+RESPONSE_CACHE = os.getenv("RESPONSE_CACHE", "false").lower() in ("true", "1", "yes")
+# Bounds of the cache: number of responses and total body bytes
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Seconds a response without explicit freshness information is served before revalidation
+RESPONSE_CACHE_DEFAULT_TTL = float(os.getenv("RESPONSE_CACHE_DEFAULT_TTL", "0"))
+
+# Statuses that may be stored (RFC 9110, section 15.1, cacheable by default)
+CACHEABLE_STATUSES = {200, 203, 204, 300, 301, 308, 404, 405, 410, 414, 501}
+# Not taken from a 304 when it renews a stored response
+NOT_UPDATED = {"content-length", "content-encoding", "transfer-encoding", "content-range"}
+
+
+def cache_control(headers) -> dict:
+    """Directives of all Cache-Control headers; those without a value map to True"""
+    directives = {}
+    for key, value in headers:
+        if key.lower() != "cache-control":
+            continue
+        for part in value.split(","):
+            name, _, argument = part.strip().partition("=")
+            if name:
+                directives[name.lower()] = argument.strip('"') if argument else True
+    return directives
+
+
+def _seconds(value) -> float:
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _http_date(value: str):
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+class CacheEntry:
+    """A stored response; shaped like httpx.Response where the proxy reads it"""
+
+    def __init__(self, response: httpx.Response, body: bytes, vary: tuple, lifetime: float):
+        self.status_code = response.status_code
+        self.url = response.url
+        self.headers = httpx.Headers(response.headers.multi_items())
+        self.content = body
+        self.vary = vary
+        self.lifetime = lifetime
+        self.stored = time.time()
+        self.initial_age = _seconds(response.headers.get("age"))
+        # Headers of the request that stored it, to tell whether a waiting request may share it
+        self.request_headers = []
+
+    def age(self) -> float:
+        return self.initial_age + time.time() - self.stored
+
+    def fresh(self) -> bool:
+        return self.age() < self.lifetime
+
+    def validators(self):
+        """Conditional request headers for revalidation"""
+        conditions = []
+        if "etag" in self.headers:
+            conditions.append(("if-none-match", self.headers["etag"]))
+        if "last-modified" in self.headers:
+            conditions.append(("if-modified-since", self.headers["last-modified"]))
+        return conditions
+
+    def renew(self, response: httpx.Response):
+        """
+        Apply a 304: its headers replace the stored ones and the entry is fresh
+        again. The caller recomputes the lifetime from the merged headers, since
+        a 304 often repeats none of Cache-Control, Expires or Date.
+        """
+        updated = {key.lower() for key, _ in response.headers.multi_items()} - NOT_UPDATED
+        items = [(k, v) for k, v in self.headers.multi_items() if k.lower() not in updated]
+        items += [(k, v) for k, v in response.headers.multi_items() if k.lower() in updated]
+        self.headers = httpx.Headers(items)
+        self.stored = time.time()
+        self.initial_age = _seconds(response.headers.get("age"))
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES, max_bytes: int = RESPONSE_CACHE_MAX_BYTES,
+                 default_ttl: float = RESPONSE_CACHE_DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.entries = OrderedDict()
+        self.size = 0
+        # Header names the upstream varies on, and the number of stored variants, per resource
+        self.vary = {}
+        self.variants = Counter()
+        # Resource -> future of the response being fetched for it
+        self.pending = {}
+        # Lookups by outcome, as reported in X-Proxy-Cache
+        self.outcomes = Counter()
+
+    async def fetch(self, resource: str, headers: list, send):
+        """
+        Answer a GET for `resource` (path and query) from the cache or through
+        `send(headers)`, which returns the upstream response and its raw body.
+        Returns (response, body, outcome); the response is an httpx.Response or
+        a CacheEntry, and outcome is one of HIT, MISS, REVALIDATED, COALESCED, BYPASS.
+        """
+        request_cc = cache_control(headers)
+        # A client's own conditional request is answered by the upstream
+        if "no-store" in request_cc or get_header(headers, "if-none-match") or get_header(headers, "if-modified-since"):
+            return await self._bypass(headers, send)
+        no_cache = "no-cache" in request_cc or request_cc.get("max-age") == "0" or "no-cache" in get_header(headers, "pragma")
+
+        entry = self._lookup(resource, headers)
+        if entry is not None and entry.fresh() and not no_cache:
+            self.entries.move_to_end(self._key(resource, entry.vary, headers))
+            return self._count(entry, entry.content, "HIT")
+
+        pending = self.pending.get(resource)
+        if pending is not None:
+            # Shielded so a client giving up does not cancel the shared fetch
+            shared = await asyncio.shield(pending)
+            if shared is not None and self._key(resource, shared.vary, headers) == self._key(resource, shared.vary, shared.request_headers):
+                return self._count(shared, shared.content, "COALESCED")
+            return await self._bypass(headers, send)
+
+        future = asyncio.get_running_loop().create_future()
+        self.pending[resource] = future
+        stored = None
+        try:
+            validators = entry.validators() if entry is not None else []
+            response, body = await send(headers + validators if validators else headers)
+            if response.status_code == 304 and validators:
+                entry.renew(response)
+                entry.lifetime = self._lifetime(entry)
+                key = self._key(resource, entry.vary, headers)
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                stored = entry
+                result = self._count(entry, entry.content, "REVALIDATED")
+            else:
+                stored = self._store(resource, headers, response, body)
+                result = self._count(response, body, "MISS")
+            if stored is not None:
+                stored.request_headers = headers
+            return result
+        finally:
+            self.pending.pop(resource, None)
+            # Waiting requests fetch on their own when nothing was stored
+            future.set_result(stored)
+
+    async def _bypass(self, headers, send):
+        response, body = await send(headers)
+        return self._count(response, body, "BYPASS")
+
+    def _count(self, response, body, outcome):
+        self.outcomes[outcome] += 1
+        return response, body, outcome
+
+    @staticmethod
+    def _key(resource: str, vary: tuple, headers) -> tuple:
+        return (resource,) + tuple(get_header(headers, name) for name in vary)
+
+    def _lookup(self, resource: str, headers):
+        vary = self.vary.get(resource)
+        if vary is None:
+            return None
+        return self.entries.get(self._key(resource, vary, headers))
+
+    def _lifetime(self, response) -> float:
+        """Freshness lifetime of an httpx.Response or a CacheEntry, in seconds"""
+        directives = cache_control(response.headers.multi_items())
+        if "no-cache" in directives:
+            return 0.0
+        if "s-maxage" in directives:
+            return _seconds(directives["s-maxage"])
+        if "max-age" in directives:
+            return _seconds(directives["max-age"])
+        if "expires" in response.headers:
+            expires = _http_date(response.headers["expires"])
+            date = _http_date(response.headers.get("date", "")) or time.time()
+            return max(expires - date, 0.0) if expires is not None else 0.0
+        return self.default_ttl
+
+    def _store(self, resource: str, headers, response: httpx.Response, body: bytes):
+        if response.status_code not in CACHEABLE_STATUSES or len(body) > self.max_bytes:
+            return None
+        directives = cache_control(response.headers.multi_items())
+        if "no-store" in directives or "private" in directives or "set-cookie" in response.headers:
+            return None
+        # Answers to authenticated requests are only shared when the upstream says so
+        if get_header(headers, "authorization") and not ({"public", "s-maxage", "must-revalidate"} & set(directives)):
+            return None
+        vary = tuple(sorted({v.strip().lower() for v in ",".join(response.headers.get_list("vary")).split(",") if v.strip()}))
+        if "*" in vary:
+            return None
+        lifetime = self._lifetime(response)
+        entry = CacheEntry(response, body, vary, lifetime)
+        if not lifetime and not entry.validators():
+            return None
+        if self.vary.get(resource) != vary:
+            # The upstream changed what it varies on; variants under the old key are unreachable
+            self._drop_resource(resource)
+            self.vary[resource] = vary
+        key = self._key(resource, vary, headers)
+        if key in self.entries:
+            self._remove(key)
+        self.entries[key] = entry
+        self.size += len(body)
+        self.variants[resource] += 1
+        while self.entries and (len(self.entries) > self.max_entries or self.size > self.max_bytes):
+            self._remove(next(iter(self.entries)))
+        return entry
+
+    def _remove(self, key: tuple):
+        resource = key[0]
+        self.size -= len(self.entries.pop(key).content)
+        self.variants[resource] -= 1
+        if not self.variants[resource]:
+            del self.variants[resource]
+            self.vary.pop(resource, None)
+
+    def _drop_resource(self, resource: str):
+        for key in [k for k in self.entries if k[0] == resource]:
+            self._remove(key)
+
+    def gauges(self) -> dict:
+        return {
+            "echo_proxy_cache_entries": ("gauge", "Responses in the cache", len(self.entries)),
+            "echo_proxy_cache_bytes": ("gauge", "Body bytes held by the cache", self.size),
+            "echo_proxy_cache_lookups_total": (
+                "counter", "Cacheable requests by outcome (HIT, MISS, REVALIDATED, COALESCED, BYPASS)",
+                {(("outcome", outcome),): count for outcome, count in self.outcomes.items()}),
+        }
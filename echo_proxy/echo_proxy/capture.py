@@ -0,0 +1,350 @@
+"""
+Append-only on-disk capture of proxied exchanges.
+
+Each exchange (request + response with raw body bytes) is written as one
+zlib-compressed frame appended to a segment file. Next to every segment a
+small JSON-lines index records the timestamp, method, path, status and frame
+offset, so readers can filter on those fields and decompress only the frames
+they need. Segments are rotated by size and age.
+
+Usage:
+    python -m echo_proxy.capture ./captures --path '/api/*' --status 5xx --show
+"""
+
+import os
+import sys
+import json
+import time
+import mmap
+import zlib
+import glob
+import struct
+import fnmatch
+import argparse
+from datetime import datetime
+
+from .decoding import decode_content
+from .headers import format_headers, get_header
+
+# Directory to capture exchanges to (capture is disabled when empty)
+CAPTURE_DIR = os.getenv("CAPTURE_DIR", "")
+# Start a new segment when the current one reaches this size or age
+CAPTURE_SEGMENT_MAX_BYTES = int(os.getenv("CAPTURE_SEGMENT_MAX_BYTES", str(64 * 1024 * 1024)))
+CAPTURE_SEGMENT_MAX_SECONDS = float(os.getenv("CAPTURE_SEGMENT_MAX_SECONDS", "3600"))
+# zlib level for frames: 1 is fastest, 9 is smallest
+CAPTURE_COMPRESSION_LEVEL = int(os.getenv("CAPTURE_COMPRESSION_LEVEL", "1"))
+
+# Frame header: magic and compressed payload length
+FRAME_MAGIC = b"EPX1"
+FRAME_HEADER = struct.Struct(">4sI")
+# Payload starts with the length of the JSON metadata that precedes the bodies
+META_LENGTH = struct.Struct(">I")
+
+# Requests whose response never arrives are forgotten after this many newer ones
+MAX_PENDING = 10000
+
+
+def encode_exchange(meta: dict, request_body: bytes, response_body: bytes) -> bytes:
+    meta = dict(meta, request_body_length=len(request_body), response_body_length=len(response_body))
+    meta_bytes = json.dumps(meta, ensure_ascii=False).encode("utf-8")
+    return META_LENGTH.pack(len(meta_bytes)) + meta_bytes + request_body + response_body
+
+
+def decode_exchange(payload: bytes) -> dict:
+    meta_length = META_LENGTH.unpack_from(payload)[0]
+    start = META_LENGTH.size
+    exchange = json.loads(payload[start:start + meta_length])
+    start += meta_length
+    request_end = start + exchange["request_body_length"]
+    exchange["request_body"] = payload[start:request_end]
+    exchange["response_body"] = payload[request_end:request_end + exchange["response_body_length"]]
+    return exchange
+
+
+class CaptureWriter:
+    """
+    Log pipeline sink that pairs request and response records into exchanges
+    and appends them to rotating segment files. It is lossless: the pipeline
+    never drops its records, so the capture is a faithful recording to replay
+    or mock from even when LOG_QUEUE_POLICY=drop sheds console output.
+    """
+
+    lossless = True
+
+    def __init__(self, directory: str = CAPTURE_DIR,
+                 max_bytes: int = CAPTURE_SEGMENT_MAX_BYTES,
+                 max_seconds: float = CAPTURE_SEGMENT_MAX_SECONDS,
+                 level: int = CAPTURE_COMPRESSION_LEVEL):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.level = level
+        self.pending = {}
+        self.sequence = 0
+        self.segment = None
+        self.index = None
+        self.segment_size = 0
+        self.segment_started = 0
+        self.written = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, record: dict):
+        kind = record["type"]
+        if kind == "request":
+            self.pending[record["id"]] = {"request": record}
+            if len(self.pending) > MAX_PENDING:
+                self.pending.pop(next(iter(self.pending)))
+            return
+        exchange = self.pending.get(record.get("id"))
+        if exchange is None:
+            return
+        if kind == "response":
+            exchange["response"] = record
+            # Streamed bodies follow in a response_body record
+            if not record.get("streamed"):
+                self._finish(record["id"])
+        elif kind == "response_body":
+            exchange["response_body"] = record
+            self._finish(record["id"])
+        elif kind == "error":
+            exchange["error"] = record
+            self._finish(record["id"])
+        elif kind in ("echo", "mock_miss", "fault"):
+            # Nothing came from the upstream
+            self.pending.pop(record["id"], None)
+
+    def _finish(self, exchange_id):
+        exchange = self.pending.pop(exchange_id)
+        request = exchange["request"]
+        response = exchange.get("response", {})
+        body_record = exchange.get("response_body", response)
+        error = exchange.get("error")
+        request_body = request.get("body") or b""
+        response_body = body_record.get("body") or b""
+        meta = {
+            "ts": request["time"],
+            "duration": body_record.get("time", error["time"] if error else request["time"]) - request["time"],
+            "method": request["method"],
+            "path": request["path"],
+            "query": request.get("query", ""),
+            "url": request["url"],
+            "target_url": request["target_url"],
+            "request_headers": request["headers"],
+            "request_body_size": request.get("body_size", len(request_body)),
+            "status": 502 if error else response.get("status", 0),
+            "response_headers": response.get("headers", {}),
+            "response_body_size": body_record.get("body_size", len(response_body)),
+            # Bodies are stored as sent, still content-encoded
+            "raw_bodies": True,
+        }
+        if error:
+            meta["error"] = error["message"]
+        self.append(meta, request_body, response_body)
+
+    def append(self, meta: dict, request_body: bytes, response_body: bytes):
+        frame = zlib.compress(encode_exchange(meta, request_body, response_body), self.level)
+        self._rotate_if_needed(len(frame))
+        offset = self.segment_size
+        self.segment.write(FRAME_HEADER.pack(FRAME_MAGIC, len(frame)))
+        self.segment.write(frame)
+        self.segment_size += FRAME_HEADER.size + len(frame)
+        entry = {
+            "ts": meta["ts"],
+            "method": meta["method"],
+            "path": meta["path"],
+            "status": meta["status"],
+            "offset": offset,
+            "length": FRAME_HEADER.size + len(frame),
+        }
+        self.index.write(json.dumps(entry) + "\n")
+        self.written += 1
+
+    def _rotate_if_needed(self, frame_size: int):
+        if self.segment is not None:
+            too_big = self.segment_size and self.segment_size + frame_size > self.max_bytes
+            too_old = time.time() - self.segment_started > self.max_seconds
+            if not (too_big or too_old):
+                return
+            self._close_segment()
+        self.segment_started = time.time()
+        self.sequence += 1
+        stamp = datetime.fromtimestamp(self.segment_started).strftime("%Y%m%d-%H%M%S")
+        # pid keeps segments from several proxy processes apart
+        name = os.path.join(self.directory, f"capture-{stamp}-{os.getpid()}-{self.sequence:04d}")
+        self.segment = open(name + ".seg", "ab")
+        self.index = open(name + ".idx", "a", encoding="utf-8")
+        self.segment_size = self.segment.tell()
+
+    def _close_segment(self):
+        self.segment.close()
+        self.index.close()
+        self.segment = None
+        self.index = None
+
+    def flush(self):
+        if self.segment is not None:
+            self.segment.flush()
+            self.index.flush()
+
+    def close(self):
+        if self.segment is not None:
+            self._close_segment()
+
+
+def _status_matches(status: int, wanted: str) -> bool:
+    # "500" matches exactly, "5xx" matches the class
+    wanted = wanted.lower()
+    if wanted.endswith("xx"):
+        return str(status).startswith(wanted[0])
+    return str(status) == wanted
+
+
+class CaptureReader:
+    """Reads captured exchanges, filtering on the side index before touching segment data"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def segments(self):
+        return sorted(glob.glob(os.path.join(self.directory, "capture-*.seg")))
+
+    def entries(self, path: str = None, method: str = None, status: str = None,
+                since: float = None, until: float = None):
+        """Index entries matching all given filters; path is a glob such as /api/*"""
+        for segment in self.segments():
+            for entry in self._segment_index(segment):
+                if path and not fnmatch.fnmatchcase(entry["path"], path):
+                    continue
+                if method and entry["method"] != method.upper():
+                    continue
+                if status and not _status_matches(entry["status"], status):
+                    continue
+                if since is not None and entry["ts"] < since:
+                    continue
+                if until is not None and entry["ts"] > until:
+                    continue
+                entry["segment"] = segment
+                yield entry
+
+    def exchanges(self, **filters):
+        """Matching exchanges with request_body/response_body as bytes, in capture order"""
+        segment = None
+        data = None
+        try:
+            for entry in self.entries(**filters):
+                if entry["segment"] != segment:
+                    if data is not None:
+                        data.close()
+                    segment = entry["segment"]
+                    data = self._map(segment)
+                if data is None:
+                    continue
+                yield self._read_frame(data, entry["offset"])
+        finally:
+            if data is not None:
+                data.close()
+
+    def _segment_index(self, segment: str):
+        index_path = segment[:-len(".seg")] + ".idx"
+        if not os.path.exists(index_path):
+            yield from self._scan(segment)
+            return
+        with open(index_path, encoding="utf-8") as f:
+            for line in f:
+                # A crash can leave a partial last line
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+    def _scan(self, segment: str):
+        """Rebuild index entries from the frames when the .idx file is missing"""
+        data = self._map(segment)
+        if data is None:
+            return
+        try:
+            offset = 0
+            while offset + FRAME_HEADER.size <= len(data):
+                magic, length = FRAME_HEADER.unpack_from(data, offset)
+                if magic != FRAME_MAGIC or offset + FRAME_HEADER.size + length > len(data):
+                    break
+                exchange = self._read_frame(data, offset)
+                yield {
+                    "ts": exchange["ts"],
+                    "method": exchange["method"],
+                    "path": exchange["path"],
+                    "status": exchange["status"],
+                    "offset": offset,
+                    "length": FRAME_HEADER.size + length,
+                }
+                offset += FRAME_HEADER.size + length
+        finally:
+            data.close()
+
+    @staticmethod
+    def _map(segment: str):
+        with open(segment, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return None
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @staticmethod
+    def _read_frame(data, offset: int) -> dict:
+        magic, length = FRAME_HEADER.unpack_from(data, offset)
+        if magic != FRAME_MAGIC:
+            raise ValueError(f"Bad capture frame at offset {offset}")
+        start = offset + FRAME_HEADER.size
+        return decode_exchange(zlib.decompress(data[start:start + length]))
+
+
+def _parse_time(value: str) -> float:
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def _show_body(body: bytes, headers, raw: bool) -> str:
+    from .formatter import format_body
+
+    note = ""
+    encoding = get_header(headers, "content-encoding")
+    if body and encoding and raw:
+        body, note = decode_content(body, encoding)
+    formatted = format_body(body, get_header(headers, "content-type"))
+    return f"{formatted}\n{note}" if note else formatted
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="List and show captured proxy exchanges")
+    parser.add_argument("directory", nargs="?", default=CAPTURE_DIR or ".", help="capture directory")
+    parser.add_argument("--path", help="path glob, e.g. '/api/*'")
+    parser.add_argument("--method", help="HTTP method")
+    parser.add_argument("--status", help="status code or class, e.g. 404 or 5xx")
+    parser.add_argument("--since", type=_parse_time, help="ISO time or epoch seconds")
+    parser.add_argument("--until", type=_parse_time, help="ISO time or epoch seconds")
+    parser.add_argument("--show", action="store_true", help="print headers and formatted bodies")
+    args = parser.parse_args(argv)
+
+    reader = CaptureReader(args.directory)
+    filters = dict(path=args.path, method=args.method, status=args.status, since=args.since, until=args.until)
+    if not args.show:
+        for entry in reader.entries(**filters):
+            stamp = datetime.fromtimestamp(entry["ts"]).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+            print(f"{stamp} {entry['status']:>3} {entry['method']:<7} {entry['path']}")
+        return
+
+    for exchange in reader.exchanges(**filters):
+        stamp = datetime.fromtimestamp(exchange["ts"]).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+        print(f"=== {stamp} {exchange['method']} {exchange['url']} -> {exchange['status']} ({exchange['duration'] * 1000:.1f} ms)")
+        if exchange.get("error"):
+            print(f"Error: {exchange['error']}")
+        print(f"Request headers: {format_headers(exchange['request_headers'])}")
+        print(f"Request body: {_show_body(exchange['request_body'], exchange['request_headers'], exchange.get('raw_bodies'))}")
+        print(f"Response headers: {format_headers(exchange['response_headers'])}")
+        print(f"Response body: {_show_body(exchange['response_body'], exchange['response_headers'], exchange.get('raw_bodies'))}")
+        print()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,94 @@
+"""
+Decoding of content-encoded (compressed) bodies for the log.
+
+Bodies are proxied in their encoded form; only the copy that is formatted
+for the log is decompressed, and never beyond a byte limit, so a small
+compressed body cannot expand into an unbounded amount of memory.
+"""
+
+import os
+import zlib
+
+# Max decompressed bytes produced for logging
+LOG_DECODE_LIMIT = int(os.getenv("LOG_DECODE_LIMIT", str(1024 * 1024)))
+
+try:
+    import brotli
+except ImportError:
+    try:
+        import brotlicffi as brotli
+    except ImportError:
+        brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def _inflate(body: bytes, wbits: int, limit: int):
+    decompressor = zlib.decompressobj(wbits)
+    data = decompressor.decompress(body, limit)
+    # Data left over once the limit is reached means the body was cut off
+    return data, not decompressor.unconsumed_tail
+
+
+def _deflate(body: bytes, limit: int):
+    # "deflate" is meant to be zlib-wrapped, but some servers send raw deflate
+    try:
+        return _inflate(body, zlib.MAX_WBITS, limit)
+    except zlib.error:
+        return _inflate(body, -zlib.MAX_WBITS, limit)
+
+
+def _brotli(body: bytes, limit: int):
+    if hasattr(brotli, "Decompressor") and hasattr(brotli.Decompressor, "can_accept_more_data"):
+        decompressor = brotli.Decompressor()
+        data = decompressor.process(body, output_buffer_limit=limit)
+        return data, len(data) < limit
+    # Older brotli bindings cannot stop at a limit
+    data = brotli.decompress(body)
+    return data[:limit], len(data) <= limit
+
+
+def _zstd(body: bytes, limit: int):
+    reader = zstandard.ZstdDecompressor().stream_reader(body)
+    data = reader.read(limit)
+    return data, not reader.read(1)
+
+
+DECODERS = {
+    "gzip": lambda body, limit: _inflate(body, zlib.MAX_WBITS | 16, limit),
+    "x-gzip": lambda body, limit: _inflate(body, zlib.MAX_WBITS | 16, limit),
+    "deflate": _deflate,
+}
+if brotli is not None:
+    DECODERS["br"] = _brotli
+if zstandard is not None:
+    DECODERS["zstd"] = _zstd
+
+
+def decode_content(body: bytes, encoding: str, limit: int = LOG_DECODE_LIMIT):
+    """
+    Undo a Content-Encoding (possibly a list such as "gzip, br") for logging.
+
+    Returns (data, note): the decoded bytes, and a note for the log when the
+    body could not be decoded or was cut off at `limit`; data is the body
+    unchanged when it could not be decoded.
+    """
+    codings = [c.strip().lower() for c in encoding.split(",") if c.strip() and c.strip().lower() != "identity"]
+    data = body
+    complete = True
+    # Codings are listed in the order they were applied
+    for coding in reversed(codings):
+        decoder = DECODERS.get(coding)
+        if decoder is None:
+            return body, f"[{encoding}-encoded body, not decoded]"
+        try:
+            data, done = decoder(data, limit)
+        except Exception as e:
+            return body, f"[{encoding}-encoded body could not be decoded: {e}]"
+        complete = complete and done
+    if not complete:
+        return data, f"... decoded body cut off at {limit} bytes"
+    return data, ""
@@ -0,0 +1,262 @@
+"""
+Fault injection and traffic shaping.
+
+FAULT_RULES_FILE points at a JSON list of rules. The first rule whose methods
+and path template match a request applies to it; all random draws for the
+request are made once, when it matches, so its log record shows exactly what
+was injected. All waiting is done with asyncio timers, so a delayed or
+throttled request holds no worker and costs other requests nothing.
+
+    [
+      {"path": "/api/orders/*", "methods": ["GET"], "probability": 0.5,
+       "delay": {"uniform": [0.1, 0.5]}, "ttfb": 1.0, "bandwidth": 16384},
+      {"path": "/api/pay", "error_status": 503, "error_rate": 0.2, "reset_rate": 0.05}
+    ]
+
+The rules file is reloaded when it changes, and GET/PUT /__proxy/faults reads
+or replaces the rules of the answering process without a restart.
+"""
+
+import os
+import json
+import random
+import asyncio
+import logging
+
+from colorama import Fore, Style
+from fastapi import Response
+from fastapi.responses import StreamingResponse
+
+from .metrics import compile_path_template
+
+# JSON file with the fault rules (disabled when empty)
+FAULT_RULES_FILE = os.getenv("FAULT_RULES_FILE", "")
+# Seconds between checks of the rules file for changes
+FAULT_RELOAD_INTERVAL = float(os.getenv("FAULT_RELOAD_INTERVAL", "2"))
+
+FAULTS_PATH = "/__proxy/faults"
+
+RULE_FIELDS = {
+    "path", "methods", "probability", "delay", "ttfb", "bandwidth",
+    "error_status", "error_rate", "error_body", "reset_rate", "reset_after",
+}
+DISTRIBUTIONS = {
+    "uniform": random.uniform,
+    "normal": random.gauss,
+    "lognormal": random.lognormvariate,
+    "exponential": lambda mean: random.expovariate(1 / mean),
+}
+
+
+class FaultReset(Exception):
+    """Raised from a response body to drop the client connection"""
+
+
+class _HideInjectedResets(logging.Filter):
+    # uvicorn logs an exception that closes a connection; an injected reset is not an error
+    def filter(self, record):
+        error = record.exc_info[1] if record.exc_info else None
+        while error is not None:
+            if isinstance(error, FaultReset):
+                return False
+            nested = getattr(error, "exceptions", None)
+            error = nested[0] if nested else None
+        return True
+
+
+logging.getLogger("uvicorn.error").addFilter(_HideInjectedResets())
+
+
+def parse_delay(value):
+    """A delay in seconds: a number, or {"uniform": [lo, hi]}, {"normal": [mean, stddev]}, {"lognormal": [mu, sigma]}, {"exponential": mean}"""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        seconds = float(value)
+        return lambda: seconds
+    if isinstance(value, dict) and len(value) == 1:
+        name, args = next(iter(value.items()))
+        draw = DISTRIBUTIONS.get(name)
+        if draw is None:
+            raise ValueError(f"Unknown delay distribution: {name} (use one of {', '.join(DISTRIBUTIONS)})")
+        args = args if isinstance(args, list) else [args]
+        draw(*args)
+        return lambda: max(draw(*args), 0.0)
+    raise ValueError(f"Invalid delay: {value!r}")
+
+
+class FaultRule:
+    def __init__(self, spec: dict):
+        unknown = set(spec) - RULE_FIELDS
+        if unknown:
+            raise ValueError(f"Unknown fault rule fields: {', '.join(sorted(unknown))}")
+        self.spec = spec
+        self.path = spec.get("path", "/*")
+        self.pattern = compile_path_template(self.path)[0]
+        self.methods = {m.upper() for m in spec.get("methods", [])}
+        self.probability = float(spec.get("probability", 1.0))
+        self.delay = parse_delay(spec.get("delay"))
+        self.ttfb = parse_delay(spec.get("ttfb"))
+        # Response body bytes per second
+        self.bandwidth = float(spec.get("bandwidth", 0))
+        self.error_status = int(spec.get("error_status", 0))
+        self.error_rate = float(spec.get("error_rate", 1.0 if self.error_status else 0.0))
+        self.error_body = spec.get("error_body", "Injected fault")
+        self.reset_rate = float(spec.get("reset_rate", 0.0))
+        # Body bytes sent before a reset (0 drops the connection right after the headers)
+        self.reset_after = int(spec.get("reset_after", 0))
+
+    def matches(self, method: str, path: str) -> bool:
+        return (not self.methods or method in self.methods) and bool(self.pattern.match(path))
+
+
+class Fault:
+    """What a rule injects into one request, with its random draws made"""
+
+    def __init__(self, rule: FaultRule):
+        self.rule = rule
+        self.delay = rule.delay() if rule.delay else 0.0
+        self.ttfb = rule.ttfb() if rule.ttfb else 0.0
+        self.bandwidth = rule.bandwidth
+        self.status = rule.error_status if rule.error_rate and random.random() < rule.error_rate else 0
+        self.reset = not self.status and rule.reset_rate and random.random() < rule.reset_rate
+
+    def describe(self) -> list:
+        actions = []
+        if self.status:
+            actions.append(f"error {self.status}")
+        if self.delay:
+            actions.append(f"delay {self.delay * 1000:.0f}ms")
+        if self.ttfb and not self.status:
+            actions.append(f"ttfb +{self.ttfb * 1000:.0f}ms")
+        if self.bandwidth and not self.status:
+            actions.append(f"bandwidth {self.bandwidth / 1024:.1f} KiB/s")
+        if self.reset:
+            actions.append(f"reset after {self.rule.reset_after} bytes")
+        return actions
+
+    def error_response(self) -> Response:
+        return Response(
+            content=json.dumps({"error": self.rule.error_body}, indent=2),
+            status_code=self.status,
+            headers={"content-type": "application/json"}
+        )
+
+    async def shape(self, response: Response, timer) -> Response:
+        """Hold back the response headers for the ttfb delay, then throttle or cut off the body"""
+        if self.ttfb:
+            await asyncio.sleep(self.ttfb)
+        if not self.bandwidth and not self.reset:
+            return response
+        if isinstance(response, StreamingResponse):
+            body = response.body_iterator
+        else:
+            body = _single(response.body)
+            timer.response_bytes = len(response.body)
+        shaped = StreamingResponse(self._body(body, timer, response.status_code), status_code=response.status_code)
+        shaped.raw_headers = response.raw_headers
+        shaped.background = response.background
+        return shaped
+
+    async def _body(self, chunks, timer, status: int):
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        sent = 0
+        # Small slices so a throttled body flows evenly instead of in bursts
+        slice_size = max(int(self.bandwidth / 20), 512) if self.bandwidth else None
+        try:
+            async for chunk in chunks:
+                for start in range(0, len(chunk), slice_size or len(chunk) or 1):
+                    part = chunk[start:start + slice_size] if slice_size else chunk
+                    if self.reset and sent + len(part) > self.rule.reset_after:
+                        yield part[:self.rule.reset_after - sent]
+                        raise FaultReset()
+                    if self.bandwidth:
+                        # Sleep until this slice is due at the configured rate, counting its own bytes
+                        wait = started + (sent + len(part)) / self.bandwidth - loop.time()
+                        if wait > 0:
+                            await asyncio.sleep(wait)
+                    yield part
+                    sent += len(part)
+            if self.reset:
+                raise FaultReset()
+        finally:
+            # Let an upstream stream cut off by a reset release its connection now
+            if hasattr(chunks, "aclose"):
+                await chunks.aclose()
+            timer.finish(status)
+
+
+async def _single(body: bytes):
+    yield body
+
+
+class FaultRules:
+    def __init__(self, path: str = FAULT_RULES_FILE):
+        self.path = path
+        self.rules = []
+        self.mtime = None
+        self.task = None
+
+    def match(self, method: str, path: str):
+        """The fault to inject into this request, or None"""
+        for rule in self.rules:
+            if rule.matches(method, path):
+                if rule.probability < 1 and random.random() >= rule.probability:
+                    return None
+                return Fault(rule)
+        return None
+
+    def replace(self, specs):
+        """Swap in new rules; raises ValueError and keeps the old ones if any rule is invalid"""
+        if not isinstance(specs, list) or not all(isinstance(s, dict) for s in specs):
+            raise ValueError("Fault rules must be a JSON list of objects")
+        try:
+            self.rules = [FaultRule(spec) for spec in specs]
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Invalid fault rule: {e}") from e
+
+    def specs(self) -> list:
+        return [rule.spec for rule in self.rules]
+
+    def reload(self):
+        """Load the rules file if it changed since the last load"""
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError as e:
+            if self.mtime is not None:
+                print(f"{Fore.YELLOW}Fault rules file {self.path} is unreadable, keeping the current rules: {e}{Style.RESET_ALL}")
+                self.mtime = None
+            return
+        if mtime == self.mtime:
+            return
+        self.mtime = mtime
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                self.replace(json.load(f))
+        except (OSError, ValueError) as e:
+            print(f"{Fore.YELLOW}Fault rules in {self.path} not loaded, keeping the current rules: {e}{Style.RESET_ALL}")
+            return
+        print(f"{Fore.MAGENTA}Loaded {len(self.rules)} fault rules from {self.path}{Style.RESET_ALL}")
+
+    def start(self, interval: float = FAULT_RELOAD_INTERVAL):
+        if self.path:
+            self.reload()
+            self.task = asyncio.create_task(self._watch(interval))
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def _watch(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            self.reload()
+
+
+fault_rules = FaultRules()
@@ -1,53 +1,312 @@
+import os
 import json
 import base64
+import pickle
+import threading
 import warnings
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+
+from .pretty import render_limited, iter_json, iter_xml, iter_text
+from .typedef_cache import typedef_cache
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # Suppress the pkg_resources deprecation warning from old protobuf versions
 warnings.filterwarnings("ignore", category=UserWarning, module="google.protobuf")
 
+# Third-party formatters register under this entry point group, named by MIME type:
+#   [project.entry-points."echo_proxy.formatters"]
+#   "application/msgpack" = "my_package.formatters:format_msgpack"
+ENTRY_POINT_GROUP = "echo_proxy.formatters"
+
+# Bytes inspected when guessing the format of a body without a known content type
+SNIFF_BYTES = 64
+
+# Bodies larger than this are formatted incrementally within the output budget below
+FORMAT_STREAM_THRESHOLD = int(os.getenv("FORMAT_STREAM_THRESHOLD", str(256 * 1024)))
+# Output budget for large bodies (0 means no limit)
+FORMAT_MAX_BYTES = int(os.getenv("FORMAT_MAX_BYTES", str(1024 * 1024)))
+FORMAT_MAX_LINES = int(os.getenv("FORMAT_MAX_LINES", "0"))
+
+# Worker processes for expensive formatters (0 keeps formatting in-process)
+FORMAT_PROCESS_POOL_SIZE = int(os.getenv("FORMAT_PROCESS_POOL_SIZE", "0"))
+# Formatters run in the pool: comma-separated protobuf, json, xml, text, or "all"
+FORMAT_OFFLOAD = {name.strip() for name in os.getenv("FORMAT_OFFLOAD", "protobuf").lower().split(",")}
+# Seconds to wait for a pooled formatter before logging a base64 preview instead
+FORMAT_TIMEOUT = float(os.getenv("FORMAT_TIMEOUT", "2"))
 
-def format_body(body: bytes, content_type: str = "") -> str:
+# Exact MIME type -> formatter, e.g. "application/json"
+_formatters = {}
+# Structured syntax suffix -> formatter, e.g. "+json" for "application/vnd.api+json"
+_suffix_formatters = {}
+# Keyword anywhere in the MIME type -> formatter, checked in registration order
+_keyword_formatters = {}
+
+_entry_points_loaded = False
+_entry_points_lock = threading.Lock()
+
+_process_pool = None
+_process_pool_size = 0
+# Futures that timed out and may still hold a worker; guarded by _process_pool_lock
+_stuck = []
+_process_pool_lock = threading.Lock()
+
+
+def format_body(body: bytes, content_type: str = "", endpoint: str = "") -> str:
     """
     Format body content based on content type.
     Returns a human-readable string representation.
-    
+
     Args:
         body: Raw body bytes
         content_type: MIME type from headers (e.g., 'application/json')
-    
+        endpoint: Where the body was seen (e.g., 'response POST /api/items'),
+            used to reuse the protobuf layout inferred for earlier messages
+
     Returns:
         Formatted string representation of the body
     """
     if not body:
         return ""
-    
-    content_type = content_type.lower()
-    
-    # Try protobuf first if content type matches
-    if "protobuf" in content_type:
-        return _format_protobuf(body)
-    
-    # Try to decode as text
+
+    if not _entry_points_loaded:
+        _load_entry_points()
+
+    formatter = _resolve(content_type) or _sniff(body)
     try:
-        text = body.decode('utf-8')
+        if formatter is _format_protobuf:
+            mime_type = content_type.split(";", 1)[0].strip().lower()
+            return _format_protobuf(body, f"{endpoint} {mime_type}" if endpoint else "")
+        return _call(formatter, body)
+    except FutureTimeoutError:
+        return f"<formatting timed out after {FORMAT_TIMEOUT}s>\n{_format_binary(body)}"
+    except BrokenProcessPool as e:
+        return f"<formatter process failed: {e}>\n{_format_binary(body)}"
+
+
+def start_process_pool(size: int = FORMAT_PROCESS_POOL_SIZE):
+    """Start worker processes for the formatters listed in FORMAT_OFFLOAD"""
+    global _process_pool, _process_pool_size
+    if size > 0 and _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=size)
+        _process_pool_size = size
+
+
+def stop_process_pool():
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is not None:
+            _kill_pool(_process_pool)
+            _process_pool = None
+        _stuck.clear()
+
+
+def _kill_pool(pool: ProcessPoolExecutor):
+    """Shut a pool down without waiting for its workers, terminating any still running"""
+    if hasattr(pool, "terminate_workers"):
+        # Python 3.14+
+        pool.terminate_workers()
+        return
+    # cancel() cannot stop a task a worker already runs, so the workers are terminated
+    for process in list((getattr(pool, "_processes", None) or {}).values()):
+        process.terminate()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _timed_out(pool: ProcessPoolExecutor, future):
+    """
+    Note a task that outlived FORMAT_TIMEOUT. Once such tasks hold half of the
+    workers, the pool is replaced and its workers killed, so runaway formatters
+    cannot starve it; other tasks still running there log a base64 preview.
+    """
+    global _process_pool
+    with _process_pool_lock:
+        # A pool already replaced has had its workers killed
+        if future.cancel() or pool is not _process_pool:
+            return
+        _stuck[:] = [f for f in _stuck if not f.done()] + [future]
+        if len(_stuck) < max(1, _process_pool_size // 2):
+            return
+        _kill_pool(_process_pool)
+        _process_pool = ProcessPoolExecutor(max_workers=_process_pool_size)
+        _stuck.clear()
+
+
+def _is_offloaded(func) -> bool:
+    if "all" not in FORMAT_OFFLOAD and _BUILTIN_NAMES.get(func) not in FORMAT_OFFLOAD:
+        return False
+    # Formatters that cannot be sent to a worker (e.g. lambdas) run in this process
+    return _picklable(func)
+
+
+@lru_cache(maxsize=256)
+def _picklable(func) -> bool:
+    try:
+        pickle.dumps(func)
+    except (pickle.PicklingError, AttributeError, TypeError):
+        return False
+    return True
+
+
+def _call(func, *args):
+    """
+    Run a formatting function, in a worker process if it is offloaded.
+
+    Raises concurrent.futures.TimeoutError after FORMAT_TIMEOUT; errors raised
+    by the formatter itself propagate.
+    """
+    pool = _process_pool
+    if pool is None or not _is_offloaded(func):
+        return func(*args)
+    try:
+        future = pool.submit(func, *args)
+    except RuntimeError:
+        # The pool was replaced after a timeout just now; use the new one
+        pool = _process_pool
+        if pool is None:
+            return func(*args)
+        future = pool.submit(func, *args)
+    try:
+        return future.result(timeout=FORMAT_TIMEOUT)
+    except FutureTimeoutError:
+        _timed_out(pool, future)
+        raise
+
+
+def register_formatter(mime_type: str, formatter):
+    """
+    Register a formatter for a MIME type.
+
+    Args:
+        mime_type: Exact type ("application/msgpack") or structured suffix ("+cbor")
+        formatter: Callable taking the raw body bytes and returning a string
+    """
+    mime_type = mime_type.strip().lower()
+    if mime_type.startswith("+"):
+        _suffix_formatters[mime_type] = formatter
+    else:
+        _formatters[mime_type] = formatter
+    _resolve.cache_clear()
+
+
+def _register_keyword(keyword: str, formatter):
+    _keyword_formatters[keyword] = formatter
+    _resolve.cache_clear()
+
+
+@lru_cache(maxsize=1024)
+def _resolve(content_type: str):
+    """Find the formatter for a Content-Type header value, or None to sniff the body"""
+    mime_type = content_type.split(";", 1)[0].strip().lower()
+    if not mime_type:
+        return None
+
+    formatter = _formatters.get(mime_type)
+    if formatter is not None:
+        return formatter
+
+    if "+" in mime_type:
+        formatter = _suffix_formatters.get("+" + mime_type.rsplit("+", 1)[1])
+        if formatter is not None:
+            return formatter
+
+    for keyword, formatter in _keyword_formatters.items():
+        if keyword in mime_type:
+            return formatter
+    return None
+
+
+def _sniff(body: bytes):
+    """Guess the format from the first few bytes of the body"""
+    head = body[:SNIFF_BYTES].lstrip()
+    if head.startswith((b"{", b"[")):
+        return _format_json
+    if head.startswith(b"<"):
+        return _format_xml
+    return _format_text
+
+
+def _load_entry_points():
+    global _entry_points_loaded
+    with _entry_points_lock:
+        if _entry_points_loaded:
+            return
+        _entry_points_loaded = True
+        try:
+            from importlib.metadata import entry_points
+            eps = entry_points()
+            # Python 3.9 returns a dict of groups, 3.10+ supports select()
+            group = eps.select(group=ENTRY_POINT_GROUP) if hasattr(eps, "select") else eps.get(ENTRY_POINT_GROUP, [])
+        except Exception:
+            return
+        for ep in group:
+            try:
+                register_formatter(ep.name, ep.load())
+            except Exception as e:
+                warnings.warn(f"Failed to load formatter {ep.name!r} from {ep.value}: {e}")
+
+
+def _is_large(body: bytes) -> bool:
+    return len(body) > FORMAT_STREAM_THRESHOLD
+
+
+def _render_large(chunks, body: bytes) -> str:
+    return render_limited(chunks, len(body), FORMAT_MAX_BYTES, FORMAT_MAX_LINES)
+
+
+def _format_binary(body: bytes) -> str:
+    if _is_large(body) and FORMAT_MAX_BYTES:
+        # base64 takes 4 output bytes for every 3 input bytes
+        shown = FORMAT_MAX_BYTES * 3 // 4
+        if len(body) > shown:
+            return f"<binary data, base64: {base64.b64encode(body[:shown]).decode()}>\n... {len(body) - shown} bytes truncated"
+    return f"<binary data, base64: {base64.b64encode(body).decode()}>"
+
+
+def _format_text(body: bytes) -> str:
+    """Plain text, or base64 for binary data"""
+    if _is_large(body):
+        # Only the start decides text vs binary, the rest is decoded leniently
+        if not _looks_like_text(body[:4096]):
+            return _format_binary(body)
+        return _render_large(iter_text(body), body)
+    try:
+        return body.decode('utf-8')
     except UnicodeDecodeError:
-        # Binary data - return base64
-        return f"<binary data, base64: {base64.b64encode(body).decode()}>"
-    
-    # Format JSON
-    if "json" in content_type or text.strip().startswith(("{", "[")):
-        return _format_json(text)
-    
-    # Format XML
-    if "xml" in content_type or text.strip().startswith("<"):
-        return _format_xml(text)
-    
-    # Plain text
-    return text
-
-
-def _format_json(text: str) -> str:
+        return _format_binary(body)
+
+
+def _looks_like_text(head: bytes) -> bool:
+    if b"\x00" in head:
+        return False
+    try:
+        head.decode('utf-8')
+        return True
+    except UnicodeDecodeError as e:
+        # A multi-byte character cut off at the end of the slice is still text
+        return e.reason == "unexpected end of data"
+
+
+def _format_json(body: bytes) -> str:
     """Pretty print JSON"""
+    if _is_large(body):
+        # Re-indent the token stream instead of building the object tree
+        return _render_large(iter_json(body), body)
+    if orjson is not None:
+        try:
+            return orjson.dumps(orjson.loads(body), option=orjson.OPT_INDENT_2).decode()
+        except (ValueError, TypeError):
+            # Invalid JSON, or values orjson does not support (NaN, huge ints) - let json decide
+            pass
+    try:
+        text = body.decode('utf-8')
+    except UnicodeDecodeError:
+        return _format_binary(body)
     try:
         data = json.loads(text)
         return json.dumps(data, indent=2, ensure_ascii=False)
@@ -55,8 +314,15 @@ def _format_json(text: str) -> str:
         return text
 
 
-def _format_xml(text: str) -> str:
+def _format_xml(body: bytes) -> str:
     """Pretty print XML"""
+    if _is_large(body):
+        # Re-indent from pull-parser events instead of building a DOM
+        return _render_large(iter_xml(body), body)
+    try:
+        text = body.decode('utf-8')
+    except UnicodeDecodeError:
+        return _format_binary(body)
     try:
         import xml.dom.minidom
         dom = xml.dom.minidom.parseString(text)
@@ -65,17 +331,53 @@ def _format_xml(text: str) -> str:
         return text
 
 
-def _format_protobuf(body: bytes) -> str:
+def _format_protobuf(body: bytes, cache_key: str = "") -> str:
     """Decode protobuf to JSON-like format"""
+    typedef = typedef_cache.get(cache_key) if cache_key else None
     try:
-        import blackboxprotobuf
-        decoded, message_type = blackboxprotobuf.protobuf_to_json(body)
-        # Pretty print the JSON output
-        data = json.loads(decoded)
-        return f"<protobuf decoded>\n{json.dumps(data, indent=2, ensure_ascii=False)}"
+        decoded, message_type = _call(_decode_protobuf, body, typedef)
     except ImportError:
         # blackboxprotobuf not installed
         return f"<protobuf - install blackboxprotobuf to decode>\n{base64.b64encode(body).decode()}"
+    except (FutureTimeoutError, BrokenProcessPool):
+        raise
     except Exception as e:
         # Failed to decode
         return f"<protobuf decode failed: {e}>\n{base64.b64encode(body).decode()}"
+    if cache_key:
+        typedef_cache.put(cache_key, message_type)
+    return f"<protobuf decoded>\n{decoded}"
+
+
+def _decode_protobuf(body: bytes, typedef: dict = None):
+    """Decode against a known typedef, inferring the layout from scratch if it no longer fits"""
+    import blackboxprotobuf
+    # protobuf_to_json already returns indented JSON
+    if typedef is not None:
+        try:
+            return blackboxprotobuf.protobuf_to_json(body, typedef)
+        except Exception:
+            pass
+    return blackboxprotobuf.protobuf_to_json(body)
+
+
+# Names used by FORMAT_OFFLOAD
+_BUILTIN_NAMES = {
+    _decode_protobuf: "protobuf",
+    _format_json: "json",
+    _format_xml: "xml",
+    _format_text: "text",
+}
+
+register_formatter("application/json", _format_json)
+register_formatter("+json", _format_json)
+register_formatter("application/xml", _format_xml)
+register_formatter("text/xml", _format_xml)
+register_formatter("+xml", _format_xml)
+register_formatter("application/x-protobuf", _format_protobuf)
+register_formatter("application/protobuf", _format_protobuf)
+
+# Anything else that mentions these formats, e.g. "application/grpc-web+protobuf"
+_register_keyword("protobuf", _format_protobuf)
+_register_keyword("json", _format_json)
+_register_keyword("xml", _format_xml)
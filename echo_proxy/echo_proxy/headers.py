@@ -0,0 +1,52 @@
+"""
+Header helpers.
+
+Headers are kept as lists of (name, value) pairs so repeated headers such as
+set-cookie survive proxying, capture and replay. Captures written before that
+stored plain dicts, which the helpers accept as well.
+"""
+
+# Connection-specific headers that must not be forwarded (RFC 9110, section 7.6.1)
+HOP_BY_HOP = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization", "proxy-connection",
+    "te", "trailer", "trailers", "transfer-encoding", "upgrade",
+}
+
+
+def header_items(headers):
+    """(name, value) pairs from a list of pairs or a dict"""
+    if isinstance(headers, dict):
+        return list(headers.items())
+    return [tuple(pair) for pair in headers]
+
+
+def get_header(headers, name: str, default: str = "") -> str:
+    """First value of a header, matched case-insensitively"""
+    name = name.lower()
+    for key, value in header_items(headers):
+        if key.lower() == name:
+            return value
+    return default
+
+
+def end_to_end(headers, skip=()):
+    """
+    Drop hop-by-hop headers, including those the Connection header names,
+    and any listed in `skip` (lowercase).
+    """
+    items = header_items(headers)
+    dropped = set(HOP_BY_HOP) | set(skip)
+    for key, value in items:
+        if key.lower() == "connection":
+            dropped.update(token.strip().lower() for token in value.split(","))
+    return [(key, value) for key, value in items if key.lower() not in dropped]
+
+
+def encode_headers(headers):
+    """Raw ASGI header list for Response.raw_headers"""
+    return [(key.lower().encode("latin-1"), value.encode("latin-1")) for key, value in header_items(headers)]
+
+
+def format_headers(headers) -> str:
+    """Dict-like rendering that keeps repeated headers"""
+    return "{" + ", ".join(f"{key!r}: {value!r}" for key, value in header_items(headers)) + "}"
@@ -0,0 +1,75 @@
+import math
+
+
+class Histogram:
+    """
+    Log-linear histogram of non-negative integers in the style of HdrHistogram.
+
+    Values below 2 * 10**significant_digits are counted exactly; above that,
+    every power-of-two range is split into the same number of buckets, so any
+    recorded value is reported within a fixed relative error (about 0.4% for
+    two significant digits) while memory stays proportional to the number of
+    distinct buckets used.
+    """
+
+    def __init__(self, significant_digits: int = 2):
+        self.bits = math.ceil(math.log2(2 * 10 ** significant_digits))
+        self.sub_buckets = 1 << self.bits
+        self.half = self.sub_buckets // 2
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def record(self, value: int, count: int = 1):
+        value = max(int(value), 0)
+        index = self._index(value)
+        self.counts[index] = self.counts.get(index, 0) + count
+        self.count += count
+        self.total += value * count
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other: "Histogram"):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        if other.count:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def percentile(self, percent: float) -> int:
+        """Value at or below which `percent` of the recorded values fall"""
+        if not self.count:
+            return 0
+        if percent >= 100:
+            return self.max
+        rank = max(math.ceil(self.count * percent / 100), 1)
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                low, width = self._bucket(index)
+                # Report the middle of the bucket, but never outside what was recorded
+                return min(max(low + (width - 1) // 2, self.min), self.max)
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def _index(self, value: int) -> int:
+        if value < self.sub_buckets:
+            return value
+        shift = value.bit_length() - self.bits
+        return self.sub_buckets + (shift - 1) * self.half + ((value >> shift) - self.half)
+
+    def _bucket(self, index: int):
+        """Lowest value and width of a bucket"""
+        if index < self.sub_buckets:
+            return index, 1
+        shift = (index - self.sub_buckets) // self.half + 1
+        mantissa = (index - self.sub_buckets) % self.half + self.half
+        return mantissa << shift, 1 << shift
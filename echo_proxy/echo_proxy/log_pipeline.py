@@ -0,0 +1,333 @@
+import os
+import sys
+import json
+import time
+import base64
+import asyncio
+from datetime import datetime
+from colorama import Fore, Back, Style
+
+from .formatter import format_body
+from .metrics import metrics
+from .decoding import decode_content
+from .headers import format_headers
+from .tracing import describe_timing
+
+# Max records waiting to be rendered
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# What to do when the queue is full: "block" the request until there is room, or "drop" the record
+LOG_QUEUE_POLICY = os.getenv("LOG_QUEUE_POLICY", "block").lower()
+# Comma-separated list of sinks: console, jsonl, none
+LOG_SINK = os.getenv("LOG_SINK", "console").lower()
+# Where the jsonl sink writes (default is stdout)
+LOG_FILE = os.getenv("LOG_FILE", "")
+
+# Max records rendered per hand-off to the worker thread
+BATCH_SIZE = 256
+
+
+def _timestamp(epoch: float) -> str:
+    return datetime.fromtimestamp(epoch).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+
+
+def format_record_body(record: dict) -> str:
+    """Format the body of a request/response record, noting any part that was not captured"""
+    # Records from worker processes arrive already formatted
+    if "formatted_body" in record:
+        return record["formatted_body"]
+    body = record.get("body") or b""
+    body_size = record.get("body_size", len(body))
+    # Request and response bodies of one endpoint have different protobuf layouts
+    direction = record.get("direction") or ("request" if record["type"] == "request" else "response")
+    endpoint = f"{direction} {record['method']} {record['path']}" if record.get("path") else ""
+    started = time.perf_counter()
+    # Bodies are proxied as sent; only this logging copy is decompressed
+    note = ""
+    if body and record.get("content_encoding"):
+        body, note = decode_content(body, record["content_encoding"])
+    formatted = format_body(body, record.get("content_type", ""), endpoint)
+    if record.get("path"):
+        metrics.observe_format(record["method"], record["path"], time.perf_counter() - started)
+    if note:
+        formatted += f"\n{note}"
+    logged = len(record.get("body") or b"")
+    if body_size > logged:
+        formatted += f"\n... {body_size - logged} more bytes not logged ({body_size} total)"
+    return formatted
+
+
+def _timing_line(record: dict) -> str:
+    return f"{Style.DIM}Timing:{Style.RESET_ALL} {Fore.WHITE}{describe_timing(record['timing'])}{Style.RESET_ALL}"
+
+
+class ConsoleSink:
+    """Renders records as the colored console output"""
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+        # Track last request time for smart spacing
+        self.last_request_time = None
+
+    def write(self, record: dict):
+        render = getattr(self, f"_render_{record['type']}", None)
+        if render is None:
+            return
+        lines = render(record)
+        if lines:
+            self.stream.write("\n".join(lines) + "\n")
+
+    def flush(self):
+        self.stream.flush()
+
+    def close(self):
+        self.flush()
+
+    def _render_request(self, record: dict):
+        lines = []
+        # Smart spacing: add separator if more than a minute has passed
+        if self.last_request_time is not None and record["time"] - self.last_request_time > 60:
+            lines.append("\n\n\n----------------------------------------------------------------------\n\n")
+        self.last_request_time = record["time"]
+
+        lines.append(f"\n\n\n{Back.BLUE}{Fore.WHITE} INCOMING REQUEST {Style.RESET_ALL} {Fore.CYAN}{_timestamp(record['time'])}{Style.RESET_ALL}")
+        lines.append(f"{Style.DIM}URL:{Style.RESET_ALL} {Fore.WHITE}{record['url']}{Style.RESET_ALL}")
+        lines.append(f"{Style.DIM}Target URL:{Style.RESET_ALL} {Fore.CYAN}{record['target_url']}{Style.RESET_ALL}")
+        lines.append(f"{Style.DIM}Method:{Style.RESET_ALL} {Fore.YELLOW}{record['method']}{Style.RESET_ALL}")
+        lines.append(f"{Style.DIM}Headers:{Style.RESET_ALL} {Fore.WHITE}{format_headers(record['headers'])}{Style.RESET_ALL}")
+        if record.get("faults"):
+            lines.append(f"{Style.DIM}Injected faults:{Style.RESET_ALL} {Fore.MAGENTA}{', '.join(record['faults'])}{Style.RESET_ALL}")
+        lines.append(f"{Style.DIM}Body:{Style.RESET_ALL} {Fore.WHITE}{format_record_body(record)}{Style.RESET_ALL}")
+        return lines
+
+    def _render_echo(self, record: dict):
+        lines = [
+            f"\n{Back.MAGENTA}{Fore.WHITE} ECHO RESPONSE {Style.RESET_ALL} {Fore.CYAN}{_timestamp(record['time'])}{Style.RESET_ALL}",
+            f"{Fore.GREEN}Status: 200 OK{Style.RESET_ALL}",
+            f"{Style.DIM}Echoing request without forwarding{Style.RESET_ALL}",
+        ]
+        if record.get("timing"):
+            lines.append(_timing_line(record))
+        return lines
+
+    def _render_mock_miss(self, record: dict):
+        return [
+            f"\n{Back.MAGENTA}{Fore.WHITE} MOCK MISS {Style.RESET_ALL} {Fore.CYAN}{_timestamp(record['time'])}{Style.RESET_ALL}",
+            f"{Fore.YELLOW}Status: 404 (no recorded response matches this request){Style.RESET_ALL}",
+        ]
+
+    def _render_fault(self, record: dict):
+        return [
+            f"\n{Back.MAGENTA}{Fore.WHITE} INJECTED ERROR {Style.RESET_ALL} {Fore.CYAN}{_timestamp(record['time'])}{Style.RESET_ALL}",
+            f"{Fore.RED}Status: {record['status']}{Style.RESET_ALL} {Style.DIM}(fault rule, not forwarded){Style.RESET_ALL}",
+        ]
+
+    def _render_response(self, record: dict):
+        # Color status code based on HTTP status
+        status = record["status"]
+        status_color = Fore.GREEN if 200 <= status < 300 else Fore.YELLOW if 300 <= status < 400 else Fore.RED
+        lines = [
+            f"\n{Back.GREEN}{Fore.WHITE} OUTGOING RESPONSE {Style.RESET_ALL} {Fore.CYAN}{_timestamp(record['time'])}{Style.RESET_ALL}",
+            f"{Style.DIM}Status:{Style.RESET_ALL} {status_color}{status}{Style.RESET_ALL}",
+            f"{Style.DIM}URL:{Style.RESET_ALL} {Fore.WHITE}{record['url']}{Style.RESET_ALL}",
+            f"{Style.DIM}Headers:{Style.RESET_ALL} {Fore.WHITE}{format_headers(record['headers'])}{Style.RESET_ALL}",
+        ]
+        if record.get("cache"):
+            lines.append(f"{Style.DIM}Cache:{Style.RESET_ALL} {Fore.MAGENTA}{record['cache']}{Style.RESET_ALL}")
+        if record.get("timing"):
+            lines.append(_timing_line(record))
+        # Streamed bodies arrive later as a separate response_body record
+        if not record.get("streamed"):
+            lines.append(f"{Style.DIM}Body:{Style.RESET_ALL} {Fore.WHITE}{format_record_body(record)}{Style.RESET_ALL}")
+        return lines
+
+    def _render_response_body(self, record: dict):
+        lines = [
+            f"\n{Style.DIM}Streamed response body ({record['body_size']} bytes, {_timestamp(record['time'])}):{Style.RESET_ALL} {Fore.WHITE}{format_record_body(record)}{Style.RESET_ALL}",
+        ]
+        if record.get("timing"):
+            lines.append(_timing_line(record))
+        return lines
+
+    def _render_ws_open(self, record: dict):
+        lines = [
+            f"\n\n\n{Back.BLUE}{Fore.WHITE} WEBSOCKET OPEN {Style.RESET_ALL} {Fore.CYAN}{_timestamp(record['time'])}{Style.RESET_ALL}",
+            f"{Style.DIM}URL:{Style.RESET_ALL} {Fore.WHITE}{record['url']}{Style.RESET_ALL}",
+            f"{Style.DIM}Target URL:{Style.RESET_ALL} {Fore.CYAN}{record['target_url']}{Style.RESET_ALL}",
+        ]
+        if record.get("subprotocol"):
+            lines.append(f"{Style.DIM}Subprotocol:{Style.RESET_ALL} {Fore.WHITE}{record['subprotocol']}{Style.RESET_ALL}")
+        return lines
+
+    def _render_ws_frame(self, record: dict):
+        arrow = "client -> upstream" if record["direction"] == "client" else "upstream -> client"
+        lines = [
+            f"{Fore.CYAN}{_timestamp(record['time'])}{Style.RESET_ALL} {Fore.YELLOW}WS {arrow}{Style.RESET_ALL} "
+            f"{Style.DIM}#{record['frame']} {record['opcode']} {record['body_size']} bytes{Style.RESET_ALL}",
+        ]
+        if record.get("skipped"):
+            lines.append(f"{Style.DIM}({record['skipped']} frames not logged before this one){Style.RESET_ALL}")
+        lines.append(f"{Fore.WHITE}{format_record_body(record)}{Style.RESET_ALL}")
+        return lines
+
+    def _render_ws_close(self, record: dict):
+        def direction(name):
+            return (f"{record['frames'][name]} frames, {record['bytes'][name]} bytes "
+                    f"({record['frames_per_second'][name]:.1f} frames/s, {record['bytes_per_second'][name] / 1024:.1f} KiB/s)")
+        return [
+            f"\n{Back.MAGENTA}{Fore.WHITE} WEBSOCKET CLOSED {Style.RESET_ALL} {Fore.CYAN}{_timestamp(record['time'])}{Style.RESET_ALL}",
+            f"{Style.DIM}Closed by:{Style.RESET_ALL} {record['closed_by']} (code {record['code']}{', ' + record['reason'] if record['reason'] else ''}) after {record['duration']:.1f}s",
+            f"{Style.DIM}Client -> upstream:{Style.RESET_ALL} {direction('client')}",
+            f"{Style.DIM}Upstream -> client:{Style.RESET_ALL} {direction('upstream')}",
+            f"{Style.DIM}Frames logged:{Style.RESET_ALL} {record['logged']}",
+        ]
+
+    def _render_shadow(self, record: dict):
+        # Matching shadow responses are only counted
+        if record.get("error"):
+            return [f"{Fore.YELLOW}Shadow request failed:{Style.RESET_ALL} {record['method']} {record['url']}: {record['error']}"]
+        if not record["diffs"]:
+            return []
+        lines = [
+            f"\n{Back.YELLOW}{Fore.BLACK} SHADOW MISMATCH {Style.RESET_ALL} {Fore.CYAN}{_timestamp(record['time'])}{Style.RESET_ALL} "
+            f"{Fore.WHITE}{record['method']} {record['path']}{Style.RESET_ALL}",
+            f"{Style.DIM}Latency:{Style.RESET_ALL} primary {record['primary_latency'] * 1000:.1f}ms, shadow {record['latency'] * 1000:.1f}ms",
+        ]
+        lines += [f"  {Fore.YELLOW}{diff}{Style.RESET_ALL}" for diff in record["diffs"]]
+        return lines
+
+    def _render_error(self, record: dict):
+        return [
+            f"\n{Back.RED}{Fore.WHITE} CONNECTION ERROR {Style.RESET_ALL}",
+            f"{Fore.RED}{record['message']}{Style.RESET_ALL}",
+            f"{Style.DIM}TARGET_URL env variable:{Style.RESET_ALL} {Fore.YELLOW}{record['target']}{Style.RESET_ALL}",
+            f"{Style.DIM}Make sure the target server is running and accessible{Style.RESET_ALL}",
+        ]
+
+
+class JsonLinesSink:
+    """Writes one JSON object per record, with bodies as text or base64"""
+
+    def __init__(self, path: str = ""):
+        self.stream = open(path, "a", encoding="utf-8") if path else sys.stdout
+        self.owns_stream = bool(path)
+
+    def write(self, record: dict):
+        self.stream.write(json.dumps(self.to_json(record), ensure_ascii=False) + "\n")
+
+    @staticmethod
+    def to_json(record: dict) -> dict:
+        data = dict(record)
+        body = data.pop("body", None)
+        if body:
+            try:
+                data["body"] = body.decode("utf-8")
+            except UnicodeDecodeError:
+                data["body_base64"] = base64.b64encode(body).decode()
+        return data
+
+    def flush(self):
+        self.stream.flush()
+
+    def close(self):
+        self.flush()
+        if self.owns_stream:
+            self.stream.close()
+
+
+def create_sinks(names: str = LOG_SINK):
+    sinks = []
+    for name in (n.strip() for n in names.split(",")):
+        if name == "console":
+            sinks.append(ConsoleSink())
+        elif name == "jsonl":
+            sinks.append(JsonLinesSink(LOG_FILE))
+        elif name in ("none", ""):
+            continue
+        else:
+            raise ValueError(f"Unknown LOG_SINK: {name}")
+    return sinks
+
+
+class LogPipeline:
+    """
+    Moves logging off the request path.
+
+    Handlers enqueue structured records with emit(); a background task hands
+    them in batches to a worker thread that formats bodies and writes them to
+    the sinks. The queue is bounded: with the "block" policy emit() waits for
+    room, with the "drop" policy the record is discarded and counted.
+
+    Sinks marked `lossless` (the capture) must see every record, so they get a
+    queue and worker of their own that always blocks, whatever the policy.
+    """
+
+    def __init__(self, sinks, maxsize: int = LOG_QUEUE_SIZE, policy: str = LOG_QUEUE_POLICY):
+        if policy not in ("block", "drop"):
+            raise ValueError(f"Unknown LOG_QUEUE_POLICY: {policy}")
+        self.sinks = [sink for sink in sinks if not getattr(sink, "lossless", False)]
+        self.lossless_sinks = [sink for sink in sinks if getattr(sink, "lossless", False)]
+        self.maxsize = maxsize
+        self.policy = policy
+        self.dropped = 0
+        self.queue = None
+        self.task = None
+        self.lossless_queue = None
+        self.lossless_task = None
+
+    def start(self):
+        self.queue = asyncio.Queue(self.maxsize)
+        self.task = asyncio.create_task(self._run(self.queue, self.sinks))
+        self.lossless_queue = asyncio.Queue(self.maxsize)
+        self.lossless_task = asyncio.create_task(self._run(self.lossless_queue, self.lossless_sinks))
+
+    async def stop(self):
+        if self.task is None:
+            return
+        # Sentinel always gets in: stop waits for room even under the drop policy
+        await self.queue.put(None)
+        await self.lossless_queue.put(None)
+        await asyncio.gather(self.task, self.lossless_task)
+        self.task = None
+        self.lossless_task = None
+        for sink in self.sinks + self.lossless_sinks:
+            sink.close()
+        if self.dropped:
+            print(f"{Fore.YELLOW}Log pipeline dropped {self.dropped} records{Style.RESET_ALL}")
+
+    async def emit(self, record: dict):
+        if not self.sinks and not self.lossless_sinks:
+            return
+        record.setdefault("time", time.time())
+        if self.lossless_sinks:
+            await self.lossless_queue.put(record)
+        if not self.sinks:
+            return
+        if self.policy == "drop":
+            try:
+                self.queue.put_nowait(record)
+            except asyncio.QueueFull:
+                self.dropped += 1
+        else:
+            await self.queue.put(record)
+
+    async def _run(self, queue: asyncio.Queue, sinks):
+        while True:
+            batch = [await queue.get()]
+            while len(batch) < BATCH_SIZE and not queue.empty():
+                batch.append(queue.get_nowait())
+            stop = batch[-1] is None
+            records = [r for r in batch if r is not None]
+            if records:
+                await asyncio.to_thread(self._write, sinks, records)
+            if stop:
+                return
+
+    @staticmethod
+    def _write(sinks, records):
+        for sink in sinks:
+            for record in records:
+                try:
+                    sink.write(record)
+                except Exception as e:
+                    print(f"{Fore.RED}Log sink {type(sink).__name__} failed: {e}{Style.RESET_ALL}")
+            sink.flush()
@@ -1,139 +1,582 @@
 import os
 import json
+import time
+import asyncio
+import itertools
 import warnings
-from datetime import datetime
-from urllib.parse import urljoin
-from fastapi import FastAPI, Request, Response
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request, Response, WebSocket
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 import httpx
-from colorama import Fore, Back, Style, init
+from colorama import Fore, Style, init
 
 # Suppress the pkg_resources deprecation warning from old protobuf versions
 warnings.filterwarnings("ignore", category=UserWarning, module="google.protobuf")
 
-from .formatter import format_body
+from .formatter import format_body, start_process_pool, stop_process_pool
+from .log_pipeline import LOG_SINK, LogPipeline, create_sinks
+from .aggregator import LOG_AGGREGATOR_ADDRESS, ForwardingSink, start_aggregator, stop_aggregator
+from .capture import CAPTURE_DIR, CaptureWriter
+from .typedef_cache import typedef_cache
+from .mock import MOCK_CAPTURE_DIR, MOCK_MISS, MockIndex
+from .metrics import METRICS_PATH, RequestTimer, metrics, pool_usage
+from .upstreams import TARGET_URLS, Target, Upstreams, parse_targets
+from .headers import encode_headers, end_to_end, get_header
+from .ws_proxy import WebSocketRelay, websockets_available
+from .faults import FAULT_RULES_FILE, FAULTS_PATH, Fault, fault_rules
+from .tracing import SERVER_TIMING, TRACE_FILE, RequestTrace, TraceWriter
+from .cache import RESPONSE_CACHE, CacheEntry, ResponseCache
+from .shadow import SHADOW_PATH, SHADOW_TARGET_URL, Shadow
+from .admission import Admission, Rejected
 
 # Initialize colorama for cross-platform colored output
 init(autoreset=True)
 
-app = FastAPI()
-
 TARGET_URL =  os.getenv("TARGET_URL", "http://localhost:8080")
-ECHO_MODE = os.getenv("ECHO_MODE", "false").lower() in ("true", "1", "yes")
+# TARGET_URLS, when set, replaces TARGET_URL with several weighted targets
+upstreams = Upstreams(parse_targets(TARGET_URLS or TARGET_URL))
+ECHO_MODE = os.getenv("ECHO_MODE", "false").lower() in ("true", "1", "yes", "raw")
+# Raw echo returns the request body as-is, without any formatting work
+RAW_ECHO = os.getenv("ECHO_MODE", "false").lower() == "raw"
+
+# Upstream connection pool settings
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "1000"))
+UPSTREAM_MAX_KEEPALIVE = int(os.getenv("UPSTREAM_MAX_KEEPALIVE", "100"))
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", "5"))
+UPSTREAM_HTTP2 = os.getenv("UPSTREAM_HTTP2", "false").lower() in ("true", "1", "yes")
+
+# Stream request/response bodies through instead of buffering them
+STREAM_MODE = os.getenv("STREAM_MODE", "false").lower() in ("true", "1", "yes")
+# Max bytes of a streamed body kept for the console log
+LOG_BODY_LIMIT = int(os.getenv("LOG_BODY_LIMIT", str(64 * 1024)))
 
-# Track last request time for smart spacing
-last_request_time = None
+# Number of server processes; "auto" uses one per CPU core
+WORKERS = os.getenv("WORKERS", "1").lower()
+WORKERS = os.cpu_count() or 1 if WORKERS == "auto" else int(WORKERS)
 
+# Shared upstream client, created on startup so connections are reused across requests
+http_client = None
 
-print(f"{Fore.GREEN}Proxy Server Starting{Style.RESET_ALL}")
-if ECHO_MODE:
-    print(f"{Fore.MAGENTA}Echo Mode: Enabled (all requests will return 200 without forwarding){Style.RESET_ALL}")
+# Formats and prints request/response records off the request path.
+# Worker processes send their records to the aggregator in the parent instead.
+if LOG_AGGREGATOR_ADDRESS:
+    log_sinks = [ForwardingSink(keep_body="jsonl" in LOG_SINK)]
 else:
-    print(f"{Style.DIM}Redirecting traffic to:{Style.RESET_ALL} {Fore.YELLOW}{TARGET_URL}{Style.RESET_ALL}")
+    log_sinks = create_sinks()
+if CAPTURE_DIR:
+    log_sinks.append(CaptureWriter(CAPTURE_DIR))
+if TRACE_FILE:
+    log_sinks.append(TraceWriter(TRACE_FILE))
+log_pipeline = LogPipeline(log_sinks)
+
+# Ties the request and response records of one exchange together
+exchange_ids = itertools.count(1)
+
+# Recorded responses served in mock mode, loaded on startup
+mock_index = None
+
+# Upstream GET responses kept for reuse
+response_cache = ResponseCache() if RESPONSE_CACHE else None
+
+# Concurrency caps in front of the upstream
+admission = Admission()
+if not admission.enabled:
+    admission = None
+
+# Mirrors forwarded requests to a secondary target and compares the answers
+shadow = Shadow(SHADOW_TARGET_URL, log_pipeline) if SHADOW_TARGET_URL else None
+
+
+def print_banner():
+    print(f"{Fore.GREEN}Proxy Server Starting{Style.RESET_ALL}")
+    if RAW_ECHO:
+        print(f"{Fore.MAGENTA}Raw Echo Mode: Enabled (all requests will return their own body without forwarding){Style.RESET_ALL}")
+    elif ECHO_MODE:
+        print(f"{Fore.MAGENTA}Echo Mode: Enabled (all requests will return 200 without forwarding){Style.RESET_ALL}")
+    elif MOCK_CAPTURE_DIR:
+        print(f"{Fore.MAGENTA}Mock Mode: Enabled (serving recorded responses from {MOCK_CAPTURE_DIR}, misses: {MOCK_MISS}){Style.RESET_ALL}")
+    else:
+        targets = ", ".join(t.url if len(upstreams.targets) == 1 else f"{t.url} (weight {t.weight:g})" for t in upstreams.targets)
+        print(f"{Style.DIM}Redirecting traffic to:{Style.RESET_ALL} {Fore.YELLOW}{targets}{Style.RESET_ALL}")
+    if response_cache is not None and not ECHO_MODE:
+        print(f"{Fore.MAGENTA}Response Cache: Enabled (up to {response_cache.max_entries} responses, {response_cache.max_bytes / (1024 * 1024):g} MiB){Style.RESET_ALL}")
+    if shadow is not None and not ECHO_MODE:
+        methods = "all" if "*" in shadow.methods else ", ".join(sorted(shadow.methods))
+        print(f"{Fore.MAGENTA}Shadowing: {methods} requests mirrored to {shadow.target.url}{Style.RESET_ALL}")
+    if admission is not None:
+        caps = [f"{limiter.name}={limiter.capacity}" for _, limiter in admission.routes]
+        if admission.limiter is not None:
+            caps.append(f"global={admission.limiter.capacity}")
+        print(f"{Fore.MAGENTA}Admission Control: {', '.join(caps)} (queue timeout {admission.queue_timeout:g}s){Style.RESET_ALL}")
+    if STREAM_MODE:
+        print(f"{Fore.MAGENTA}Stream Mode: Enabled (bodies are relayed as they arrive, first {LOG_BODY_LIMIT} bytes logged){Style.RESET_ALL}")
+    if FAULT_RULES_FILE:
+        print(f"{Fore.MAGENTA}Fault Injection: Enabled (rules from {FAULT_RULES_FILE}){Style.RESET_ALL}")
+    if CAPTURE_DIR:
+        print(f"{Style.DIM}Capturing exchanges to:{Style.RESET_ALL} {Fore.YELLOW}{CAPTURE_DIR}{Style.RESET_ALL}")
+
+
+# Worker processes are started by the main process, which has printed the banner already
+if not os.getenv("ECHO_PROXY_WORKER"):
+    print_banner()
+
+
+class BodyPrefix:
+    """Keeps the first `limit` bytes of a streamed body for logging"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.chunks = []
+        self.size = 0
+        self.total = 0
+
+    def add(self, chunk: bytes):
+        self.total += len(chunk)
+        if self.size < self.limit:
+            part = chunk[:self.limit - self.size]
+            self.chunks.append(part)
+            self.size += len(part)
+
+    def getvalue(self) -> bytes:
+        return b"".join(self.chunks)
+
+
+def create_http_client() -> httpx.AsyncClient:
+    """Build the shared upstream client from the pool settings"""
+    http2 = UPSTREAM_HTTP2
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            print(f"{Fore.YELLOW}UPSTREAM_HTTP2 requested but 'h2' is not installed (pip install 'httpx[http2]'), using HTTP/1.1{Style.RESET_ALL}")
+            http2 = False
+
+    # No timeouts so long-running upstream calls are not cut off
+    timeout = httpx.Timeout(None)
+    limits = httpx.Limits(
+        max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE,
+        max_connections=UPSTREAM_MAX_CONNECTIONS,
+        keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY,
+    )
+    return httpx.AsyncClient(timeout=timeout, limits=limits, http2=http2)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global http_client, mock_index
+    http_client = create_http_client()
+    if MOCK_CAPTURE_DIR and not ECHO_MODE:
+        mock_index = await asyncio.to_thread(MockIndex().load, MOCK_CAPTURE_DIR)
+        print(f"{Style.DIM}Loaded {mock_index.loaded} recorded responses ({mock_index.skipped} skipped){Style.RESET_ALL}")
+    if not ECHO_MODE:
+        upstreams.start_health_checks(http_client)
+    fault_rules.start()
+    if shadow is not None:
+        shadow.start()
+    start_process_pool()
+    typedef_cache.load()
+    log_pipeline.start()
+    try:
+        yield
+    finally:
+        await fault_rules.stop()
+        if shadow is not None:
+            await shadow.stop()
+        await upstreams.stop_health_checks()
+        await http_client.aclose()
+        http_client = None
+        await log_pipeline.stop()
+        stop_process_pool()
+        typedef_cache.save()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+# Registered before the catch-all route so it is not proxied
+@app.get(METRICS_PATH, include_in_schema=False)
+async def metrics_endpoint():
+    extra = pool_usage(http_client) if http_client is not None else {}
+    extra.update(upstreams.gauges())
+    if response_cache is not None:
+        extra.update(response_cache.gauges())
+    if shadow is not None:
+        extra.update(shadow.gauges())
+    if admission is not None:
+        extra.update(admission.gauges())
+    extra["echo_proxy_log_records_dropped_total"] = ("counter", "Log records dropped because the log queue was full", log_pipeline.dropped)
+    return Response(content=metrics.render(extra), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get(SHADOW_PATH, include_in_schema=False)
+async def shadow_summary():
+    if shadow is None:
+        return Response(content=json.dumps({"error": "SHADOW_TARGET_URL is not set"}, indent=2), status_code=404,
+                        headers={"content-type": "application/json"})
+    return {"target": shadow.target.url, **shadow.stats.summary()}
+
+
+@app.get(FAULTS_PATH, include_in_schema=False)
+async def get_faults():
+    return fault_rules.specs()
+
+
+@app.put(FAULTS_PATH, include_in_schema=False)
+async def put_faults(request: Request):
+    try:
+        fault_rules.replace(json.loads(await request.body()))
+    except ValueError as e:
+        return Response(content=json.dumps({"error": str(e)}, indent=2), status_code=400,
+                        headers={"content-type": "application/json"})
+    print(f"{Fore.MAGENTA}Replaced fault rules: {len(fault_rules.rules)} rules{Style.RESET_ALL}")
+    return fault_rules.specs()
+
 
 @app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "DELETE", "PATCH", "OPTIONS", "HEAD"])
 async def proxy(request: Request, path: str):
-    global last_request_time
-    
-    # Smart spacing: add separator if more than a minute has passed
-    current_time = datetime.now()
-    if last_request_time is not None:
-        time_diff = (current_time - last_request_time).total_seconds()
-        if time_diff > 60:  # More than a minute
-            print("\n\n\n----------------------------------------------------------------------\n\n\n")
-    last_request_time = current_time
-    
+    timer = metrics.start(request.method, request.url.path)
+    acquired, waited = [], 0.0
+    if admission is not None:
+        try:
+            acquired, waited = await admission.admit(request.url.path)
+        except Rejected as e:
+            response = admission.rejection(e)
+            timer.finish(response.status_code)
+            return response
+    fault = fault_rules.match(request.method, request.url.path)
+    try:
+        response = await handle_request(request, path, timer, fault, waited)
+        if fault is not None:
+            response = await fault.shape(response, timer)
+    except BaseException:
+        timer.finish(500)
+        if acquired:
+            admission.release(acquired)
+        raise
+    if acquired:
+        if isinstance(response, StreamingResponse):
+            # Streamed responses keep their slot until the last chunk has been sent
+            response.body_iterator = release_after(response.body_iterator, acquired)
+        else:
+            admission.release(acquired)
+    # Streamed responses are reported once their last chunk has been sent
+    if not isinstance(response, StreamingResponse):
+        timer.response_bytes = len(response.body)
+        timer.finish(response.status_code)
+    return response
+
+
+async def release_after(chunks, acquired):
+    try:
+        async for chunk in chunks:
+            yield chunk
+    finally:
+        admission.release(acquired)
+        await chunks.aclose()
+
+
+@app.websocket("/{path:path}")
+async def websocket_proxy(websocket: WebSocket, path: str):
+    relay = WebSocketRelay(websocket, next(exchange_ids), websocket.url.path, log_pipeline)
+    if ECHO_MODE:
+        await relay.echo()
+        return
+    if not websockets_available():
+        await websocket.close(code=1011)
+        return
+    target = upstreams.choose()
+    await relay.relay(target.url_for(path, websocket.url.query), upstreams, target)
+
+
+async def handle_request(request: Request, path: str, timer: RequestTimer, fault: Fault = None, queued: float = 0.0):
+    start_time = time.time()
     method = request.method    
     # Properly construct the target URL with query parameters
     query_string = str(request.url.query) if request.url.query else ""
     target_path = path if path else ""
-    url = urljoin(TARGET_URL + "/", target_path)
-    if query_string:
-        url = f"{url}?{query_string}"
-    body = await request.body()
-    headers = dict(request.headers)
+    target = upstreams.choose()
+    url = target.url_for(target_path, query_string)
+    # Repeated headers are kept; host is set by the upstream client
+    headers = end_to_end(request.headers.items(), skip={"host"})
+    # Bodies are relayed without re-encoding, so the upstream may only use encodings the client accepts
+    if not get_header(headers, "accept-encoding"):
+        headers.append(("accept-encoding", "identity"))
 
-    # Remove host header to avoid forwarding issues
-    headers.pop('host', None)
+    exchange_id = next(exchange_ids)
+    trace = RequestTrace(timer.started)
+    if queued:
+        trace.add("queue", 0.0, queued)
+    request_record = {
+        "type": "request",
+        "id": exchange_id,
+        "time": start_time,
+        "url": str(request.url),
+        "target_url": url,
+        "method": method,
+        "path": request.url.path,
+        "query": query_string,
+        "headers": headers,
+        "content_type": get_header(headers, "content-type"),
+        "content_encoding": get_header(headers, "content-encoding"),
+    }
+    if fault is not None:
+        request_record["faults"] = fault.describe()
+        # Injected latency is a timer; the request holds nothing else while it waits
+        if fault.delay:
+            await asyncio.sleep(fault.delay)
+        if fault.status:
+            body = await request.body()
+            timer.request_bytes = len(body)
+            await log_pipeline.emit({**request_record, "body": body})
+            await log_pipeline.emit({"type": "fault", "id": exchange_id, "status": fault.status})
+            return fault.error_response()
+    if STREAM_MODE and not ECHO_MODE and mock_index is None:
+        return await stream_proxy(request, request_record, timer, target, trace)
 
-    timestamp = current_time.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
-    print(f"\n\n\n{Back.BLUE}{Fore.WHITE} INCOMING REQUEST {Style.RESET_ALL} {Fore.CYAN}{timestamp}{Style.RESET_ALL}")
-    print(f"{Style.DIM}URL:{Style.RESET_ALL} {Fore.WHITE}{request.url}{Style.RESET_ALL}")
-    print(f"{Style.DIM}Target URL:{Style.RESET_ALL} {Fore.CYAN}{url}{Style.RESET_ALL}")
-    print(f"{Style.DIM}Method:{Style.RESET_ALL} {Fore.YELLOW}{method}{Style.RESET_ALL}")
-    print(f"{Style.DIM}Headers:{Style.RESET_ALL} {Fore.WHITE}{headers}{Style.RESET_ALL}")
-    
-    content_type = headers.get("content-type", "")
-    formatted_body = format_body(body, content_type)
-    print(f"{Style.DIM}Body:{Style.RESET_ALL} {Fore.WHITE}{formatted_body}{Style.RESET_ALL}")
+    body = await request.body()
+    timer.request_bytes = len(body)
+    await log_pipeline.emit({**request_record, "body": body})
+
+    if RAW_ECHO:
+        await log_pipeline.emit({"type": "echo", "id": exchange_id, "timing": trace.record()})
+        return with_server_timing(Response(
+            content=body,
+            status_code=200,
+            headers={"content-type": request_record["content_type"] or "application/octet-stream"}
+        ), trace)
 
     # If echo mode is enabled, return 200 without forwarding
     if ECHO_MODE:
+        format_started = time.perf_counter()
+        formatted = await asyncio.to_thread(format_body, body, request_record["content_type"])
+        format_finished = time.perf_counter()
+        metrics.observe_format(method, request.url.path, format_finished - format_started)
+        trace.add("format", format_started - trace.origin, format_finished - trace.origin)
         echo_response = {
             "echo": True,
             "method": method,
             "path": path,
-            "headers": headers,
-            "body": formatted_body
+            "headers": dict(request.headers),
+            "body": formatted
         }
-        response_timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
-        print(f"\n{Back.MAGENTA}{Fore.WHITE} ECHO RESPONSE {Style.RESET_ALL} {Fore.CYAN}{response_timestamp}{Style.RESET_ALL}")
-        print(f"{Fore.GREEN}Status: 200 OK{Style.RESET_ALL}")
-        print(f"{Style.DIM}Echoing request without forwarding{Style.RESET_ALL}")
-        
-        return Response(
+        await log_pipeline.emit({"type": "echo", "id": exchange_id, "timing": trace.record()})
+        return with_server_timing(Response(
             content=json.dumps(echo_response, indent=2),
             status_code=200,
             headers={"content-type": "application/json"}
-        )
+        ), trace)
 
-    # Configure client with no timeouts and increased limits
-    timeout = httpx.Timeout(None)  # No timeout
-    limits = httpx.Limits(max_keepalive_connections=100, max_connections=1000)
-    
-    try:
-        async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
-            resp = await client.request(
-                method,
-                url,
-                content=body,
-                headers=headers,
-                follow_redirects=True,
+    if mock_index is not None:
+        mocked = mock_index.lookup(method, request.url.path, query_string, body)
+        if mocked is not None:
+            await log_pipeline.emit({
+                "type": "response",
+                "id": exchange_id,
+                "method": method,
+                "path": request_record["path"],
+                "status": mocked.status,
+                "url": f"mock:{request_record['path']}",
+                "headers": mocked.headers,
+                "content_type": get_header(mocked.headers, "content-type"),
+                "content_encoding": get_header(mocked.headers, "content-encoding"),
+                "body": mocked.body,
+            })
+            return mocked.response()
+        if MOCK_MISS != "proxy":
+            await log_pipeline.emit({"type": "mock_miss", "id": exchange_id})
+            return Response(
+                content=json.dumps({"error": "No recorded response matches this request"}, indent=2),
+                status_code=404,
+                headers={"content-type": "application/json"}
             )
+
+    async def send(upstream_headers):
+        return await forward(method, url, upstream_headers, body, target, timer, trace)
+
+    cache_outcome = None
+    try:
+        if response_cache is not None and method == "GET":
+            resource = f"{request.url.path}?{query_string}" if query_string else request.url.path
+            resp, content, cache_outcome = await response_cache.fetch(resource, headers, send)
+        else:
+            resp, content = await send(headers)
     except httpx.ConnectError as e:
-        error_msg = f"Failed to connect to target: {url}. Error: {str(e)}"
-        print(f"\n{Back.RED}{Fore.WHITE} CONNECTION ERROR {Style.RESET_ALL}")
-        print(f"{Fore.RED}{error_msg}{Style.RESET_ALL}")
-        print(f"{Style.DIM}TARGET_URL env variable:{Style.RESET_ALL} {Fore.YELLOW}{TARGET_URL}{Style.RESET_ALL}")
-        print(f"{Style.DIM}Make sure the target server is running and accessible{Style.RESET_ALL}")
-        return Response(
-            content=json.dumps({"error": error_msg}, indent=2),
-            status_code=502,
-            headers={"content-type": "application/json"}
-        )
+        return await connection_error_response(exchange_id, url, target, e)
+
+    record = {**response_record(resp, request_record), "body": content, "timing": trace.record()}
+    if cache_outcome is not None:
+        record["cache"] = cache_outcome
+    await log_pipeline.emit(record)
+
+    # Content-length is set from the body actually sent, except for replies that have none
+    # (HEAD, 304), where the upstream's value describes the resource; a stored response gets its current age
+    from_cache = isinstance(resp, CacheEntry)
+    bodiless = method == "HEAD" or resp.status_code == 304
+    skip = set() if bodiless else {"content-length"}
+    if from_cache:
+        skip.add("age")
+    response = Response(content=content, status_code=resp.status_code)
+    if bodiless:
+        response.raw_headers = [(k, v) for k, v in response.raw_headers if k != b"content-length"]
+    response.raw_headers.extend(encode_headers(end_to_end(resp.headers.multi_items(), skip=skip)))
+    if from_cache:
+        response.raw_headers.append((b"age", str(int(resp.age())).encode()))
+    if cache_outcome is not None:
+        response.raw_headers.append((b"x-proxy-cache", cache_outcome.encode()))
+    # Queued once the client has its response, so the copy never delays it
+    if shadow is not None and shadow.wants(method) and not from_cache:
+        response.background = BackgroundTask(shadow.submit, request_record, body, resp, content, timer.upstream)
+    return with_server_timing(response, trace)
+
+
+async def forward(method: str, url: str, headers: list, body: bytes, target: Target,
+                  timer: RequestTimer, trace: RequestTrace):
+    """Send a buffered request to the target and read the raw response body"""
+    resp = None
+    upstream_started = time.perf_counter()
+    metrics.upstream_in_flight += 1
+    upstreams.start(target)
+    try:
+        # Connection events of the call are collected into the request's timing breakdown
+        upstream_request = http_client.build_request(method, url, content=body, headers=headers,
+                                                     extensions={"trace": trace})
+        resp = await http_client.send(upstream_request, stream=True, follow_redirects=True)
+        # Raw bytes as sent by the upstream, still content-encoded
+        try:
+            content = b"".join([chunk async for chunk in resp.aiter_raw()])
+        finally:
+            await resp.aclose()
+    finally:
+        metrics.upstream_in_flight -= 1
+        timer.upstream = time.perf_counter() - upstream_started
+        upstreams.release(target)
+        upstreams.observe(target, timer.upstream, resp.status_code if resp is not None else None)
+    return resp, content
+
+
+async def stream_proxy(request: Request, request_record: dict, timer: RequestTimer, target: Target,
+                       trace: RequestTrace):
+    """Forward the request and relay both bodies chunk by chunk"""
+    headers = request_record["headers"]
+    request_prefix = BodyPrefix(LOG_BODY_LIMIT)
+
+    async def request_stream():
+        async for chunk in request.stream():
+            request_prefix.add(chunk)
+            yield chunk
+
+    # Only send a body when the client announced one
+    has_body = "content-length" in request.headers or "transfer-encoding" in request.headers
+    upstream_request = http_client.build_request(
+        request_record["method"],
+        request_record["target_url"],
+        content=request_stream() if has_body else None,
+        headers=headers,
+        extensions={"trace": trace},
+    )
+    resp = None
+    upstream_started = time.perf_counter()
+    metrics.upstream_in_flight += 1
+    upstreams.start(target)
+    try:
+        resp = await http_client.send(upstream_request, stream=True, follow_redirects=True)
+    except httpx.ConnectError as e:
+        await log_pipeline.emit({**request_record, "body": request_prefix.getvalue(), "body_size": request_prefix.total})
+        return await connection_error_response(request_record["id"], request_record["target_url"], target, e)
+    finally:
+        metrics.upstream_in_flight -= 1
+        if resp is None:
+            upstreams.release(target)
+        # Time to response headers; the body is relayed as it arrives
+        timer.upstream = time.perf_counter() - upstream_started
+        timer.request_bytes = request_prefix.total
+        upstreams.observe(target, timer.upstream, resp.status_code if resp is not None else None)
+
+    # The request body has been sent by the time response headers arrive
+    await log_pipeline.emit({**request_record, "body": request_prefix.getvalue(), "body_size": request_prefix.total})
+    await log_pipeline.emit({**response_record(resp, request_record), "streamed": True})
 
-    response_timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
-    print(f"\n{Back.GREEN}{Fore.WHITE} OUTGOING RESPONSE {Style.RESET_ALL} {Fore.CYAN}{response_timestamp}{Style.RESET_ALL}")
-    
-    # Color status code based on HTTP status
-    status_color = Fore.GREEN if 200 <= resp.status_code < 300 else Fore.YELLOW if 300 <= resp.status_code < 400 else Fore.RED
-    print(f"{Style.DIM}Status:{Style.RESET_ALL} {status_color}{resp.status_code}{Style.RESET_ALL}")
-    print(f"{Style.DIM}URL:{Style.RESET_ALL} {Fore.WHITE}{resp.url}{Style.RESET_ALL}")
-    print(f"{Style.DIM}Headers:{Style.RESET_ALL} {Fore.WHITE}{dict(resp.headers)}{Style.RESET_ALL}")
-    
     response_content_type = resp.headers.get("content-type", "")
-    formatted_response = format_body(resp.content, response_content_type)
-    print(f"{Style.DIM}Body:{Style.RESET_ALL} {Fore.WHITE}{formatted_response}{Style.RESET_ALL}")
+    response_content_encoding = resp.headers.get("content-encoding", "")
+    response_prefix = BodyPrefix(LOG_BODY_LIMIT)
+
+    async def response_stream():
+        try:
+            async for chunk in resp.aiter_raw():
+                response_prefix.add(chunk)
+                yield chunk
+        finally:
+            await resp.aclose()
+            # Counts as outstanding on the target until the body is through
+            upstreams.release(target)
+            timer.response_bytes = response_prefix.total
+            timer.finish(resp.status_code)
+            await log_pipeline.emit({
+                "type": "response_body",
+                "id": request_record["id"],
+                "method": request_record["method"],
+                "path": request_record["path"],
+                "content_type": response_content_type,
+                "content_encoding": response_content_encoding,
+                "body": response_prefix.getvalue(),
+                "body_size": response_prefix.total,
+                "timing": trace.record(),
+            })
+
+    # The raw body is relayed unchanged, so content-encoding and content-length still hold
+    response = StreamingResponse(response_stream(), status_code=resp.status_code)
+    response.raw_headers = encode_headers(end_to_end(resp.headers.multi_items()))
+    # Covers the time to the response headers; the body phase is only in the log record
+    return with_server_timing(response, trace)
+
 
+def with_server_timing(response: Response, trace: RequestTrace) -> Response:
+    # Added next to any Server-Timing header of the upstream's own
+    if SERVER_TIMING:
+        response.raw_headers.append((b"server-timing", trace.server_timing().encode("latin-1")))
+    return response
+
+
+def response_record(resp: httpx.Response, request_record: dict) -> dict:
+    return {
+        "type": "response",
+        "id": request_record["id"],
+        "method": request_record["method"],
+        "path": request_record["path"],
+        "status": resp.status_code,
+        "url": str(resp.url),
+        "headers": resp.headers.multi_items(),
+        "content_type": resp.headers.get("content-type", ""),
+        "content_encoding": resp.headers.get("content-encoding", ""),
+    }
+
+
+async def connection_error_response(exchange_id: int, url: str, target: Target, error: Exception) -> Response:
+    error_msg = f"Failed to connect to target: {url}. Error: {str(error)}"
+    await log_pipeline.emit({"type": "error", "id": exchange_id, "message": error_msg, "target": target.url})
     return Response(
-        content=resp.content,
-        status_code=resp.status_code,
-        headers=dict(resp.headers)
+        content=json.dumps({"error": error_msg}, indent=2),
+        status_code=502,
+        headers={"content-type": "application/json"}
     )
 
+
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 9090))
     host = os.getenv("HOST", "0.0.0.0") 
     
-    print(f"{Fore.CYAN}Starting server on {host}:{port}{Style.RESET_ALL}")
-    uvicorn.run(app, host=host, port=port)
\ No newline at end of file
+    if WORKERS > 1:
+        print(f"{Fore.CYAN}Starting server on {host}:{port} with {WORKERS} workers{Style.RESET_ALL}")
+        os.environ["ECHO_PROXY_WORKER"] = "1"
+        # One process writes the log for all workers
+        aggregator = start_aggregator(LOG_SINK) if LOG_SINK.replace("none", "").strip(", ") else None
+        try:
+            uvicorn.run("echo_proxy.main:app", host=host, port=port, workers=WORKERS)
+        finally:
+            if aggregator is not None:
+                stop_aggregator(aggregator)
+    else:
+        print(f"{Fore.CYAN}Starting server on {host}:{port}{Style.RESET_ALL}")
+        uvicorn.run(app, host=host, port=port)
\ No newline at end of file
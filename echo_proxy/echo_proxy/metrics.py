@@ -0,0 +1,295 @@
+"""
+Prometheus metrics for the proxy, served at /__proxy/metrics.
+
+Latency is split into the time spent waiting on the upstream, the time spent
+formatting bodies for the log, and the total time the proxy held the request,
+so the overhead added by the proxy itself can be read off directly.
+"""
+
+import os
+import re
+import time
+import threading
+from bisect import bisect_left
+
+# Path templates used as the `path` label, matched in order, e.g. "/users/{id}/orders,/static/*".
+# {name} matches one path segment, a trailing * matches the rest of the path.
+METRICS_PATH_TEMPLATES = [t.strip() for t in os.getenv("METRICS_PATH_TEMPLATES", "").split(",") if t.strip()]
+# Replace numeric, UUID and long hex segments with {id} for paths no template matches
+METRICS_GROUP_IDS = os.getenv("METRICS_GROUP_IDS", "true").lower() in ("true", "1", "yes")
+# Distinct path labels kept before new paths are reported as "other"
+METRICS_MAX_PATHS = int(os.getenv("METRICS_MAX_PATHS", "200"))
+
+METRICS_PATH = "/__proxy/metrics"
+
+# Histogram bucket upper bounds in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+ID_SEGMENT = re.compile(
+    r"^(\d+|[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}|[0-9a-fA-F]{16,})$"
+)
+
+
+def compile_path_template(template: str):
+    prefix = template.endswith("*")
+    parts = []
+    for segment in template.rstrip("*").strip("/").split("/"):
+        if not segment:
+            continue
+        if segment.startswith("{") and segment.endswith("}"):
+            parts.append("[^/]+")
+        else:
+            parts.append(re.escape(segment))
+    pattern = "^/" + "/".join(parts)
+    pattern += "(/.*)?$" if prefix else "/?$"
+    return re.compile(pattern), template
+
+
+class PathGrouper:
+    """Maps request paths to a bounded set of label values"""
+
+    def __init__(self, templates=METRICS_PATH_TEMPLATES, group_ids: bool = METRICS_GROUP_IDS,
+                 max_paths: int = METRICS_MAX_PATHS):
+        self.templates = [compile_path_template(t) for t in templates]
+        self.group_ids = group_ids
+        self.max_paths = max_paths
+        self.known = {}
+        self.labels = set()
+
+    def __call__(self, path: str) -> str:
+        label = self.known.get(path)
+        if label is not None:
+            return label
+        label = self._group(path)
+        if len(self.known) < self.max_paths * 4:
+            self.known[path] = label
+        return label
+
+    def _group(self, path: str) -> str:
+        for pattern, template in self.templates:
+            if pattern.match(path):
+                return template
+        if self.group_ids:
+            path = "/".join("{id}" if ID_SEGMENT.match(s) else s for s in path.split("/"))
+        if path not in self.labels:
+            if len(self.labels) >= self.max_paths:
+                return "other"
+            self.labels.add(path)
+        return path
+
+
+class LatencyHistogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect_left(self.buckets, seconds)] += 1
+        self.sum += seconds
+
+    def render(self, name: str, labels: str):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        cumulative += self.counts[-1]
+        yield f'{name}_bucket{{{labels},le="+Inf"}} {cumulative}'
+        yield f"{name}_sum{{{labels}}} {self.sum}"
+        yield f"{name}_count{{{labels}}} {cumulative}"
+
+
+class RequestTimer:
+    """Timing and sizes of one proxied request, reported once by finish()"""
+
+    __slots__ = ("metrics", "method", "path", "started", "upstream", "request_bytes", "response_bytes", "done")
+
+    def __init__(self, metrics, method: str, path: str):
+        self.metrics = metrics
+        self.method = method
+        self.path = path
+        self.started = time.perf_counter()
+        self.upstream = None
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.done = False
+
+    def finish(self, status: int):
+        if not self.done:
+            self.done = True
+            self.metrics._finish(self, status, time.perf_counter() - self.started)
+
+
+class Metrics:
+    """
+    Counters, gauges and histograms keyed by (method, path template).
+
+    Request metrics are updated on the event loop, formatting time from the
+    log worker thread, so updates go through a lock.
+    """
+
+    def __init__(self, grouper: PathGrouper = None):
+        self.group = grouper or PathGrouper()
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.request_bytes = {}
+        self.response_bytes = {}
+        self.total_latency = {}
+        self.upstream_latency = {}
+        self.overhead_latency = {}
+        self.format_latency = {}
+        self.in_flight = {}
+        self.upstream_in_flight = 0
+        self.target_requests = {}
+        self.target_latency = {}
+        self.websocket_connections = 0
+        self.websocket_frames = {}
+        self.websocket_bytes = {}
+        self.admission_wait = {}
+        self.admission_rejected = {}
+
+    def start(self, method: str, path: str) -> RequestTimer:
+        timer = RequestTimer(self, method, self.group(path))
+        key = (method, timer.path)
+        with self.lock:
+            self.in_flight[key] = self.in_flight.get(key, 0) + 1
+        return timer
+
+    def _finish(self, timer: RequestTimer, status: int, total: float):
+        key = (timer.method, timer.path)
+        with self.lock:
+            self.in_flight[key] -= 1
+            status_key = key + (str(status),)
+            self.requests[status_key] = self.requests.get(status_key, 0) + 1
+            self.request_bytes[key] = self.request_bytes.get(key, 0) + timer.request_bytes
+            self.response_bytes[key] = self.response_bytes.get(key, 0) + timer.response_bytes
+            self._histogram(self.total_latency, key).observe(total)
+            if timer.upstream is not None:
+                self._histogram(self.upstream_latency, key).observe(timer.upstream)
+                self._histogram(self.overhead_latency, key).observe(max(total - timer.upstream, 0.0))
+
+    def observe_format(self, method: str, path: str, seconds: float):
+        key = (method, self.group(path))
+        with self.lock:
+            self._histogram(self.format_latency, key).observe(seconds)
+
+    def observe_target(self, target: str, status: int, seconds: float):
+        """Outcome of one request to an upstream target; status is None when no response arrived"""
+        key = (target, str(status) if status is not None else "error")
+        with self.lock:
+            self.target_requests[key] = self.target_requests.get(key, 0) + 1
+            self._histogram(self.target_latency, (target,)).observe(seconds)
+
+    def observe_ws_frame(self, direction: str, size: int):
+        key = (direction,)
+        with self.lock:
+            self.websocket_frames[key] = self.websocket_frames.get(key, 0) + 1
+            self.websocket_bytes[key] = self.websocket_bytes.get(key, 0) + size
+
+    def observe_admission(self, limit: str, waited: float, rejected: str = None):
+        """Time a request waited for a slot under a limit, and why it was refused if it was"""
+        with self.lock:
+            self._histogram(self.admission_wait, (limit,)).observe(waited)
+            if rejected:
+                key = (limit, rejected)
+                self.admission_rejected[key] = self.admission_rejected.get(key, 0) + 1
+
+    @staticmethod
+    def _histogram(histograms: dict, key) -> LatencyHistogram:
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = LatencyHistogram()
+        return histogram
+
+    def render(self, extra: dict = None) -> str:
+        """
+        Prometheus text exposition. `extra` maps more metric names to (type, help, value),
+        where value is a number or a dict of label tuples such as (("target", url),) to numbers.
+        """
+        lines = []
+        with self.lock:
+            self._counter(lines, "echo_proxy_requests_total", "Requests handled, by status code", self.requests,
+                          ("method", "path", "status"))
+            self._counter(lines, "echo_proxy_request_bytes_total", "Request body bytes received", self.request_bytes)
+            self._counter(lines, "echo_proxy_response_bytes_total", "Response body bytes sent", self.response_bytes)
+            self._histograms(lines, "echo_proxy_request_duration_seconds",
+                             "Time from receiving the request to handing back the response (to the last chunk when streaming)", self.total_latency)
+            self._histograms(lines, "echo_proxy_upstream_duration_seconds",
+                             "Time waiting on the upstream (until response headers when streaming)", self.upstream_latency)
+            self._histograms(lines, "echo_proxy_overhead_duration_seconds",
+                             "Request duration minus upstream duration", self.overhead_latency)
+            self._histograms(lines, "echo_proxy_format_duration_seconds",
+                             "Time spent formatting bodies for the log", self.format_latency)
+            self._counter(lines, "echo_proxy_target_requests_total", "Requests sent to each upstream target, by status code",
+                          self.target_requests, ("target", "status"))
+            self._histograms(lines, "echo_proxy_target_duration_seconds", "Upstream latency per target",
+                             self.target_latency, ("target",))
+            self._gauge(lines, "echo_proxy_in_flight_requests", "Requests currently being handled", self.in_flight)
+            self._counter(lines, "echo_proxy_websocket_frames_total", "WebSocket frames relayed, by sender",
+                          self.websocket_frames, ("direction",))
+            self._counter(lines, "echo_proxy_websocket_bytes_total", "WebSocket payload bytes relayed, by sender",
+                          self.websocket_bytes, ("direction",))
+            self._histograms(lines, "echo_proxy_admission_wait_seconds", "Time requests waited for a slot, per limit",
+                             self.admission_wait, ("limit",))
+            self._counter(lines, "echo_proxy_admission_rejected_total", "Requests refused with 503, per limit and reason",
+                          self.admission_rejected, ("limit", "reason"))
+            lines.append("# HELP echo_proxy_websocket_connections Open WebSocket connections")
+            lines.append("# TYPE echo_proxy_websocket_connections gauge")
+            lines.append(f"echo_proxy_websocket_connections {self.websocket_connections}")
+            lines.append("# HELP echo_proxy_upstream_in_flight_requests Requests currently waiting on the upstream")
+            lines.append("# TYPE echo_proxy_upstream_in_flight_requests gauge")
+            lines.append(f"echo_proxy_upstream_in_flight_requests {self.upstream_in_flight}")
+        for name, (kind, help_text, value) in (extra or {}).items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if isinstance(value, dict):
+                for labels, labeled_value in value.items():
+                    lines.append(f"{name}{{{self._labels(*zip(*labels))}}} {labeled_value}")
+            else:
+                lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _labels(names, values) -> str:
+        return ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+    def _counter(self, lines, name, help_text, values, label_names=("method", "path")):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} counter")
+        for key, value in sorted(values.items()):
+            lines.append(f"{name}{{{self._labels(label_names, key)}}} {value}")
+
+    def _gauge(self, lines, name, help_text, values, label_names=("method", "path")):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        for key, value in sorted(values.items()):
+            lines.append(f"{name}{{{self._labels(label_names, key)}}} {value}")
+
+    def _histograms(self, lines, name, help_text, histograms, label_names=("method", "path")):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} histogram")
+        for key, histogram in sorted(histograms.items()):
+            lines.extend(histogram.render(name, self._labels(label_names, key)))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def pool_usage(client) -> dict:
+    """Active, idle and queued counts of an httpx client's connection pool"""
+    pool = getattr(getattr(client, "_transport", None), "_pool", None)
+    if pool is None:
+        return {}
+    connections = list(getattr(pool, "connections", []))
+    idle = sum(1 for c in connections if c.is_idle())
+    queued = sum(1 for r in getattr(pool, "_requests", []) if r.is_queued())
+    return {
+        "echo_proxy_upstream_connections_active": ("gauge", "Upstream connections serving a request", len(connections) - idle),
+        "echo_proxy_upstream_connections_idle": ("gauge", "Idle keep-alive upstream connections", idle),
+        "echo_proxy_upstream_requests_queued": ("gauge", "Requests waiting for a free upstream connection", queued),
+    }
+
+
+# Shared by the request handlers and the log pipeline
+metrics = Metrics()
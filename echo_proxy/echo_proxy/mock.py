@@ -0,0 +1,114 @@
+import os
+import hashlib
+from functools import lru_cache
+from urllib.parse import parse_qsl, urlencode
+
+from fastapi import Response
+
+from .capture import CaptureReader
+from .headers import encode_headers, end_to_end
+
+# Capture directory whose recorded responses are served instead of forwarding
+MOCK_CAPTURE_DIR = os.getenv("MOCK_CAPTURE_DIR", "")
+# Include a hash of the request body in the lookup key
+MOCK_MATCH_BODY = os.getenv("MOCK_MATCH_BODY", "false").lower() in ("true", "1", "yes")
+# Parts of the key dropped one by one when there is no exact match: body, query
+MOCK_FALLBACK = [step.strip() for step in os.getenv("MOCK_FALLBACK", "body,query").lower().split(",") if step.strip()]
+# What to do when nothing matches: "404", or "proxy" to forward to TARGET_URL
+MOCK_MISS = os.getenv("MOCK_MISS", "404").lower()
+
+# Recorded headers that describe the original exchange, not the replayed one; the server sets its own
+NOT_REPLAYED = {"content-length", "date", "server"}
+
+
+@lru_cache(maxsize=4096)
+def normalize_query(query: str) -> str:
+    """Sort query parameters so that ?b=2&a=1 and ?a=1&b=2 match"""
+    if not query:
+        return ""
+    return urlencode(sorted(parse_qsl(query, keep_blank_values=True)))
+
+
+def body_hash(body: bytes) -> bytes:
+    return hashlib.blake2b(body, digest_size=16).digest()
+
+
+class MockResponse:
+    """A recorded response, with headers encoded once at load time"""
+
+    __slots__ = ("status", "headers", "raw_headers", "body")
+
+    def __init__(self, status: int, headers, body: bytes, decoded: bool = False):
+        self.status = status
+        # Content-length is recomputed for the body being sent; hop-by-hop headers are dropped too
+        skip = set(NOT_REPLAYED)
+        if decoded:
+            # Older captures hold bodies already decompressed by httpx
+            skip.add("content-encoding")
+        self.headers = end_to_end(headers, skip=skip)
+        self.raw_headers = encode_headers(self.headers)
+        self.body = body
+
+    def response(self) -> Response:
+        response = Response(content=self.body, status_code=self.status)
+        response.raw_headers.extend(self.raw_headers)
+        return response
+
+
+class MockIndex:
+    """
+    In-memory hash index of recorded responses.
+
+    Keys are (method, path, normalized query, body hash). Each response is
+    stored once per fallback level, with the dropped parts set to None, so a
+    lookup is at most one dict probe per level.
+    """
+
+    def __init__(self, match_body: bool = MOCK_MATCH_BODY, fallback=MOCK_FALLBACK):
+        self.entries = {}
+        # (use_query, use_body) per lookup attempt, most specific first
+        self.levels = [(True, match_body)]
+        use_query, use_body = True, match_body
+        for step in fallback:
+            if step == "body":
+                use_body = False
+            elif step == "query":
+                use_query = False
+            else:
+                raise ValueError(f"Unknown MOCK_FALLBACK step: {step}")
+            if (use_query, use_body) not in self.levels:
+                self.levels.append((use_query, use_body))
+        self.needs_body = any(use_body for _, use_body in self.levels)
+        self.loaded = 0
+        self.skipped = 0
+
+    def _keys(self, method: str, path: str, query: str, body: bytes):
+        query = normalize_query(query)
+        digest = body_hash(body) if self.needs_body else None
+        for use_query, use_body in self.levels:
+            yield (method, path, query if use_query else None, digest if use_body else None)
+
+    def add(self, method: str, path: str, query: str, body: bytes, response: MockResponse):
+        # Later recordings replace earlier ones
+        for key in self._keys(method, path, query, body):
+            self.entries[key] = response
+
+    def lookup(self, method: str, path: str, query: str, body: bytes = b""):
+        for key in self._keys(method, path, query, body):
+            response = self.entries.get(key)
+            if response is not None:
+                return response
+        return None
+
+    def load(self, directory: str):
+        for exchange in CaptureReader(directory).exchanges():
+            # Upstream failures and bodies cut off in stream mode cannot be served back
+            truncated = exchange["response_body_size"] > len(exchange["response_body"])
+            if exchange.get("error") or truncated:
+                self.skipped += 1
+                continue
+            response = MockResponse(exchange["status"], exchange["response_headers"], exchange["response_body"],
+                                    decoded=not exchange.get("raw_bodies"))
+            self.add(exchange["method"], exchange["path"], exchange.get("query", ""), exchange["request_body"], response)
+            self.loaded += 1
+        return self
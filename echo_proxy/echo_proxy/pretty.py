@@ -0,0 +1,238 @@
+"""
+Incremental pretty-printers for large bodies.
+
+Each printer walks the body token by token and yields (text, consumed) pairs,
+where consumed is how many input bytes have been processed so far. Nothing
+like a parsed object tree or DOM is built, and render_limited() stops pulling
+from the printer once the output budget is spent, so the cost of formatting
+is bounded by the budget rather than by the body size.
+"""
+
+import re
+import codecs
+from xml.etree.ElementTree import XMLPullParser, ParseError
+from xml.sax.saxutils import escape, quoteattr
+
+# Input is fed to the XML parser / raw fallback in slices of this size
+CHUNK_SIZE = 64 * 1024
+
+_JSON_WHITESPACE = re.compile(rb"[ \t\r\n]*")
+# Numbers, true/false/null, and anything else up to the next delimiter
+_JSON_SCALAR = re.compile(rb'[^ \t\r\n{}\[\],:"]+')
+
+
+def render_limited(chunks, total_size: int, max_bytes: int = 0, max_lines: int = 0) -> str:
+    """
+    Join the output of a printer, stopping at max_bytes of output or max_lines
+    lines (0 means no limit) with a "... N bytes truncated" marker.
+    """
+    out = []
+    size = 0
+    lines = 1
+    consumed = 0
+    for text, next_consumed in chunks:
+        length = len(text) if text.isascii() else len(text.encode("utf-8"))
+        newlines = text.count("\n")
+        over_bytes = max_bytes and size + length > max_bytes
+        over_lines = max_lines and lines + newlines > max_lines
+        if over_bytes or over_lines:
+            if over_lines:
+                # Keep the text up to the newline that ends the last allowed line
+                cut = -1
+                for _ in range(max_lines - lines + 1):
+                    cut = text.find("\n", cut + 1)
+                text = text[:cut]
+            if max_bytes and size + len(text) > max_bytes:
+                text = text[:max(max_bytes - size, 0)]
+            out.append(text)
+            out.append(f"\n... {max(total_size - consumed, 0)} bytes truncated")
+            return "".join(out)
+        out.append(text)
+        size += length
+        lines += newlines
+        consumed = next_consumed
+    return "".join(out)
+
+
+def iter_text(body: bytes):
+    """Decode UTF-8 text slice by slice"""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    for start in range(0, len(body), CHUNK_SIZE):
+        end = start + CHUNK_SIZE
+        yield decoder.decode(body[start:end], final=end >= len(body)), min(end, len(body))
+
+
+def iter_json(body: bytes, indent: str = "  "):
+    """
+    Re-indent JSON on its token stream.
+
+    Works on the raw bytes: JSON delimiters are ASCII and never appear inside a
+    UTF-8 multi-byte sequence, so only string and scalar tokens are decoded.
+    Invalid input is not rejected, it is laid out as well as possible.
+    """
+    pos = 0
+    size = len(body)
+    depth = 0
+    # Set after an opening bracket: the next token goes on a new line unless it closes the container
+    opened = False
+    while True:
+        pos = _JSON_WHITESPACE.match(body, pos).end()
+        if pos >= size:
+            return
+        char = body[pos:pos + 1]
+
+        if char in (b"}", b"]"):
+            depth = max(depth - 1, 0)
+            text = char.decode() if opened else "\n" + indent * depth + char.decode()
+            opened = False
+            pos += 1
+            yield text, pos
+            continue
+
+        prefix = "\n" + indent * depth if opened else ""
+        opened = False
+        if char in (b"{", b"["):
+            depth += 1
+            opened = True
+            pos += 1
+            yield prefix + char.decode(), pos
+        elif char == b",":
+            pos += 1
+            yield ",\n" + indent * depth, pos
+        elif char == b":":
+            pos += 1
+            yield ": ", pos
+        elif char == b'"':
+            end = _find_string_end(body, pos + 1)
+            token = body[pos:end]
+            pos = end
+            yield prefix + token.decode("utf-8", errors="replace"), pos
+        else:
+            end = _JSON_SCALAR.match(body, pos).end()
+            token = body[pos:end]
+            pos = end
+            yield prefix + token.decode("utf-8", errors="replace"), pos
+
+
+def _find_string_end(body: bytes, pos: int) -> int:
+    """Index just past the closing quote of a string starting before pos"""
+    while True:
+        quote = body.find(b'"', pos)
+        if quote == -1:
+            return len(body)
+        # The quote is escaped if preceded by an odd number of backslashes
+        backslashes = 0
+        while body[quote - 1 - backslashes] == 0x5C:
+            backslashes += 1
+        if backslashes % 2 == 0:
+            return quote + 1
+        pos = quote + 1
+
+
+def iter_xml(body: bytes, indent: str = "  "):
+    """
+    Re-indent XML from pull-parser events.
+
+    Elements are dropped from the tree as soon as they have been written, so
+    memory stays flat for large documents. If the document turns out to be
+    invalid, the rest of the input is passed through as text.
+    """
+    parser = XMLPullParser(events=("start", "end", "start-ns", "comment", "pi"))
+    # uri -> prefix for namespaces currently in scope
+    prefixes = {}
+    new_namespaces = []
+    open_elements = []
+    # Element whose start tag is not written yet: it becomes <a/>, <a>text</a> or an open tag
+    pending = None
+    # Last written element whose tail text is not known yet
+    closed = None
+    # Input bytes whose formatted output has been yielded
+    done = 0
+
+    def name(tag):
+        if tag[:1] != "{":
+            return tag
+        uri, local = tag[1:].split("}", 1)
+        prefix = prefixes.get(uri)
+        return f"{prefix}:{local}" if prefix else local
+
+    def start_tag(elem, namespaces):
+        parts = [name(elem.tag)]
+        for prefix, uri in namespaces:
+            parts.append(f"xmlns:{prefix}={quoteattr(uri)}" if prefix else f"xmlns={quoteattr(uri)}")
+        for key, value in elem.attrib.items():
+            parts.append(f"{name(key)}={quoteattr(value)}")
+        return "<" + " ".join(parts)
+
+    def text_line(text, depth):
+        text = text.strip()
+        return "\n" + indent * depth + escape(text) if text else ""
+
+    def flush_tail(depth):
+        nonlocal closed
+        if closed is None:
+            return ""
+        text = text_line(closed.tail or "", depth)
+        closed.clear()
+        if open_elements and len(open_elements[-1]) and open_elements[-1][0] is closed:
+            del open_elements[-1][0]
+        closed = None
+        return text
+
+    def flush_pending():
+        nonlocal pending
+        if pending is None:
+            return ""
+        elem, namespaces = pending
+        pending = None
+        depth = len(open_elements) - 1
+        return "\n" + indent * depth + start_tag(elem, namespaces) + ">" + text_line(elem.text or "", depth + 1)
+
+    try:
+        for start in range(0, len(body), CHUNK_SIZE):
+            parser.feed(body[start:start + CHUNK_SIZE])
+            out = ['<?xml version="1.0" ?>'] if start == 0 else []
+            for event, elem in parser.read_events():
+                if event == "start-ns":
+                    prefix, uri = elem
+                    prefixes[uri] = prefix
+                    new_namespaces.append(elem)
+                elif event == "start":
+                    out.append(flush_pending())
+                    out.append(flush_tail(len(open_elements)))
+                    open_elements.append(elem)
+                    pending = (elem, new_namespaces)
+                    new_namespaces = []
+                elif event == "end":
+                    open_elements.pop()
+                    depth = len(open_elements)
+                    if pending is not None and pending[0] is elem:
+                        tag = start_tag(elem, pending[1])
+                        text = (elem.text or "").strip()
+                        if text:
+                            out.append("\n" + indent * depth + tag + ">" + escape(text) + f"</{name(elem.tag)}>")
+                        else:
+                            out.append("\n" + indent * depth + tag + "/>")
+                        pending = None
+                    else:
+                        out.append(flush_tail(depth + 1))
+                        out.append("\n" + indent * depth + f"</{name(elem.tag)}>")
+                    closed = elem
+                elif event in ("comment", "pi"):
+                    out.append(flush_pending())
+                    out.append(flush_tail(len(open_elements)))
+                    depth = len(open_elements)
+                    if event == "comment":
+                        out.append("\n" + indent * depth + f"<!--{elem.text}-->")
+                    else:
+                        out.append("\n" + indent * depth + f"<?{elem.text}?>")
+            done = min(start + CHUNK_SIZE, len(body))
+            yield "".join(out), done
+        parser.close()
+        yield "\n", len(body)
+    except ParseError as e:
+        # Pass the rest through unformatted, or everything if it failed in the first slice
+        if done:
+            yield f"\n<xml parse error: {e}>\n", done
+        for text, offset in iter_text(body[done:]):
+            yield text, done + offset
@@ -0,0 +1,208 @@
+"""
+Replay captured exchanges against a target and report latency and throughput.
+
+Closed-loop mode runs --concurrency workers that each send the next request
+as soon as the previous one finished. Open-loop mode sends requests on a
+schedule, either at a fixed --rate or following the original capture timing
+sped up by --time-scale; latency is measured from the scheduled send time, so
+queueing caused by a slow target shows up in the percentiles instead of
+silently lowering the load.
+
+Usage:
+    python -m echo_proxy.replay ./captures --target http://localhost:8080 --mode open --rate 200
+"""
+
+import sys
+import json
+import time
+import asyncio
+import argparse
+from collections import Counter
+
+import httpx
+
+from .capture import CAPTURE_DIR, CaptureReader, _parse_time
+from .histogram import Histogram
+from .headers import end_to_end
+
+
+class ReplayStats:
+    def __init__(self):
+        # Latencies in microseconds
+        self.latency = Histogram()
+        self.statuses = Counter()
+        self.errors = Counter()
+        self.sent = 0
+        self.started = None
+        self.finished = None
+
+    def record(self, latency: float, status: int = None, error: str = None):
+        self.latency.record(latency * 1_000_000)
+        if error:
+            self.errors[error] += 1
+        else:
+            self.statuses[status] += 1
+
+    def summary(self) -> dict:
+        elapsed = (self.finished or time.monotonic()) - self.started
+        completed = self.latency.count
+        failed = sum(self.errors.values())
+        server_errors = sum(count for status, count in self.statuses.items() if status >= 500)
+        return {
+            "requests": completed,
+            "elapsed_s": round(elapsed, 3),
+            "throughput_rps": round(completed / elapsed, 2) if elapsed else 0.0,
+            "error_rate": round(failed / completed, 4) if completed else 0.0,
+            "server_error_rate": round(server_errors / completed, 4) if completed else 0.0,
+            "statuses": {str(status): count for status, count in sorted(self.statuses.items())},
+            "errors": dict(self.errors),
+            "latency_ms": {
+                "min": (self.latency.min or 0) / 1000,
+                "mean": round(self.latency.mean / 1000, 3),
+                "p50": self.latency.percentile(50) / 1000,
+                "p90": self.latency.percentile(90) / 1000,
+                "p95": self.latency.percentile(95) / 1000,
+                "p99": self.latency.percentile(99) / 1000,
+                "p99.9": self.latency.percentile(99.9) / 1000,
+                "max": (self.latency.max or 0) / 1000,
+            },
+        }
+
+
+def build_request(client: httpx.AsyncClient, target: str, exchange: dict) -> httpx.Request:
+    url = target.rstrip("/") + exchange["path"]
+    if exchange.get("query"):
+        url = f"{url}?{exchange['query']}"
+    # Host and content-length describe the original request; httpx sets its own
+    headers = end_to_end(exchange["request_headers"], skip={"host", "content-length"})
+    return client.build_request(exchange["method"], url, headers=headers, content=exchange["request_body"] or None)
+
+
+async def send(client: httpx.AsyncClient, target: str, exchange: dict, stats: ReplayStats, scheduled: float):
+    try:
+        response = await client.send(build_request(client, target, exchange))
+        await response.aread()
+        stats.record(time.monotonic() - scheduled, status=response.status_code)
+    except httpx.HTTPError as e:
+        stats.record(time.monotonic() - scheduled, error=type(e).__name__)
+
+
+def iter_exchanges(reader: CaptureReader, filters: dict, repeat: int):
+    """(pass number, exchange) for every exchange, `repeat` times over"""
+    for number in range(repeat):
+        for exchange in reader.exchanges(**filters):
+            yield number, exchange
+
+
+async def run_closed_loop(client, target, exchanges, stats, concurrency: int, deadline: float):
+    async def worker():
+        # The generator is shared; asyncio runs one worker at a time, so next() is safe
+        for _, exchange in exchanges:
+            if time.monotonic() >= deadline:
+                return
+            stats.sent += 1
+            await send(client, target, exchange, stats, time.monotonic())
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+async def run_open_loop(client, target, exchanges, stats, concurrency: int, deadline: float,
+                        rate: float = None, time_scale: float = 1.0):
+    in_flight = asyncio.Semaphore(concurrency)
+    tasks = set()
+    start = time.monotonic()
+    first_ts = None
+    current_pass = 0
+    scheduled = start
+
+    async def limited(exchange, scheduled):
+        async with in_flight:
+            await send(client, target, exchange, stats, scheduled)
+
+    for i, (number, exchange) in enumerate(exchanges):
+        if number != current_pass and not rate:
+            # Each repeat follows the captured pace again, starting where the previous one ended;
+            # at a fixed rate the global index already carries on across passes
+            current_pass = number
+            first_ts = None
+            start = scheduled
+        if rate:
+            offset = i / rate
+        else:
+            # Follow the captured arrival times, compressed by time_scale
+            first_ts = exchange["ts"] if first_ts is None else first_ts
+            offset = (exchange["ts"] - first_ts) / time_scale
+        scheduled = start + offset
+        if scheduled >= deadline:
+            break
+        delay = scheduled - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        stats.sent += 1
+        task = asyncio.create_task(limited(exchange, scheduled))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.gather(*tasks)
+
+
+async def replay(directory: str, target: str, mode: str = "closed", concurrency: int = 10,
+                 rate: float = None, time_scale: float = 1.0, duration: float = None,
+                 repeat: int = 1, timeout: float = 30.0, filters: dict = None) -> ReplayStats:
+    reader = CaptureReader(directory)
+    exchanges = iter_exchanges(reader, filters or {}, repeat)
+    stats = ReplayStats()
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=httpx.Timeout(timeout), limits=limits) as client:
+        stats.started = time.monotonic()
+        deadline = stats.started + duration if duration else float("inf")
+        if mode == "open":
+            await run_open_loop(client, target, exchanges, stats, concurrency, deadline, rate, time_scale)
+        else:
+            await run_closed_loop(client, target, exchanges, stats, concurrency, deadline)
+        stats.finished = time.monotonic()
+    return stats
+
+
+def print_summary(summary: dict):
+    latency = summary["latency_ms"]
+    print(f"Requests:    {summary['requests']} in {summary['elapsed_s']}s ({summary['throughput_rps']} req/s)")
+    print(f"Statuses:    {summary['statuses']}")
+    print(f"Errors:      {summary['errors'] or 'none'} (error rate {summary['error_rate']:.2%}, 5xx rate {summary['server_error_rate']:.2%})")
+    print("Latency ms:  " + "  ".join(f"{name} {value:.2f}" for name, value in latency.items()))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay captured exchanges against a target")
+    parser.add_argument("directory", nargs="?", default=CAPTURE_DIR or ".", help="capture directory")
+    parser.add_argument("--target", required=True, help="base URL to send requests to")
+    parser.add_argument("--mode", choices=("closed", "open"), default="closed")
+    parser.add_argument("--concurrency", type=int, default=10, help="closed-loop workers / max in-flight requests in open loop")
+    parser.add_argument("--rate", type=float, help="open loop: requests per second (default is the captured timing)")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="open loop: speed-up factor for the captured timing")
+    parser.add_argument("--duration", type=float, help="stop after this many seconds")
+    parser.add_argument("--repeat", type=int, default=1, help="times to go through the capture")
+    parser.add_argument("--timeout", type=float, default=30.0, help="per-request timeout in seconds")
+    parser.add_argument("--path", help="only replay paths matching this glob")
+    parser.add_argument("--method", help="only replay this HTTP method")
+    parser.add_argument("--status", help="only replay exchanges with this status or class (e.g. 2xx)")
+    parser.add_argument("--since", type=_parse_time, help="ISO time or epoch seconds")
+    parser.add_argument("--until", type=_parse_time, help="ISO time or epoch seconds")
+    parser.add_argument("--json", action="store_true", help="print the summary as JSON")
+    args = parser.parse_args(argv)
+
+    filters = dict(path=args.path, method=args.method, status=args.status, since=args.since, until=args.until)
+    stats = asyncio.run(replay(
+        args.directory, args.target, mode=args.mode, concurrency=args.concurrency,
+        rate=args.rate, time_scale=args.time_scale, duration=args.duration,
+        repeat=args.repeat, timeout=args.timeout, filters=filters,
+    ))
+    summary = stats.summary()
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print_summary(summary)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,274 @@
+"""
+Traffic shadowing to a secondary target.
+
+Once the primary response has been sent to the client, a copy of the request
+is queued for SHADOW_TARGET_URL. A few worker tasks send the copies with
+their own connection pool and compare each shadow response with the primary
+one: status, headers, and the bodies after both went through the formatter,
+so JSON (and protobuf, which the formatter renders as JSON) is compared as
+data, not as bytes. The queue is bounded; when the shadow falls behind, new
+copies are dropped and counted rather than held in memory.
+
+Every comparison is logged as a "shadow" record (the console shows the
+mismatches), and /__proxy/shadow summarizes match rates and latencies.
+"""
+
+import os
+import json
+import time
+import asyncio
+import difflib
+
+import httpx
+from colorama import Fore, Style
+
+from .formatter import format_body
+from .decoding import decode_content
+from .headers import end_to_end
+from .histogram import Histogram
+from .upstreams import Target
+
+# Secondary target that receives a copy of the traffic (disabled when empty)
+SHADOW_TARGET_URL = os.getenv("SHADOW_TARGET_URL", "")
+# Methods that are mirrored; other requests may not be safe to send twice ("*" mirrors all)
+SHADOW_METHODS = {m.strip().upper() for m in os.getenv("SHADOW_METHODS", "GET,HEAD").split(",") if m.strip()}
+# Copies waiting to be sent before new ones are dropped
+SHADOW_QUEUE_SIZE = int(os.getenv("SHADOW_QUEUE_SIZE", "100"))
+# Shadow requests in flight at once
+SHADOW_CONCURRENCY = int(os.getenv("SHADOW_CONCURRENCY", "4"))
+SHADOW_TIMEOUT = float(os.getenv("SHADOW_TIMEOUT", "10"))
+# Response headers that differ between any two deployments and are not compared
+SHADOW_IGNORE_HEADERS = {h.strip().lower() for h in os.getenv(
+    "SHADOW_IGNORE_HEADERS", "date,server,age,content-length,etag,last-modified,server-timing,x-request-id,set-cookie"
+).split(",") if h.strip()}
+# JSON object keys not compared wherever they appear, e.g. "timestamp,requestId"
+SHADOW_IGNORE_FIELDS = {f.strip() for f in os.getenv("SHADOW_IGNORE_FIELDS", "").split(",") if f.strip()}
+# Differences listed per mismatch
+SHADOW_MAX_DIFFS = int(os.getenv("SHADOW_MAX_DIFFS", "20"))
+
+SHADOW_PATH = "/__proxy/shadow"
+
+
+def json_diff(primary, shadow, path: str = "$", ignore=SHADOW_IGNORE_FIELDS, limit: int = SHADOW_MAX_DIFFS):
+    """Paths where two JSON values differ, e.g. "$.items[2].price: 9.5 != 9.9" """
+    diffs = []
+
+    def walk(a, b, path):
+        if len(diffs) >= limit:
+            return
+        if isinstance(a, dict) and isinstance(b, dict):
+            for key in sorted(set(a) | set(b), key=str):
+                if key in ignore:
+                    continue
+                if key not in b:
+                    diffs.append(f"{path}.{key}: missing in shadow")
+                elif key not in a:
+                    diffs.append(f"{path}.{key}: only in shadow")
+                else:
+                    walk(a[key], b[key], f"{path}.{key}")
+        elif isinstance(a, list) and isinstance(b, list):
+            if len(a) != len(b):
+                diffs.append(f"{path}: {len(a)} items != {len(b)} items")
+            for i, (x, y) in enumerate(zip(a, b)):
+                walk(x, y, f"{path}[{i}]")
+        elif a != b or isinstance(a, bool) != isinstance(b, bool):
+            diffs.append(f"{path}: {json.dumps(a)[:80]} != {json.dumps(b)[:80]}")
+
+    walk(primary, shadow, path)
+    return diffs
+
+
+def body_diff(primary: str, shadow: str, limit: int = SHADOW_MAX_DIFFS):
+    """Differences between two formatted bodies: by JSON path when both are JSON, else by line"""
+    try:
+        return json_diff(json.loads(primary), json.loads(shadow), limit=limit)
+    except ValueError:
+        pass
+    if primary == shadow:
+        return []
+    lines = difflib.unified_diff(primary.splitlines(), shadow.splitlines(), "primary", "shadow", n=0, lineterm="")
+    return [line for _, line in zip(range(limit), lines)]
+
+
+def header_diff(primary, shadow, ignore=SHADOW_IGNORE_HEADERS):
+    def collect(headers):
+        values = {}
+        for key, value in end_to_end(headers):
+            if key.lower() not in ignore:
+                values.setdefault(key.lower(), []).append(value)
+        return values
+
+    a, b = collect(primary), collect(shadow)
+    diffs = []
+    for name in sorted(set(a) | set(b)):
+        if name not in b:
+            diffs.append(f"header {name}: missing in shadow")
+        elif name not in a:
+            diffs.append(f"header {name}: only in shadow")
+        elif a[name] != b[name]:
+            diffs.append(f"header {name}: {', '.join(a[name])!r} != {', '.join(b[name])!r}")
+    return diffs
+
+
+def _normalized(body: bytes, headers, endpoint: str) -> str:
+    headers = httpx.Headers(headers)
+    if body and headers.get("content-encoding"):
+        body, _ = decode_content(body, headers["content-encoding"])
+    return format_body(body, headers.get("content-type", ""), endpoint)
+
+
+class ShadowStats:
+    def __init__(self):
+        self.queued = 0
+        self.shed = 0
+        self.errors = 0
+        self.compared = 0
+        self.matched = 0
+        self.mismatches = {"status": 0, "headers": 0, "body": 0}
+        # Latencies in microseconds
+        self.primary_latency = Histogram()
+        self.shadow_latency = Histogram()
+        self.shadow_slower = 0
+
+    def summary(self) -> dict:
+        def percentiles(histogram):
+            return {p: histogram.percentile(p) / 1000 for p in (50, 90, 99)}
+
+        return {
+            "queued": self.queued,
+            "shed": self.shed,
+            "errors": self.errors,
+            "compared": self.compared,
+            "matched": self.matched,
+            "match_rate": round(self.matched / self.compared, 4) if self.compared else None,
+            "mismatches": dict(self.mismatches),
+            "latency_ms": {
+                "primary": percentiles(self.primary_latency),
+                "shadow": percentiles(self.shadow_latency),
+                "mean_difference": round((self.shadow_latency.mean - self.primary_latency.mean) / 1000, 3),
+            },
+            "shadow_slower_rate": round(self.shadow_slower / self.compared, 4) if self.compared else None,
+        }
+
+
+class Shadow:
+    def __init__(self, target_url: str, log_pipeline, methods=SHADOW_METHODS, queue_size: int = SHADOW_QUEUE_SIZE,
+                 concurrency: int = SHADOW_CONCURRENCY, timeout: float = SHADOW_TIMEOUT):
+        self.target = Target(target_url)
+        self.log_pipeline = log_pipeline
+        self.methods = methods
+        self.queue_size = queue_size
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.stats = ShadowStats()
+        self.queue = None
+        self.client = None
+        self.workers = []
+
+    def start(self):
+        self.queue = asyncio.Queue(self.queue_size)
+        # Its own pool, so shadow traffic never holds connections the primary needs
+        self.client = httpx.AsyncClient(
+            timeout=self.timeout, limits=httpx.Limits(max_connections=self.concurrency))
+        self.workers = [asyncio.create_task(self._work()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+        if self.client is not None:
+            await self.client.aclose()
+        if self.stats.queued:
+            s = self.stats.summary()
+            print(f"{Fore.CYAN}Shadow: {s['compared']} compared, {s['matched']} matched, "
+                  f"{s['shed']} shed, {s['errors']} errors{Style.RESET_ALL}")
+
+    def wants(self, method: str) -> bool:
+        return "*" in self.methods or method in self.methods
+
+    async def submit(self, request_record: dict, body: bytes, response, response_body: bytes, latency: float):
+        """Queue a copy of a finished exchange; runs as a background task after the response was sent"""
+        try:
+            self.queue.put_nowait((request_record, body, response.status_code,
+                                   response.headers.multi_items(), response_body, latency))
+        except asyncio.QueueFull:
+            self.stats.shed += 1
+            return
+        self.stats.queued += 1
+
+    async def _work(self):
+        while True:
+            item = await self.queue.get()
+            try:
+                await self._compare(*item)
+            except Exception as e:
+                print(f"{Fore.RED}Shadow comparison failed: {e}{Style.RESET_ALL}")
+
+    async def _compare(self, request_record, body, status, headers, response_body, latency):
+        method, path = request_record["method"], request_record["path"]
+        url = self.target.url_for(path.lstrip("/"), request_record["query"])
+        started = time.perf_counter()
+        try:
+            request = self.client.build_request(method, url, content=body,
+                                                headers=end_to_end(request_record["headers"], skip={"host", "content-length"}))
+            # Same redirect policy as the primary request, so a redirect is not reported as a mismatch
+            response = await self.client.send(request, stream=True, follow_redirects=True)
+            try:
+                shadow_body = b"".join([chunk async for chunk in response.aiter_raw()])
+            finally:
+                await response.aclose()
+        except httpx.HTTPError as e:
+            self.stats.errors += 1
+            await self.log_pipeline.emit({"type": "shadow", "id": request_record["id"], "method": method,
+                                          "path": path, "url": url, "error": f"{type(e).__name__}: {e}"})
+            return
+        shadow_latency = time.perf_counter() - started
+
+        diffs = []
+        if response.status_code != status:
+            diffs.append(f"status {status} != {response.status_code}")
+            self.stats.mismatches["status"] += 1
+        header_diffs = header_diff(headers, response.headers.multi_items())
+        if header_diffs:
+            diffs += header_diffs
+            self.stats.mismatches["headers"] += 1
+        # Formatting is CPU work; keep it off the event loop that serves the primary traffic
+        endpoint = f"response {method} {path}"
+        primary_text, shadow_text = await asyncio.to_thread(
+            lambda: (_normalized(response_body, headers, endpoint),
+                     _normalized(shadow_body, response.headers.multi_items(), endpoint)))
+        body_diffs = body_diff(primary_text, shadow_text)
+        if body_diffs:
+            diffs += body_diffs
+            self.stats.mismatches["body"] += 1
+
+        self.stats.compared += 1
+        if not diffs:
+            self.stats.matched += 1
+        self.stats.primary_latency.record(latency * 1_000_000)
+        self.stats.shadow_latency.record(shadow_latency * 1_000_000)
+        if shadow_latency > latency:
+            self.stats.shadow_slower += 1
+        await self.log_pipeline.emit({
+            "type": "shadow",
+            "id": request_record["id"],
+            "method": method,
+            "path": path,
+            "url": url,
+            "status": response.status_code,
+            "primary_status": status,
+            "latency": shadow_latency,
+            "primary_latency": latency,
+            "diffs": diffs[:SHADOW_MAX_DIFFS],
+        })
+
+    def gauges(self) -> dict:
+        s = self.stats
+        return {
+            "echo_proxy_shadow_requests_total": (
+                "counter", "Shadow copies by outcome",
+                {(("outcome", "matched"),): s.matched, (("outcome", "mismatched"),): s.compared - s.matched,
+                 (("outcome", "error"),): s.errors, (("outcome", "shed"),): s.shed}),
+            "echo_proxy_shadow_queue_depth": ("gauge", "Shadow copies waiting to be sent", self.queue.qsize() if self.queue else 0),
+        }
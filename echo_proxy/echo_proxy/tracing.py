@@ -0,0 +1,151 @@
+"""
+Per-request timing breakdown.
+
+Upstream calls carry an httpx "trace" extension whose connection events are
+collected into spans: connect (DNS and TCP, which httpcore does not separate),
+tls, send, wait (time to the response headers) and receive; time spent in
+the admission queue comes first as a queue span. The phase totals go back to
+the client in a Server-Timing header, into the log records, and with
+TRACE_FILE set into a Chrome trace event file that Perfetto or
+chrome://tracing can open.
+
+Bodies are formatted for the log after the response has been sent, so
+formatting only shows up as a phase where it is part of the request itself,
+as in echo mode.
+"""
+
+import os
+import json
+import time
+
+# Add a Server-Timing header to proxied responses
+SERVER_TIMING = os.getenv("SERVER_TIMING", "true").lower() in ("true", "1", "yes")
+# Write the spans of every exchange to this file in Chrome trace event format (disabled when empty)
+TRACE_FILE = os.getenv("TRACE_FILE", "")
+
+# httpcore trace event names (without their "http11."/"connection." prefix) and the phase they count toward
+PHASES = {
+    "connect_tcp": "connect",
+    "connect_unix_socket": "connect",
+    "start_tls": "tls",
+    "send_connection_init": "send",
+    "send_request_headers": "send",
+    "send_request_body": "send",
+    "receive_response_headers": "wait",
+    "receive_response_body": "receive",
+}
+PHASE_ORDER = ("queue", "connect", "tls", "send", "wait", "receive", "format")
+
+
+class RequestTrace:
+    """Spans of one exchange, in seconds from the moment the proxy received the request"""
+
+    def __init__(self, origin: float):
+        # perf_counter() and wall-clock time of the request's arrival
+        self.origin = origin
+        self.started = time.time() - (time.perf_counter() - origin)
+        self.spans = []
+        self.open = {}
+
+    async def __call__(self, event_name: str, info: dict):
+        """httpx trace extension callback"""
+        name, _, stage = event_name.rpartition(".")
+        phase = PHASES.get(name.rpartition(".")[2])
+        if phase is None:
+            return
+        now = time.perf_counter() - self.origin
+        if stage == "started":
+            self.open[name] = now
+        else:
+            started = self.open.pop(name, None)
+            if started is not None:
+                self.add(phase, started, now)
+
+    def add(self, phase: str, start: float, end: float):
+        # Consecutive events of one phase (request headers, then body) form one span
+        if self.spans and self.spans[-1][0] == phase and start - self.spans[-1][2] < 1e-4:
+            self.spans[-1][2] = end
+        else:
+            self.spans.append([phase, start, end])
+
+    def phases(self) -> dict:
+        totals = {}
+        for phase, start, end in self.spans:
+            totals[phase] = totals.get(phase, 0.0) + end - start
+        return totals
+
+    def record(self) -> dict:
+        """The "timing" entry of the final log record of the exchange"""
+        return {
+            "started": self.started,
+            "total": time.perf_counter() - self.origin,
+            "phases": self.phases(),
+            "spans": [(phase, start, end - start) for phase, start, end in self.spans],
+        }
+
+    def server_timing(self) -> str:
+        phases = self.phases()
+        entries = [f"{name};dur={phases[name] * 1000:.3f}" for name in PHASE_ORDER if name in phases]
+        entries.append(f"total;dur={(time.perf_counter() - self.origin) * 1000:.3f}")
+        return ", ".join(entries)
+
+
+def describe_timing(timing: dict) -> str:
+    """One-line breakdown for the console, e.g. "52.1ms: connect 1.2ms, wait 48.0ms, receive 0.5ms" """
+    phases = timing["phases"]
+    parts = [f"{name} {phases[name] * 1000:.1f}ms" for name in PHASE_ORDER if name in phases]
+    accounted = sum(phases.values())
+    parts.append(f"proxy {max(timing['total'] - accounted, 0) * 1000:.1f}ms")
+    return f"{timing['total'] * 1000:.1f}ms: " + ", ".join(parts)
+
+
+class TraceWriter:
+    """
+    Sink that appends the spans of each finished exchange as Chrome trace events.
+
+    The file is a JSON array left open at the end, which the trace viewers
+    accept, so events can be appended as they come. Each exchange is its own
+    thread row, named after the request.
+    """
+
+    def __init__(self, path: str = TRACE_FILE):
+        # Worker processes each write their own file
+        if os.getenv("ECHO_PROXY_WORKER"):
+            root, ext = os.path.splitext(path)
+            path = f"{root}.{os.getpid()}{ext}"
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.stream = open(path, "a", encoding="utf-8")
+        if new:
+            self.stream.write("[\n")
+        self.pid = os.getpid()
+        self.requests = {}
+
+    def write(self, record: dict):
+        if record["type"] == "request":
+            self.requests[record["id"]] = f"{record['method']} {record['path']}"
+            # Exchanges that never finish are dropped eventually
+            if len(self.requests) > 10000:
+                self.requests.pop(next(iter(self.requests)))
+            return
+        timing = record.get("timing")
+        if timing is None:
+            return
+        name = self.requests.pop(record["id"], f"{record.get('method', '')} {record.get('path', '')}")
+        base = timing["started"] * 1_000_000
+        tid = record["id"]
+        events = [
+            {"ph": "M", "name": "thread_name", "pid": self.pid, "tid": tid, "args": {"name": f"#{tid} {name}"}},
+            {"ph": "X", "name": name, "cat": "exchange", "pid": self.pid, "tid": tid, "ts": round(base, 3),
+             "dur": round(timing["total"] * 1_000_000, 3), "args": {"status": record.get("status")}},
+        ]
+        for phase, start, duration in timing["spans"]:
+            events.append({"ph": "X", "name": phase, "cat": "phase", "pid": self.pid, "tid": tid,
+                           "ts": round(base + start * 1_000_000, 3), "dur": round(duration * 1_000_000, 3)})
+        for event in events:
+            self.stream.write(json.dumps(event) + ",\n")
+
+    def flush(self):
+        self.stream.flush()
+
+    def close(self):
+        self.stream.close()
@@ -0,0 +1,67 @@
+import os
+import json
+import threading
+from collections import OrderedDict
+
+# Max inferred protobuf message layouts kept in memory
+PROTOBUF_TYPEDEF_CACHE_SIZE = int(os.getenv("PROTOBUF_TYPEDEF_CACHE_SIZE", "1024"))
+# Optional file the cache is loaded from on startup and saved to on shutdown
+PROTOBUF_TYPEDEF_CACHE_FILE = os.getenv("PROTOBUF_TYPEDEF_CACHE_FILE", "")
+
+
+class TypedefCache:
+    """
+    LRU of blackboxprotobuf message typedefs keyed by endpoint.
+
+    Messages sent to the same endpoint share a schema, so the layout inferred
+    from one message is reused to decode the next ones.
+    """
+
+    def __init__(self, maxsize: int = PROTOBUF_TYPEDEF_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str):
+        with self.lock:
+            typedef = self.entries.get(key)
+            if typedef is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return typedef
+
+    def put(self, key: str, typedef: dict):
+        if self.maxsize <= 0:
+            return
+        with self.lock:
+            self.entries[key] = typedef
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def load(self, path: str = PROTOBUF_TYPEDEF_CACHE_FILE):
+        if not path or not os.path.exists(path):
+            return
+        with open(path, encoding="utf-8") as f:
+            entries = json.load(f)
+        for key, typedef in entries.items():
+            self.put(key, typedef)
+
+    def save(self, path: str = PROTOBUF_TYPEDEF_CACHE_FILE):
+        if not path:
+            return
+        with self.lock:
+            entries = dict(self.entries)
+        # Write to a temp file first so a crash never leaves a truncated cache; one per
+        # process, since every worker saves the same file on shutdown
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, path)
+
+
+typedef_cache = TypedefCache()
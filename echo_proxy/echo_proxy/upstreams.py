@@ -0,0 +1,179 @@
+"""
+Upstream target selection for TARGET_URLS.
+
+Each request goes to one of several weighted targets, picked with "power of
+two choices": two targets are drawn at random in proportion to their weight
+and the one with the lower load score wins. The score is the number of
+outstanding requests, or with UPSTREAM_BALANCER=ewma the moving average
+latency scaled by outstanding requests.
+
+Targets that fail several requests in a row (connection errors or 502/503/504)
+are ejected for a while, twice as long on each repeated ejection. With
+UPSTREAM_HEALTH_PATH set, every target is also probed in the background and
+kept out of rotation while the probe fails. If every target is out, requests
+are spread over all of them rather than refused.
+"""
+
+import os
+import time
+import random
+import asyncio
+from urllib.parse import urljoin
+
+import httpx
+from colorama import Fore, Style
+
+from .metrics import metrics
+
+# Comma-separated upstream URLs, each optionally with a weight: "http://a:8080=3,http://b:8080"
+TARGET_URLS = os.getenv("TARGET_URLS", "")
+# "least_outstanding" or "ewma"
+UPSTREAM_BALANCER = os.getenv("UPSTREAM_BALANCER", "least_outstanding").lower()
+# Consecutive failures before a target is ejected, and how long the first ejection lasts
+UPSTREAM_EJECT_AFTER = int(os.getenv("UPSTREAM_EJECT_AFTER", "3"))
+UPSTREAM_EJECT_SECONDS = float(os.getenv("UPSTREAM_EJECT_SECONDS", "10"))
+UPSTREAM_EJECT_MAX_SECONDS = float(os.getenv("UPSTREAM_EJECT_MAX_SECONDS", "300"))
+# Active health checks: path to GET on every target (disabled when empty), interval and timeout in seconds
+UPSTREAM_HEALTH_PATH = os.getenv("UPSTREAM_HEALTH_PATH", "")
+UPSTREAM_HEALTH_INTERVAL = float(os.getenv("UPSTREAM_HEALTH_INTERVAL", "10"))
+UPSTREAM_HEALTH_TIMEOUT = float(os.getenv("UPSTREAM_HEALTH_TIMEOUT", "2"))
+
+# Upstream answers that count as a failure of the target
+FAILURE_STATUSES = {502, 503, 504}
+# Weight of the newest latency sample in the moving average
+EWMA_ALPHA = 0.3
+
+
+class Target:
+    def __init__(self, url: str, weight: float = 1.0):
+        self.url = url.rstrip("/")
+        self.weight = weight
+        self.outstanding = 0
+        self.ewma = 0.0
+        self.failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        # Result of the last active health check
+        self.healthy = True
+
+    def url_for(self, path: str, query: str = "") -> str:
+        url = urljoin(self.url + "/", path)
+        return f"{url}?{query}" if query else url
+
+    def available(self, now: float) -> bool:
+        return self.healthy and now >= self.ejected_until
+
+
+def parse_targets(value: str):
+    targets = []
+    for item in (i.strip() for i in value.split(",")):
+        if not item:
+            continue
+        url, _, weight = item.rpartition("=")
+        try:
+            targets.append(Target(url, float(weight)))
+        except ValueError:
+            targets.append(Target(item))
+    return targets
+
+
+class Upstreams:
+    def __init__(self, targets, balancer: str = UPSTREAM_BALANCER, eject_after: int = UPSTREAM_EJECT_AFTER,
+                 eject_seconds: float = UPSTREAM_EJECT_SECONDS, eject_max_seconds: float = UPSTREAM_EJECT_MAX_SECONDS):
+        if balancer not in ("least_outstanding", "ewma"):
+            raise ValueError(f"Unknown UPSTREAM_BALANCER: {balancer}")
+        self.targets = targets
+        self.balancer = balancer
+        self.eject_after = eject_after
+        self.eject_seconds = eject_seconds
+        self.eject_max_seconds = eject_max_seconds
+        self.health_task = None
+
+    def choose(self) -> Target:
+        if len(self.targets) == 1:
+            return self.targets[0]
+        now = time.monotonic()
+        candidates = [t for t in self.targets if t.available(now)] or self.targets
+        if len(candidates) == 1:
+            return candidates[0]
+        a, b = random.choices(candidates, weights=[t.weight for t in candidates], k=2)
+        return a if self._score(a) <= self._score(b) else b
+
+    def _score(self, target: Target) -> float:
+        if self.balancer == "ewma":
+            return (target.ewma or 1e-3) * (target.outstanding + 1) / target.weight
+        return target.outstanding / target.weight
+
+    @staticmethod
+    def start(target: Target):
+        target.outstanding += 1
+
+    @staticmethod
+    def release(target: Target):
+        target.outstanding -= 1
+
+    def observe(self, target: Target, latency: float, status: int = None):
+        """Record the outcome of a request; status is None when no response arrived"""
+        metrics.observe_target(target.url, status, latency)
+        if status is None or status in FAILURE_STATUSES:
+            target.failures += 1
+            if target.failures >= self.eject_after and time.monotonic() >= target.ejected_until:
+                self._eject(target)
+            return
+        target.ewma = latency if not target.ewma else EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * target.ewma
+        target.failures = 0
+        target.ejections = 0
+
+    def _eject(self, target: Target):
+        duration = min(self.eject_seconds * 2 ** target.ejections, self.eject_max_seconds)
+        target.ejections += 1
+        target.ejected_until = time.monotonic() + duration
+        # Back in rotation after the ejection; one more failure sends it out again for longer
+        target.failures = self.eject_after - 1
+        print(f"{Fore.YELLOW}Upstream {target.url} ejected for {duration:.0f}s after repeated failures{Style.RESET_ALL}")
+
+    def start_health_checks(self, client: httpx.AsyncClient, path: str = UPSTREAM_HEALTH_PATH,
+                            interval: float = UPSTREAM_HEALTH_INTERVAL, timeout: float = UPSTREAM_HEALTH_TIMEOUT):
+        if path:
+            self.health_task = asyncio.create_task(self._health_loop(client, path, interval, timeout))
+
+    async def stop_health_checks(self):
+        if self.health_task is not None:
+            self.health_task.cancel()
+            try:
+                await self.health_task
+            except asyncio.CancelledError:
+                pass
+            self.health_task = None
+
+    async def _health_loop(self, client, path, interval, timeout):
+        while True:
+            await asyncio.gather(*(self._probe(client, t, path, timeout) for t in self.targets))
+            await asyncio.sleep(interval)
+
+    async def _probe(self, client, target: Target, path: str, timeout: float):
+        try:
+            response = await client.get(target.url_for(path.lstrip("/")), timeout=timeout)
+            healthy = response.status_code < 500
+        except httpx.HTTPError:
+            healthy = False
+        if healthy and not target.healthy:
+            print(f"{Fore.GREEN}Upstream {target.url} passed its health check, back in rotation{Style.RESET_ALL}")
+        elif not healthy and target.healthy:
+            print(f"{Fore.YELLOW}Upstream {target.url} failed its health check, taken out of rotation{Style.RESET_ALL}")
+        # Passive ejections run their course even when the probe passes
+        target.healthy = healthy
+
+    def gauges(self) -> dict:
+        now = time.monotonic()
+        return {
+            "echo_proxy_target_outstanding_requests": (
+                "gauge", "Requests in progress per upstream target",
+                {(("target", t.url),): t.outstanding for t in self.targets}),
+            "echo_proxy_target_available": (
+                "gauge", "1 when the target is in rotation, 0 when ejected or failing health checks",
+                {(("target", t.url),): int(t.available(now)) for t in self.targets}),
+            "echo_proxy_target_latency_ewma_seconds": (
+                "gauge", "Moving average upstream latency per target",
+                {(("target", t.url),): t.ewma for t in self.targets}),
+        }
@@ -0,0 +1,275 @@
+"""
+WebSocket proxying.
+
+The client connection is accepted once the upstream handshake succeeded, then
+two tasks relay frames in both directions until either side closes. Frames
+are passed on one at a time and never collected. Sampled frames are logged
+through the log pipeline (and formatted with format_body there); every frame
+is counted in the per-connection counters reported when the connection ends.
+"""
+
+import os
+import time
+import asyncio
+
+from fastapi import WebSocket
+from starlette.websockets import WebSocketDisconnect
+from colorama import Fore, Style
+
+from .headers import end_to_end
+from .metrics import metrics
+
+try:
+    from websockets.asyncio.client import connect as ws_connect
+    from websockets.exceptions import ConnectionClosed, InvalidHandshake, InvalidURI
+except ImportError:
+    ws_connect = None
+
+# Log every Nth frame of a connection (1 logs all)
+WS_LOG_SAMPLE = int(os.getenv("WS_LOG_SAMPLE", "1"))
+# Max frames logged per second per connection; the rest are only counted (0 is unlimited)
+WS_LOG_MAX_RATE = float(os.getenv("WS_LOG_MAX_RATE", "20"))
+# Content type used to format binary frames, e.g. application/x-protobuf (default: detect)
+WS_BINARY_CONTENT_TYPE = os.getenv("WS_BINARY_CONTENT_TYPE", "")
+# Max bytes of a frame kept for the log
+WS_LOG_FRAME_LIMIT = int(os.getenv("WS_LOG_FRAME_LIMIT", os.getenv("LOG_BODY_LIMIT", str(64 * 1024))))
+
+# Describe the client's handshake with the proxy, not the proxy's with the upstream
+HANDSHAKE_HEADERS = {
+    "host", "content-length", "sec-websocket-key", "sec-websocket-version",
+    "sec-websocket-extensions", "sec-websocket-protocol", "sec-websocket-accept",
+}
+
+# Close codes that may not be sent in a close frame
+RESERVED_CLOSE_CODES = {1005, 1006, 1015}
+
+
+class FrameSampler:
+    """Decides which frames get logged: every Nth, and at most `max_rate` per second"""
+
+    def __init__(self, every: int = WS_LOG_SAMPLE, max_rate: float = WS_LOG_MAX_RATE):
+        self.every = max(every, 1)
+        self.max_rate = max_rate
+        self.seen = 0
+        self.window_start = 0.0
+        self.window_count = 0
+        # Frames not logged since the last logged one
+        self.skipped = 0
+
+    def sample(self) -> bool:
+        self.seen += 1
+        if self.seen % self.every:
+            self.skipped += 1
+            return False
+        if self.max_rate:
+            now = time.monotonic()
+            if now - self.window_start >= 1:
+                self.window_start = now
+                self.window_count = 0
+            if self.window_count >= self.max_rate:
+                self.skipped += 1
+                return False
+            self.window_count += 1
+        return True
+
+
+class ConnectionStats:
+    """Frame and byte counters of one proxied connection, per direction"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.frames = {"client": 0, "upstream": 0}
+        self.bytes = {"client": 0, "upstream": 0}
+        self.logged = 0
+
+    def summary(self) -> dict:
+        duration = time.monotonic() - self.started
+        return {
+            "duration": duration,
+            "frames": dict(self.frames),
+            "bytes": dict(self.bytes),
+            "frames_per_second": {d: n / duration if duration else 0.0 for d, n in self.frames.items()},
+            "bytes_per_second": {d: n / duration if duration else 0.0 for d, n in self.bytes.items()},
+            "logged": self.logged,
+        }
+
+
+def websocket_url(http_url: str) -> str:
+    if http_url.startswith("https://"):
+        return "wss://" + http_url[len("https://"):]
+    if http_url.startswith("http://"):
+        return "ws://" + http_url[len("http://"):]
+    return http_url
+
+
+class WebSocketRelay:
+    def __init__(self, websocket: WebSocket, exchange_id: int, path: str, log_pipeline):
+        self.websocket = websocket
+        self.exchange_id = exchange_id
+        self.path = path
+        self.log_pipeline = log_pipeline
+        self.stats = ConnectionStats()
+        self.sampler = FrameSampler()
+
+    async def frame(self, direction: str, data):
+        """Count a frame and log it when sampled"""
+        is_text = isinstance(data, str)
+        body = data.encode("utf-8") if is_text else data
+        self.stats.frames[direction] += 1
+        self.stats.bytes[direction] += len(body)
+        metrics.observe_ws_frame(direction, len(body))
+        if not self.sampler.sample():
+            return
+        self.stats.logged += 1
+        skipped, self.sampler.skipped = self.sampler.skipped, 0
+        await self.log_pipeline.emit({
+            "type": "ws_frame",
+            "id": self.exchange_id,
+            "method": "WS",
+            "path": self.path,
+            "direction": direction,
+            "frame": self.stats.frames[direction],
+            "opcode": "text" if is_text else "binary",
+            # Text frames are detected (JSON or text); binary frames can be pinned to e.g. protobuf
+            "content_type": "" if is_text else WS_BINARY_CONTENT_TYPE,
+            "body": body[:WS_LOG_FRAME_LIMIT],
+            "body_size": len(body),
+            "skipped": skipped,
+        })
+
+    async def client_to_upstream(self, upstream):
+        while True:
+            message = await self.websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return "client", message.get("code", 1000), ""
+            data = message.get("text")
+            if data is None:
+                data = message.get("bytes") or b""
+            await self.frame("client", data)
+            try:
+                await upstream.send(data)
+            except ConnectionClosed:
+                return "upstream", upstream.close_code or 1000, upstream.close_reason or ""
+
+    async def upstream_to_client(self, upstream):
+        try:
+            async for data in upstream:
+                await self.frame("upstream", data)
+                if isinstance(data, str):
+                    await self.websocket.send_text(data)
+                else:
+                    await self.websocket.send_bytes(data)
+        except ConnectionClosed:
+            pass
+        except (WebSocketDisconnect, RuntimeError):
+            # The client went away while a frame was being sent to it
+            return "client", 1006, ""
+        return "upstream", upstream.close_code or 1000, upstream.close_reason or ""
+
+    async def echo(self):
+        """Echo mode: send every frame straight back to the client"""
+        await self.websocket.accept()
+        await self.opened("echo", None)
+        try:
+            while True:
+                message = await self.websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    await self.closed("client", message.get("code", 1000), "")
+                    return
+                data = message.get("text")
+                if data is None:
+                    data = message.get("bytes") or b""
+                await self.frame("client", data)
+                await self.frame("upstream", data)
+                if isinstance(data, str):
+                    await self.websocket.send_text(data)
+                else:
+                    await self.websocket.send_bytes(data)
+        except WebSocketDisconnect as e:
+            await self.closed("client", e.code, "")
+
+    async def relay(self, target_url: str, upstreams, target):
+        """Connect to the upstream, then relay frames in both directions until one side closes"""
+        headers = end_to_end(self.websocket.headers.items(), skip=HANDSHAKE_HEADERS)
+        subprotocols = self.websocket.scope.get("subprotocols") or None
+        url = websocket_url(target_url)
+        started = time.perf_counter()
+        upstreams.start(target)
+        try:
+            upstream = await ws_connect(
+                url,
+                additional_headers=headers,
+                subprotocols=subprotocols,
+                user_agent_header=None,
+                max_size=None,
+                proxy=None,
+            )
+        except (OSError, InvalidHandshake, InvalidURI, asyncio.TimeoutError) as e:
+            upstreams.release(target)
+            upstreams.observe(target, time.perf_counter() - started, None)
+            message = f"Failed to open WebSocket to target: {url}. Error: {e}"
+            await self.log_pipeline.emit({"type": "error", "id": self.exchange_id, "message": message, "target": target.url})
+            # Closing before accept rejects the handshake
+            await self.websocket.close(code=1011)
+            return
+        upstreams.observe(target, time.perf_counter() - started, 101)
+        metrics.websocket_connections += 1
+        try:
+            await self.websocket.accept(subprotocol=upstream.subprotocol)
+            await self.opened(url, upstream.subprotocol)
+            tasks = [
+                asyncio.create_task(self.client_to_upstream(upstream)),
+                asyncio.create_task(self.upstream_to_client(upstream)),
+            ]
+            done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            try:
+                closed_by, code, reason = done.pop().result()
+            except WebSocketDisconnect as e:
+                closed_by, code, reason = "client", e.code, ""
+            # Pass the close on to the other side
+            if code in RESERVED_CLOSE_CODES:
+                code = 1000
+            if closed_by == "client":
+                await upstream.close(code, reason)
+            else:
+                try:
+                    await self.websocket.close(code, reason)
+                except RuntimeError:
+                    # The client is already gone
+                    pass
+            await self.closed(closed_by, code, reason)
+        finally:
+            metrics.websocket_connections -= 1
+            upstreams.release(target)
+            await upstream.close()
+
+    async def opened(self, url: str, subprotocol):
+        await self.log_pipeline.emit({
+            "type": "ws_open",
+            "id": self.exchange_id,
+            "path": self.path,
+            "url": str(self.websocket.url),
+            "target_url": url,
+            "subprotocol": subprotocol,
+        })
+
+    async def closed(self, closed_by: str, code: int, reason: str):
+        await self.log_pipeline.emit({
+            "type": "ws_close",
+            "id": self.exchange_id,
+            "path": self.path,
+            "closed_by": closed_by,
+            "code": code,
+            "reason": reason,
+            **self.stats.summary(),
+        })
+
+
+def websockets_available() -> bool:
+    if ws_connect is None:
+        print(f"{Fore.YELLOW}WebSocket request received but 'websockets' is not installed (pip install 'echo-proxy[websocket]'){Style.RESET_ALL}")
+        return False
+    return True
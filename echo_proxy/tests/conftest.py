@@ -0,0 +1,4 @@
+import os
+
+# The proxy reads its configuration at import time; tests run without log output
+os.environ.setdefault("LOG_SINK", "none")
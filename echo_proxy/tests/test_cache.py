@@ -0,0 +1,35 @@
+import asyncio
+
+import httpx
+
+from echo_proxy.cache import ResponseCache
+
+
+def test_304_without_cache_headers_keeps_the_stored_max_age():
+    calls = []
+
+    async def send(headers):
+        calls.append(headers)
+        request = httpx.Request("GET", "http://upstream/item")
+        if len(calls) == 1:
+            response = httpx.Response(200, headers={"cache-control": "max-age=60", "etag": '"v1"'},
+                                      request=request)
+            return response, b"body"
+        # A bare 304 repeats none of the freshness headers
+        return httpx.Response(304, headers={"etag": '"v1"'}, request=request), b""
+
+    async def run():
+        cache = ResponseCache()
+        outcomes = [(await cache.fetch("/item", [], send))[2]]
+        # Let the stored response go stale so the next request revalidates
+        entry = next(iter(cache.entries.values()))
+        entry.stored -= 120
+        for _ in range(3):
+            outcomes.append((await cache.fetch("/item", [], send))[2])
+        return outcomes, entry
+
+    outcomes, entry = asyncio.run(run())
+    assert outcomes == ["MISS", "REVALIDATED", "HIT", "HIT"]
+    assert len(calls) == 2
+    assert ("if-none-match", '"v1"') in calls[1]
+    assert entry.lifetime == 60
@@ -0,0 +1,44 @@
+import time
+import asyncio
+
+from echo_proxy.capture import CaptureReader, CaptureWriter
+from echo_proxy.log_pipeline import LogPipeline
+
+
+class SlowSink:
+    """A console that cannot keep up"""
+
+    def __init__(self):
+        self.written = 0
+
+    def write(self, record):
+        time.sleep(0.001)
+        self.written += 1
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_capture_keeps_every_exchange_under_the_drop_policy(tmp_path):
+    console = SlowSink()
+    writer = CaptureWriter(str(tmp_path))
+
+    async def run():
+        pipeline = LogPipeline([console, writer], maxsize=2, policy="drop")
+        pipeline.start()
+        for i in range(200):
+            await pipeline.emit({"type": "request", "id": i, "method": "GET", "path": f"/item/{i}", "url": "",
+                                 "target_url": "", "headers": {}, "body": b""})
+            await pipeline.emit({"type": "response", "id": i, "status": 200, "headers": {}, "body": b"ok"})
+        await pipeline.stop()
+        return pipeline
+
+    pipeline = asyncio.run(run())
+    assert pipeline.dropped > 0
+    assert console.written < 400
+    exchanges = list(CaptureReader(str(tmp_path)).exchanges())
+    assert [e["path"] for e in exchanges] == [f"/item/{i}" for i in range(200)]
+    assert writer.pending == {}
@@ -0,0 +1,27 @@
+import asyncio
+import time
+
+from echo_proxy.faults import Fault, FaultRule
+
+
+class Timer:
+    def finish(self, status):
+        self.status = status
+
+
+async def chunks(body: bytes):
+    yield body
+
+
+def test_bandwidth_is_not_overshot():
+    # 2000 bytes at 1000 B/s go out in 512-byte slices; the last byte is due after 2 seconds
+    fault = Fault(FaultRule({"bandwidth": 1000}))
+
+    async def drain():
+        started = time.monotonic()
+        received = b"".join([part async for part in fault._body(chunks(b"x" * 2000), Timer(), 200)])
+        return received, time.monotonic() - started
+
+    received, elapsed = asyncio.run(drain())
+    assert len(received) == 2000
+    assert 1.95 <= elapsed < 2.5
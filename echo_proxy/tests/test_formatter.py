@@ -0,0 +1,53 @@
+import time
+
+import pytest
+
+from echo_proxy import formatter
+
+
+def slow_formatter(body: bytes) -> str:
+    time.sleep(30)
+    return "slow"
+
+
+def fast_formatter(body: bytes) -> str:
+    return body.decode().upper()
+
+
+calls = []
+
+
+def broken_formatter(body: bytes) -> str:
+    calls.append(body)
+    raise AttributeError("formatter bug")
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(formatter, "FORMAT_OFFLOAD", {"all"})
+    monkeypatch.setattr(formatter, "FORMAT_TIMEOUT", 0.5)
+    formatter.register_formatter("application/x-slow", slow_formatter)
+    formatter.register_formatter("application/x-fast", fast_formatter)
+    formatter.start_process_pool(1)
+    yield
+    formatter.stop_process_pool()
+
+
+def test_timed_out_formatter_does_not_starve_the_pool(pool):
+    assert formatter.format_body(b"x", "application/x-slow").startswith("<formatting timed out")
+    # The only worker is still stuck in slow_formatter unless the pool was recycled
+    started = time.monotonic()
+    assert formatter.format_body(b"abc", "application/x-fast") == "ABC"
+    assert time.monotonic() - started < 0.5
+
+
+def test_formatter_errors_propagate_without_a_second_run(pool):
+    calls.clear()
+    with pytest.raises(AttributeError, match="formatter bug"):
+        formatter._call(broken_formatter, b"x")
+    # Ran once, in the worker, not again in this process
+    assert calls == []
+
+
+def test_unpicklable_formatter_runs_in_process(pool):
+    assert formatter._call(lambda body: "local", b"x") == "local"
@@ -0,0 +1,52 @@
+import asyncio
+
+import httpx
+
+from echo_proxy import main
+
+
+# Upstream responses are built with an explicit stream: the proxy reads them with aiter_raw()
+
+
+def proxy_call(handler, method, path, **kwargs):
+    """Send one request through the proxy app to an upstream served by `handler`"""
+
+    async def call():
+        main.http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        try:
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://proxy") as client:
+                return await client.request(method, path, **kwargs)
+        finally:
+            await main.http_client.aclose()
+            main.http_client = None
+
+    return asyncio.run(call())
+
+
+def test_head_keeps_upstream_content_length():
+    def upstream(request):
+        assert request.method == "HEAD"
+        return httpx.Response(200, stream=httpx.ByteStream(b""), headers={"content-length": "1234", "content-type": "text/plain"})
+
+    response = proxy_call(upstream, "HEAD", "/file.txt")
+    assert response.status_code == 200
+    assert response.headers.get_list("content-length") == ["1234"]
+    assert response.content == b""
+
+
+def test_not_modified_keeps_upstream_content_length():
+    def upstream(request):
+        return httpx.Response(304, stream=httpx.ByteStream(b""), headers={"content-length": "99", "etag": '"v1"'})
+
+    response = proxy_call(upstream, "GET", "/doc", headers={"if-none-match": '"v1"'})
+    assert response.status_code == 304
+    assert response.headers.get_list("content-length") == ["99"]
+
+
+def test_get_content_length_matches_body():
+    def upstream(request):
+        return httpx.Response(200, stream=httpx.ByteStream(b"hello"), headers={"content-type": "text/plain"})
+
+    response = proxy_call(upstream, "GET", "/hello")
+    assert response.content == b"hello"
+    assert response.headers.get_list("content-length") == ["5"]
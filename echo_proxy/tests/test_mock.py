@@ -0,0 +1,22 @@
+from echo_proxy.mock import MockResponse
+
+
+def test_recorded_headers_are_filtered_before_replay():
+    recorded = [
+        ("Content-Type", "application/json"),
+        ("Content-Length", "2"),
+        ("Date", "Mon, 01 Jan 2024 00:00:00 GMT"),
+        ("Server", "upstream/1.0"),
+        ("Connection", "keep-alive, x-trace"),
+        ("Keep-Alive", "timeout=5"),
+        ("X-Trace", "abc"),
+        ("Transfer-Encoding", "chunked"),
+        ("ETag", '"v1"'),
+    ]
+    response = MockResponse(200, recorded, b"{}").response()
+    names = [key for key, _ in response.raw_headers]
+    assert (b"content-type", b"application/json") in response.raw_headers
+    assert (b"etag", b'"v1"') in response.raw_headers
+    assert names.count(b"content-length") == 1
+    for dropped in (b"date", b"server", b"connection", b"keep-alive", b"x-trace", b"transfer-encoding"):
+        assert dropped not in names
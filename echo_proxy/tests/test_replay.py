@@ -0,0 +1,52 @@
+import asyncio
+import time
+
+from echo_proxy import replay
+from echo_proxy.replay import ReplayStats, run_open_loop
+
+
+def test_open_loop_repeats_follow_the_captured_pace(monkeypatch):
+    sent = []
+
+    async def fake_send(client, target, exchange, stats, scheduled):
+        sent.append(time.monotonic())
+
+    monkeypatch.setattr(replay, "send", fake_send)
+    captured = [{"ts": 100.0}, {"ts": 100.2}, {"ts": 100.4}]
+    exchanges = [(number, exchange) for number in range(2) for exchange in captured]
+
+    async def run():
+        started = time.monotonic()
+        await run_open_loop(None, "http://target", exchanges, ReplayStats(), concurrency=10, deadline=float("inf"))
+        return started
+
+    started = asyncio.run(run())
+    offsets = [t - started for t in sent]
+    # The second pass starts where the first ended and keeps the 0.2 s spacing instead of bursting
+    for offset, expected in zip(offsets, [0.0, 0.2, 0.4, 0.4, 0.6, 0.8]):
+        assert abs(offset - expected) < 0.05
+    assert len(offsets) == 6
+
+
+def test_open_loop_repeats_keep_the_fixed_rate(monkeypatch):
+    sent = []
+
+    async def fake_send(client, target, exchange, stats, scheduled):
+        sent.append(time.monotonic())
+
+    monkeypatch.setattr(replay, "send", fake_send)
+    captured = [{"ts": 100.0}, {"ts": 100.5}, {"ts": 101.0}]
+    exchanges = [(number, exchange) for number in range(3) for exchange in captured]
+
+    async def run():
+        started = time.monotonic()
+        await run_open_loop(None, "http://target", exchanges, ReplayStats(), concurrency=10,
+                            deadline=float("inf"), rate=10)
+        return started
+
+    started = asyncio.run(run())
+    offsets = [t - started for t in sent]
+    # One request every 0.1 s across all passes, with no gap between them
+    assert len(offsets) == 9
+    for i, offset in enumerate(offsets):
+        assert abs(offset - i / 10) < 0.05
@@ -0,0 +1,36 @@
+import asyncio
+
+import httpx
+
+from echo_proxy.shadow import Shadow
+
+
+class Pipeline:
+    def __init__(self):
+        self.records = []
+
+    async def emit(self, record):
+        self.records.append(record)
+
+
+def test_shadow_follows_redirects_like_the_primary():
+    def upstream(request):
+        if request.url.path == "/redir":
+            return httpx.Response(302, headers={"location": "/final"}, stream=httpx.ByteStream(b""))
+        return httpx.Response(200, headers={"content-type": "application/json"}, stream=httpx.ByteStream(b'{"ok": true}'))
+
+    async def compare():
+        pipeline = Pipeline()
+        shadow = Shadow("http://shadow", pipeline)
+        shadow.client = httpx.AsyncClient(transport=httpx.MockTransport(upstream))
+        record = {"id": 1, "method": "GET", "path": "/redir", "query": "", "headers": []}
+        try:
+            await shadow._compare(record, b"", 200, [("content-type", "application/json")], b'{"ok": true}', 0.01)
+        finally:
+            await shadow.client.aclose()
+        return shadow, pipeline.records
+
+    shadow, records = asyncio.run(compare())
+    assert records[0]["status"] == 200
+    assert records[0]["diffs"] == []
+    assert shadow.stats.matched == 1
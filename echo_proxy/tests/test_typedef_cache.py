@@ -0,0 +1,19 @@
+import os
+
+from echo_proxy.typedef_cache import TypedefCache
+
+
+def test_save_uses_a_per_process_temp_file(tmp_path, monkeypatch):
+    path = str(tmp_path / "typedefs.json")
+    replaced = []
+    real_replace = os.replace
+    monkeypatch.setattr(os, "replace", lambda src, dst: (replaced.append(src), real_replace(src, dst)))
+
+    cache = TypedefCache()
+    cache.put("response GET /items application/x-protobuf", {"1": {"type": "int"}})
+    cache.save(path)
+
+    assert replaced == [f"{path}.{os.getpid()}.tmp"]
+    loaded = TypedefCache()
+    loaded.load(path)
+    assert loaded.entries == cache.entries
@@ -16,6 +16,8 @@ import time
 from http.server import HTTPServer, BaseHTTPRequestHandler
 from urllib.parse import urlparse, parse_qs, urlencode
 
+from sse import SSEReader
+
 # Shared state for OAuth callback
 oauth_state = {
     "code": None,
@@ -413,8 +415,22 @@ def main():
         }
 
 
-        response = session.post(f"{mcp_url}?transportType=streamable-http", json=test_payload, headers={"Content-Type": "application/json", "Accept": "application/json, text/event-stream", "Authorization": f"Bearer {token_info['access_token']}"})
-        print(f"   Response: {response.status_code} - {response.text}")
+        # Read the reply as it streams in, so notifications are printed the moment they arrive
+        started = time.perf_counter()
+        response = session.post(f"{mcp_url}?transportType=streamable-http", json=test_payload, stream=True, headers={"Content-Type": "application/json", "Accept": "application/json, text/event-stream", "Authorization": f"Bearer {token_info['access_token']}"})
+        print(f"   Response: {response.status_code} ({response.headers.get('content-type', '')})")
+        reader = SSEReader(
+            on_response=lambda message: print(f"   +{(time.perf_counter() - started) * 1000:.1f} ms response: {json.dumps(message)}"),
+            on_notification=lambda message: print(f"   +{(time.perf_counter() - started) * 1000:.1f} ms {message['method']}: {json.dumps(message.get('params', {}))}"),
+            started=started,
+        )
+        if response.status_code == 200:
+            reader.read(response)
+            timing = reader.timing.summary()
+            print(f"   ⏱️  {timing['events']} event(s), first after {timing['ttfe_ms']} ms, longest gap {timing['max_gap_ms']} ms")
+        else:
+            print(f"   {response.text}")
+        response.close()
         
         print("🛑 Shutting down server...")
         server.shutdown()
@@ -0,0 +1,124 @@
+"""
+On-disk cache of what an MCP server told us, so a new run can skip the
+handshake and the listings.
+
+One JSON file per server URL and protocol version holds the initialize
+result (capabilities, server info), the session id when the server issued
+one, and the tools, resources and prompts listings. Listings are kept page by
+page together with the cursor of the next page, so a partly read listing
+resumes where it stopped instead of being fetched again from the start.
+
+A listing is dropped when the server sends notifications/<kind>/list_changed
+or when it is older than MCP_CACHE_TTL; the handshake and session expire
+after MCP_CACHE_TTL as well. A cached session id that the server no longer knows is answered
+with 404, and the client then starts a new session (see MCPClient).
+"""
+
+import os
+import json
+import time
+import hashlib
+
+# Directory for the cache files
+MCP_CACHE_DIR = os.getenv("MCP_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "mcp-client"))
+# Seconds a cached handshake or listing is used before it is fetched again
+MCP_CACHE_TTL = float(os.getenv("MCP_CACHE_TTL", "3600"))
+
+LIST_KINDS = ("tools", "resources", "prompts")
+
+
+class Listing:
+    """The pages of one list method read so far, and the cursor of the next one"""
+
+    def __init__(self, pages=None, next_cursor=None, complete=False, fetched=None):
+        self.pages = pages or []
+        self.next_cursor = next_cursor
+        self.complete = complete
+        self.fetched = time.time() if fetched is None else fetched
+
+    def add(self, items: list, next_cursor):
+        self.pages.append(items)
+        self.next_cursor = next_cursor
+        self.complete = not next_cursor
+
+    def to_dict(self) -> dict:
+        return {"pages": self.pages, "next_cursor": self.next_cursor, "complete": self.complete, "fetched": self.fetched}
+
+
+class MCPCache:
+    def __init__(self, url: str, protocol_version: str, directory: str = MCP_CACHE_DIR, ttl: float = MCP_CACHE_TTL,
+                 resume: bool = True):
+        self.url = url
+        self.protocol_version = protocol_version
+        self.ttl = ttl
+        # Whether a cached session id may be reused; off when several clients share the cache
+        self.resume = resume
+        key = hashlib.sha256(f"{url}\n{protocol_version}".encode()).hexdigest()[:24]
+        self.path = os.path.join(directory, f"{key}.json")
+        self.entry = self._load()
+
+    def _load(self) -> dict:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        # A hash collision or a file from elsewhere is as good as no entry
+        if entry.get("url") != self.url or entry.get("protocol_version") != self.protocol_version:
+            return {}
+        if time.time() - entry.get("initialized", 0) > self.ttl:
+            entry.pop("initialize", None)
+            entry.pop("session_id", None)
+        return entry
+
+    def save(self):
+        self.entry.update(url=self.url, protocol_version=self.protocol_version)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # Written aside and renamed, so a reader never sees half a file
+        temporary = f"{self.path}.{os.getpid()}.tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump(self.entry, f)
+        os.replace(temporary, self.path)
+
+    def handshake(self):
+        """
+        The cached initialize result and session id (None for a server without
+        sessions), or (None, None) when there is nothing to resume
+        """
+        if "initialize" not in self.entry or not self.resume:
+            return None, None
+        return self.entry["initialize"], self.entry.get("session_id")
+
+    def store_handshake(self, result: dict, session_id: str):
+        # Listings belong to the server, not the session, and are kept; they expire on their own
+        self.entry = {"initialize": result, "initialized": time.time(), "lists": self.entry.get("lists", {})}
+        if session_id:
+            self.entry["session_id"] = session_id
+        self.save()
+
+    def forget_session(self):
+        # Without its session the handshake cannot be reused either; the listings can
+        self.entry.pop("session_id", None)
+        if self.entry.pop("initialize", None) is not None:
+            self.save()
+
+    def listing(self, kind: str) -> Listing:
+        stored = self.entry.get("lists", {}).get(kind)
+        if stored is None or time.time() - stored["fetched"] > self.ttl:
+            return Listing()
+        return Listing(**stored)
+
+    def store_listing(self, kind: str, listing: Listing):
+        self.entry.setdefault("lists", {})[kind] = listing.to_dict()
+        self.save()
+
+    def invalidate(self, kind: str):
+        if self.entry.get("lists", {}).pop(kind, None) is not None:
+            self.save()
+
+    def clear(self):
+        self.entry = {}
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
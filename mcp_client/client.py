@@ -0,0 +1,336 @@
+"""
+Reusable MCP client over streamable HTTP.
+
+MCPClient holds one pooled httpx.AsyncClient for the whole session, so calls
+reuse open connections instead of connecting each time. Request ids come from
+a per-client counter and only ever increase. Every request registers a future
+under its id, and every JSON-RPC response that arrives, on whichever reply
+stream, resolves the future with the same id. That is what allows several
+requests to be in flight at once (pipelining, via asyncio.gather) and a
+JSON-RPC batch array to be sent in one POST.
+
+With an MCPCache, the handshake and the tools, resources and prompts
+listings are kept on disk between runs (see cache.py); list() reads a
+listing lazily, one page per request, as the caller iterates.
+
+Batches were added in protocol version 2025-03-26 and removed again in
+2025-06-18. When the server refuses a batch, the client sends the calls
+pipelined instead and stops batching for the rest of the session.
+"""
+
+import asyncio
+import itertools
+import time
+
+import httpx
+
+from sse import SSEReader
+from cache import LIST_KINDS, Listing
+
+PROTOCOL_VERSION = "2025-06-18"
+CLIENT_INFO = {"name": "mcp-client", "version": "0.1.0"}
+CAPABILITIES = {"sampling": {}, "elicitation": {}, "roots": {"listChanged": True}}
+
+
+def _is_notification(call) -> bool:
+    return len(call) > 2 and bool(call[2])
+
+
+class MCPError(Exception):
+    """A JSON-RPC error answer (code), a refused HTTP request (status), or a missing answer"""
+
+    def __init__(self, message: str, code: int = None, data=None, status: int = None):
+        super().__init__(f"{message} ({code})" if code is not None else message)
+        self.code = code
+        self.data = data
+        # HTTP status when the server refused the request outright
+        self.status = status
+
+
+class MCPClient:
+    """
+    An MCP session. Use as `async with MCPClient(url) as mcp:`, which
+    initializes it, or call initialize() and close() yourself.
+
+    `on_notification(message)` is called with every notification as it
+    arrives, and `on_reply(payload, reader)` after every reply was read, with
+    the sent payload (a dict, or a list for a batch) and its SSEReader.
+    """
+
+    def __init__(self, url: str, protocol_version: str = PROTOCOL_VERSION, http: httpx.AsyncClient = None,
+                 max_connections: int = 10, timeout: float = 30, headers: dict = None,
+                 on_notification=None, on_reply=None, cache=None):
+        self.url = url
+        self.protocol_version = protocol_version
+        # A client passed in is shared (e.g. by many sessions) and not closed here
+        self.owns_http = http is None
+        self.http = http or httpx.AsyncClient(timeout=timeout, limits=httpx.Limits(
+            max_connections=max_connections, max_keepalive_connections=max_connections))
+        self.extra_headers = headers or {}
+        self.on_notification = on_notification
+        self.on_reply = on_reply
+        self.ids = itertools.count()
+        # Request id -> future of its response message
+        self.pending = {}
+        self.session_id = None
+        self.server_info = None
+        self.capabilities = {}
+        self.batching = True
+        self.cache = cache
+        # Set while the session is one taken from the cache, which the server may have forgotten
+        self.resumed = False
+        # Held while a forgotten session is replaced, so concurrent requests start one new session between them
+        self.session_lock = asyncio.Lock()
+        # Kind ("tools", ...) -> Listing read so far
+        self.listings = {}
+        # Kind -> lock held while a page of it is fetched, so concurrent iterations request each page once
+        self.list_locks = {}
+
+    async def __aenter__(self):
+        try:
+            await self.initialize()
+        except BaseException:
+            await self.close()
+            raise
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def headers(self) -> dict:
+        headers = {
+            "accept": "application/json, text/event-stream",
+            "content-type": "application/json",
+            "mcp-protocol-version": self.protocol_version,
+            **self.extra_headers,
+        }
+        if self.session_id:
+            headers["mcp-session-id"] = self.session_id
+        return headers
+
+    def message(self, method: str, params: dict = None, notification: bool = False) -> dict:
+        message = {"jsonrpc": "2.0", "method": method}
+        if not notification:
+            message["id"] = next(self.ids)
+        if params is not None:
+            message["params"] = params
+        return message
+
+    async def initialize(self, capabilities: dict = CAPABILITIES, client_info: dict = CLIENT_INFO,
+                         resume: bool = True) -> dict:
+        if self.cache is not None and resume:
+            result, session_id = self.cache.handshake()
+            if result is not None:
+                self._adopt(result)
+                self.session_id = session_id
+                self.resumed = True
+                return result
+        self.session_id = None
+        result = await self.request("initialize", {
+            "protocolVersion": self.protocol_version,
+            "capabilities": capabilities,
+            "clientInfo": client_info,
+        })
+        self._adopt(result)
+        await self.notify("notifications/initialized")
+        if self.cache is not None:
+            self.cache.store_handshake(result, self.session_id)
+        return result
+
+    def _adopt(self, result: dict):
+        # The server may answer with an older version it supports; later requests announce that one
+        self.protocol_version = result.get("protocolVersion") or self.protocol_version
+        self.capabilities = result.get("capabilities", {})
+        self.server_info = result.get("serverInfo")
+
+    async def request(self, method: str, params: dict = None):
+        """Send one request and return its result; raises MCPError for an error answer"""
+        message = self.message(method, params)
+        future = self._expect(message)
+        try:
+            await self._post(message)
+        except BaseException:
+            self.pending.pop(message["id"], None)
+            raise
+        return self._result(message, future)
+
+    async def notify(self, method: str, params: dict = None):
+        await self._post(self.message(method, params, notification=True))
+
+    async def gather(self, *calls, return_exceptions: bool = False):
+        """
+        Send (method, params) calls at once, each in its own POST over the
+        pooled connections, and return their results in the same order.
+        """
+        return await asyncio.gather(*(self.request(method, params) for method, params in calls),
+                                    return_exceptions=return_exceptions)
+
+    async def batch(self, *calls, return_exceptions: bool = False):
+        """
+        Send (method, params) calls as one JSON-RPC batch array and return their
+        results in the same order. A call given as (method, params, True) is a
+        notification and yields None. Falls back to gather() when the server
+        does not take batches.
+        """
+        if not self.batching:
+            return await self._unbatched(calls, return_exceptions)
+        messages = [self.message(call[0], call[1], _is_notification(call)) for call in calls]
+        futures = [self._expect(m) if "id" in m else None for m in messages]
+        try:
+            reader = await self._post(messages)
+        except BaseException as e:
+            for m in messages:
+                self.pending.pop(m.get("id"), None)
+            if not (isinstance(e, MCPError) and e.status == 400):
+                raise
+            reader = None
+        # Refused either with 400 or with one error answer (id null) for the whole array
+        if reader is None or (not any(f.done() for f in futures if f is not None)
+                              and any(r.get("id") is None and "error" in r for r in reader.responses)):
+            for m in messages:
+                self.pending.pop(m.get("id"), None)
+            self.batching = False
+            return await self._unbatched(calls, return_exceptions)
+        results = []
+        for m, future in zip(messages, futures):
+            try:
+                results.append(self._result(m, future) if future is not None else None)
+            except MCPError as e:
+                if not return_exceptions:
+                    raise
+                results.append(e)
+        return results
+
+    async def list(self, kind: str):
+        """
+        Iterate over the items of tools/list, resources/list or prompts/list.
+        Pages are requested with their cursor only when the iteration gets to
+        them, so stopping early saves the rest; pages read before, in this
+        session or in the cache, are not requested again.
+        """
+        if kind not in LIST_KINDS:
+            raise ValueError(f"Unknown list kind {kind!r}, expected one of {', '.join(LIST_KINDS)}")
+        listing = self._listing(kind)
+        index = 0
+        while True:
+            while index < len(listing.pages):
+                for item in listing.pages[index]:
+                    yield item
+                index += 1
+            if listing.complete:
+                return
+            async with self.list_locks.setdefault(kind, asyncio.Lock()):
+                # Another iteration may have fetched the page while this one waited
+                if index < len(listing.pages) or listing.complete:
+                    continue
+                result = await self.request(f"{kind}/list", {"cursor": listing.next_cursor} if listing.next_cursor else None)
+                listing.add(result.get(kind, []), result.get("nextCursor"))
+                # Not stored when a list_changed notification replaced the listing meanwhile
+                if self.cache is not None and self.listings.get(kind) is listing:
+                    self.cache.store_listing(kind, listing)
+
+    async def find(self, kind: str, name: str):
+        """The first item of a listing with this name (or uri), reading no further pages than needed"""
+        async for item in self.list(kind):
+            if item.get("name") == name or item.get("uri") == name:
+                return item
+        return None
+
+    def _listing(self, kind: str) -> Listing:
+        listing = self.listings.get(kind)
+        if listing is None or self.cache is not None and time.time() - listing.fetched > self.cache.ttl:
+            listing = self.cache.listing(kind) if self.cache is not None else Listing()
+            self.listings[kind] = listing
+        return listing
+
+    def _notification(self, message: dict):
+        method = message.get("method", "")
+        if method.startswith("notifications/") and method.endswith("/list_changed"):
+            kind = method.split("/")[1]
+            self.listings.pop(kind, None)
+            if self.cache is not None:
+                self.cache.invalidate(kind)
+        if self.on_notification:
+            self.on_notification(message)
+
+    async def _unbatched(self, calls, return_exceptions):
+        for call in calls:
+            if _is_notification(call):
+                await self.notify(call[0], call[1])
+        results = iter(await self.gather(*((c[0], c[1]) for c in calls if not _is_notification(c)),
+                                         return_exceptions=return_exceptions))
+        return [None if _is_notification(call) else next(results) for call in calls]
+
+    def _expect(self, message: dict):
+        future = asyncio.get_running_loop().create_future()
+        self.pending[message["id"]] = future
+        return future
+
+    def _result(self, message: dict, future):
+        self.pending.pop(message["id"], None)
+        if not future.done():
+            raise MCPError(f"No response to {message['method']} (id {message['id']})")
+        response = future.result()
+        if "error" in response:
+            error = response["error"]
+            raise MCPError(error.get("message", "error"), error.get("code"), error.get("data"))
+        return response.get("result", {})
+
+    def _response(self, message: dict):
+        future = self.pending.get(message.get("id"))
+        if future is not None and not future.done():
+            future.set_result(message)
+
+    async def _post(self, payload):
+        session_id = self.session_id
+        try:
+            return await self._send(payload)
+        except MCPError as e:
+            # A 404 for the current session that was not resumed is the server's answer to pass on
+            if e.status != 404 or session_id is None or session_id == self.session_id and not self.resumed:
+                raise
+            error = e
+        async with self.session_lock:
+            if session_id == self.session_id:
+                if not self.resumed:
+                    raise error
+                # The first request to find the cached session forgotten starts a new one
+                self.resumed = False
+                self.cache.forget_session()
+                await self.initialize(resume=False)
+        # Sent with a session that has been replaced meanwhile: send once more with the new one
+        return await self._send(payload)
+
+    async def _send(self, payload):
+        reader = SSEReader(on_response=self._response, on_notification=self._notification,
+                           started=time.perf_counter())
+        async with self.http.stream("POST", self.url, json=payload, headers=self.headers()) as response:
+            if response.status_code >= 400:
+                await response.aread()
+                raise MCPError(f"HTTP {response.status_code}: {response.text[:200]}", status=response.status_code)
+            if self.session_id is None:
+                # Assigned by the server in its answer to initialize
+                self.session_id = response.headers.get("mcp-session-id")
+            await reader.aread(response)
+        if self.on_reply:
+            self.on_reply(payload, reader)
+        return reader
+
+    async def close(self):
+        """
+        End the session on the server (if it supports that) and release the
+        connections. A session kept in a cache for resuming is left open.
+        """
+        for future in self.pending.values():
+            future.cancel()
+        self.pending.clear()
+        try:
+            if self.session_id and not (self.cache is not None and self.cache.resume):
+                try:
+                    await self.http.delete(self.url, headers=self.headers())
+                except httpx.HTTPError:
+                    pass
+                self.session_id = None
+        finally:
+            if self.owns_http:
+                await self.http.aclose()
@@ -0,0 +1,2 @@
+# The client modules are plain scripts next to each other (client.py, sse.py, cache.py);
+# pytest puts this directory on sys.path because of this file, so tests import them the same way.
@@ -1,81 +1,313 @@
 #!/usr/bin/env python3
+"""
+MCP load-testing client.
+
+Opens N concurrent MCP sessions over streamable HTTP, each with its own
+mcp-session-id, and has every session run a script of tools/list and
+tools/call requests at a target rate. At the end it reports how long the
+sessions took to establish and, per method, latency percentiles and error
+rates.
+
+With --list it instead prints the tools, resources or prompts of the server,
+taking the handshake and the listing from the on-disk cache when it can.
+"""
 
 import os
-import requests
+import json
+import time
+import random
+import asyncio
+import argparse
+import itertools
 
-def main():
-    base_url = os.getenv("BASE_URL", "http://localhost:9090/mcp")
-
-    # Initialize connection
-    init_payload = {
-        "jsonrpc": "2.0",
-        "id": 0,
-        "method": "initialize",
-        "params": {
-            "protocolVersion": "2025-06-18",
-            "capabilities": {
-                "sampling": {},
-                "elicitation": {},
-                "roots": {
-                    "listChanged": True
-                }
-            },
-            "clientInfo": {
-                "name": "mcp-inspector",
-                "version": "0.16.8"
-            }
-        }
-    }
-
-    # Base headers for initialization
-    init_headers = {
-        "Content-Type": "application/json",
-        "Accept": "application/json, text/event-stream",
-    }
-
-    print("Initializing MCP connection...")
-    response = requests.post(f"{base_url}", json=init_payload, headers=init_headers)
-    print(f"Status code: {response.status_code}")
-    print(f"Response headers: {dict(response.headers)}")
-    print(f"Response text: {response.text}")
-    session_id = response.headers.get("mcp-session-id")
-
-    # initialize notifications
-
-    notify_payload = {
-        "jsonrpc": "2.0",
-        "method": "notifications/initialized"
-    }
-
-    # Common headers for MCP requests with session
-    common_headers = {
-        "accept": "application/json, text/event-stream",
-        "content-type": "application/json",
-        "mcp-protocol-version": "2025-06-18",
-        "mcp-session-id": session_id,
-        "user-agent": "node-fetch"
-    }
-
-    print(f"\nSending notifications/initialized with session_id: {session_id}")
-    response = requests.post(f"{base_url}", json=notify_payload, headers=common_headers)
-    print(f"Notifications init response: {response.text}")
-
-
-    # List tools
-    tools_payload = {
-        "jsonrpc": "2.0",
-        "id": 1,
-        "method": "tools/list",
-        "params": {
-            "_meta": {
-                "progressToken": 1
-            }
+import httpx
+
+from cache import LIST_KINDS, MCPCache
+from client import MCPClient, MCPError, PROTOCOL_VERSION
+
+BASE_URL = os.getenv("BASE_URL", "http://localhost:9090/mcp")
+
+# Used when no --script is given
+DEFAULT_SCRIPT = [
+    {"method": "tools/list", "params": {"_meta": {"progressToken": 1}}},
+]
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * p / 100), len(ordered) - 1)]
+
+
+def load_script(path):
+    """
+    A script is a JSON list of steps, run in order and repeated:
+    {"method": "tools/call", "params": {"name": "echo", "arguments": {...}}}.
+    A step may set "weight" instead, and then every request picks one step at
+    random in proportion to the weights.
+    """
+    if not path:
+        return DEFAULT_SCRIPT
+    with open(path, encoding="utf-8") as f:
+        script = json.load(f)
+    if not isinstance(script, list) or not all(isinstance(s, dict) and "method" in s for s in script):
+        raise ValueError(f"{path}: expected a JSON list of steps with a \"method\"")
+    return script
+
+
+class MethodStats:
+    def __init__(self):
+        # Latencies of answered requests in seconds
+        self.latencies = []
+        self.errors = 0
+        self.error_kinds = {}
+        # Replies sent as event streams: time to first event and gaps between events, in seconds
+        self.streamed = 0
+        self.ttfe = []
+        self.gaps = []
+
+    def error(self, kind):
+        self.errors += 1
+        self.error_kinds[kind] = self.error_kinds.get(kind, 0) + 1
+
+    @property
+    def count(self):
+        return len(self.latencies) + self.errors
+
+
+class LoadStats:
+    def __init__(self):
+        self.methods = {}
+        self.established = []
+        self.failed_sessions = 0
+        self.notifications = {}
+        self.started = time.perf_counter()
+        self.finished = None
+
+    def method(self, name):
+        return self.methods.setdefault(name, MethodStats())
+
+    def observe(self, method, reader):
+        """Record the stream timing of a reply read by an SSEReader"""
+        if reader.streamed and reader.timing.first_event is not None:
+            stats = self.method(method)
+            stats.streamed += 1
+            stats.ttfe.append(reader.timing.first_event)
+            stats.gaps += reader.timing.gaps
+
+    def notification(self, message):
+        self.notifications[message["method"]] = self.notifications.get(message["method"], 0) + 1
+
+    def report(self):
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        total = sum(s.count for s in self.methods.values())
+        ms = lambda values, p: percentile(values, p) * 1000
+
+        print(f"\nSessions: {len(self.established)} established, {self.failed_sessions} failed")
+        if self.established:
+            print(f"  establishment p50 {ms(self.established, 50):.1f} ms, p90 {ms(self.established, 90):.1f} ms, "
+                  f"p99 {ms(self.established, 99):.1f} ms, max {max(self.established) * 1000:.1f} ms")
+        print(f"\n{'method':<16} {'count':>7} {'errors':>7} {'err %':>7} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+        for name, s in sorted(self.methods.items()):
+            rate = s.errors / s.count * 100 if s.count else 0.0
+            worst = max(s.latencies) * 1000 if s.latencies else 0.0
+            print(f"{name:<16} {s.count:>7} {s.errors:>7} {rate:>6.1f}% {ms(s.latencies, 50):>9.1f} "
+                  f"{ms(s.latencies, 90):>9.1f} {ms(s.latencies, 99):>9.1f} {worst:>9.1f}")
+            for kind, count in sorted(s.error_kinds.items()):
+                print(f"  {kind}: {count}")
+        streamed = {name: s for name, s in self.methods.items() if s.streamed}
+        if streamed:
+            print(f"\n{'streamed':<16} {'count':>7} {'ttfe p50':>9} {'ttfe p99':>9} {'gap p50':>9} {'gap p99':>9} {'gap max':>9}")
+            for name, s in sorted(streamed.items()):
+                print(f"{name:<16} {s.streamed:>7} {ms(s.ttfe, 50):>9.1f} {ms(s.ttfe, 99):>9.1f} "
+                      f"{ms(s.gaps, 50):>9.1f} {ms(s.gaps, 99):>9.1f} {max(s.gaps, default=0) * 1000:>9.1f}")
+        if self.notifications:
+            print("\nNotifications: " + ", ".join(f"{name} {count}" for name, count in sorted(self.notifications.items())))
+        print(f"\n{total} requests in {elapsed:.1f}s ({total / elapsed if elapsed else 0:.1f} req/s)")
+
+    def summary(self):
+        def percentiles(values):
+            return {f"p{p}_ms": round(percentile(values, p) * 1000, 3) for p in (50, 90, 99)}
+
+        return {
+            "sessions": {"established": len(self.established), "failed": self.failed_sessions,
+                         "establishment": percentiles(self.established)},
+            "methods": {name: {"count": s.count, "errors": s.errors, "error_kinds": s.error_kinds, **percentiles(s.latencies),
+                               "streamed": s.streamed, "ttfe": percentiles(s.ttfe), "gaps": percentiles(s.gaps)}
+                        for name, s in self.methods.items()},
+            "notifications": self.notifications,
+            "elapsed_s": round((self.finished or time.perf_counter()) - self.started, 3),
         }
-    }
 
-    print("\nRequesting list of tools...")
-    response = requests.post(f"{base_url}", json=tools_payload, headers=common_headers)
-    print(f"Tools response: {response.text}")
+
+def error_kind(error):
+    if isinstance(error, MCPError):
+        if error.status is not None:
+            return f"HTTP {error.status}"
+        if error.code is not None:
+            return f"JSON-RPC {error.code}"
+        return "no response"
+    return type(error).__name__
+
+
+async def run_session(number, http, args, script, stats, deadline):
+    def on_reply(payload, reader):
+        if isinstance(payload, dict) and "id" in payload:
+            stats.observe(payload["method"], reader)
+        if args.verbose:
+            for message in reader.responses:
+                print(f"[{number}] {payload.get('method', 'batch')} -> {json.dumps(message)}")
+
+    def on_notification(message):
+        stats.notification(message)
+        if args.verbose:
+            print(f"[{number}] {message['method']}: {json.dumps(message.get('params', {}))}")
+
+    mcp = MCPClient(args.url, http=http, headers={"user-agent": "mcp-load-client"},
+                    on_notification=on_notification, on_reply=on_reply)
+    started = time.perf_counter()
+    try:
+        await mcp.initialize(client_info={"name": "mcp-load-client", "version": "0.1.0"})
+    except (httpx.HTTPError, MCPError, ValueError) as e:
+        stats.failed_sessions += 1
+        print(f"Session {number} failed to initialize: {type(e).__name__}: {e}")
+        await mcp.close()
+        return
+    stats.established.append(time.perf_counter() - started)
+
+    weighted = all("weight" in step for step in script)
+    weights = [step["weight"] for step in script] if weighted else None
+    # Each session paces itself on its share of the target rate
+    interval = args.sessions / args.rate if args.rate else 0.0
+    steps = itertools.count()
+    total = args.iterations * len(script) if args.iterations else None
+    next_at = time.perf_counter()
+
+    async def worker():
+        nonlocal next_at
+        for i in steps:
+            if total is not None and i >= total or deadline and time.perf_counter() >= deadline:
+                return
+            if interval:
+                next_at += interval
+                delay = next_at - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            step = random.choices(script, weights)[0] if weighted else script[i % len(script)]
+            method = step["method"]
+            sent = time.perf_counter()
+            try:
+                result = await mcp.request(method, step.get("params"))
+            except (MCPError, httpx.HTTPError) as e:
+                stats.method(method).error(error_kind(e))
+                continue
+            except ValueError:
+                stats.method(method).error("invalid JSON")
+                continue
+            if method == "tools/call" and result.get("isError"):
+                stats.method(method).error("tool error")
+            else:
+                stats.method(method).latencies.append(time.perf_counter() - sent)
+
+    try:
+        # Several workers keep that many requests of this session in flight
+        await asyncio.gather(*(worker() for _ in range(args.pipeline)))
+    finally:
+        await mcp.close()
+
+
+async def run(args):
+    script = load_script(args.script)
+    stats = LoadStats()
+    # One pool shared by all sessions, with a connection for every request that can be in flight
+    connections = args.sessions * args.pipeline
+    limits = httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as http:
+        deadline = time.perf_counter() + args.ramp_up + args.duration if args.duration else None
+        tasks = []
+        for number in range(args.sessions):
+            tasks.append(asyncio.create_task(run_session(number, http, args, script, stats, deadline)))
+            if args.ramp_up:
+                await asyncio.sleep(args.ramp_up / args.sessions)
+        try:
+            await asyncio.gather(*tasks)
+        except asyncio.CancelledError:
+            pass
+    stats.finished = time.perf_counter()
+    if args.json:
+        print(json.dumps(stats.summary(), indent=2))
+    else:
+        stats.report()
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(stats.summary(), f, indent=2)
+        print(f"Report written to {args.output}")
+
+
+async def inspect(args):
+    """Print one listing of the server, requesting only what the cache does not have"""
+    cache = None if args.no_cache else MCPCache(args.url, PROTOCOL_VERSION)
+    if cache is not None and args.clear_cache:
+        cache.clear()
+    requests = []
+
+    def on_reply(payload, reader):
+        requests.append(payload.get("method", "batch") if isinstance(payload, dict) else "batch")
+
+    started = time.perf_counter()
+    async with MCPClient(args.url, timeout=args.timeout, cache=cache, on_reply=on_reply) as mcp:
+        resumed = mcp.resumed
+        count = 0
+        if args.find:
+            item = await mcp.find(args.list, args.find)
+            if item is not None:
+                count = 1
+                print(json.dumps(item, indent=2))
+        else:
+            async for item in mcp.list(args.list):
+                count += 1
+                description = (item.get("description") or "").splitlines()[0] if item.get("description") else ""
+                print(f"{item.get('name') or item.get('uri')}  {description}".rstrip())
+                if args.limit and count >= args.limit:
+                    break
+    elapsed = (time.perf_counter() - started) * 1000
+    handshake = "resumed from cache" if resumed and "initialize" not in requests else "initialized"
+    print(f"\n{count} {args.list}; session {handshake}; {len(requests)} request(s) sent "
+          f"({', '.join(requests) or 'none'}) in {elapsed:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent MCP load-testing client")
+    parser.add_argument("--url", default=BASE_URL, help="MCP endpoint (default: $BASE_URL or %(default)s)")
+    parser.add_argument("-n", "--sessions", type=int, default=1, help="concurrent MCP sessions")
+    parser.add_argument("--script", help="JSON file with the steps every session runs (default: tools/list)")
+    parser.add_argument("--rate", type=float, default=0, help="target requests per second across all sessions (0 = as fast as possible)")
+    parser.add_argument("--duration", type=float, default=0, help="seconds to run; overrides --iterations")
+    parser.add_argument("--iterations", type=int, default=1, help="times every session runs the script")
+    parser.add_argument("--pipeline", type=int, default=1, help="requests every session keeps in flight at once")
+    parser.add_argument("--ramp-up", type=float, default=0, help="seconds over which sessions are opened")
+    parser.add_argument("--timeout", type=float, default=30, help="per-request timeout in seconds")
+    parser.add_argument("--output", help="also write the report as JSON to this file")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON instead of the table")
+    parser.add_argument("-v", "--verbose", action="store_true", help="print every response")
+    parser.add_argument("--list", choices=LIST_KINDS, help="print this listing of the server instead of running a load test")
+    parser.add_argument("--limit", type=int, default=0, help="with --list, stop after this many items")
+    parser.add_argument("--find", help="with --list, print the item with this name (or uri)")
+    parser.add_argument("--no-cache", action="store_true", help="with --list, do not use the on-disk cache")
+    parser.add_argument("--clear-cache", action="store_true", help="with --list, drop the cached entry of the server first")
+    args = parser.parse_args()
+    if args.list:
+        asyncio.run(inspect(args))
+        return
+    if args.duration:
+        args.iterations = 0
+    try:
+        asyncio.run(run(args))
+    except KeyboardInterrupt:
+        pass
+
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
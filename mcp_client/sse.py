@@ -0,0 +1,198 @@
+"""
+Incremental reader for streamable-HTTP MCP replies.
+
+A POST to an MCP server is answered either with a JSON body or with a
+text/event-stream that carries notifications (progress, logging, ...) before
+the response itself. SSEParser turns bytes into events as they come off the
+socket, following the WHATWG event-stream rules, and SSEReader hands every
+JSON-RPC message to a callback the moment its event is complete: responses,
+notifications and server-to-client requests each have their own. The reader
+also times the stream: time to first event and the gaps between events.
+
+Only the standard library is used here; SSEReader.read() takes a streamed
+requests response and SSEReader.aread() a streamed httpx one. Other tools
+install it from this directory as the mcp-sse package (see pyproject.toml).
+"""
+
+import json
+import time
+import codecs
+
+BOM = "\ufeff"
+
+
+class Event:
+    def __init__(self, event: str = "message", data: str = "", id: str = None, retry: int = None):
+        self.event = event
+        self.data = data
+        self.id = id
+        self.retry = retry
+
+    def __repr__(self):
+        return f"Event(event={self.event!r}, id={self.id!r}, data={self.data[:60]!r})"
+
+
+class SSEParser:
+    """Feed it chunks of bytes; it returns the events each chunk completes"""
+
+    def __init__(self):
+        self.buffer = ""
+        self.data = []
+        self.event = ""
+        self.retry = None
+        # The id persists across events until the server sets another one
+        self.last_id = None
+        self.started = False
+        # A chunk that ended in "\r" may be the first half of "\r\n"
+        self.pending_cr = False
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    def feed(self, chunk: bytes):
+        text = self.decoder.decode(chunk)
+        if not self.started and text:
+            self.started = True
+            text = text[1:] if text.startswith(BOM) else text
+        if self.pending_cr and text.startswith("\n"):
+            text = text[1:]
+        self.pending_cr = text.endswith("\r")
+        self.buffer += text
+
+        events = []
+        lines = self.buffer.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+        # The last piece is an incomplete line (empty when the chunk ended with a line break)
+        self.buffer = lines.pop()
+        for line in lines:
+            event = self._line(line)
+            if event is not None:
+                events.append(event)
+        return events
+
+    def _line(self, line: str):
+        if not line:
+            return self._dispatch()
+        if line.startswith(":"):
+            # Comment, used by servers as keep-alive
+            return None
+        name, _, value = line.partition(":")
+        value = value[1:] if value.startswith(" ") else value
+        if name == "data":
+            self.data.append(value)
+        elif name == "event":
+            self.event = value
+        elif name == "id" and "\0" not in value:
+            self.last_id = value
+        elif name == "retry" and value.isdigit():
+            self.retry = int(value)
+        return None
+
+    def _dispatch(self):
+        if not self.data:
+            self.event = ""
+            return None
+        event = Event(self.event or "message", "\n".join(self.data), self.last_id, self.retry)
+        self.data = []
+        self.event = ""
+        return event
+
+
+class EventTiming:
+    """Time to first event and the gaps between events of one reply, in seconds"""
+
+    def __init__(self, started: float = None):
+        self.started = time.perf_counter() if started is None else started
+        self.first_event = None
+        self.last_event = None
+        self.events = 0
+        self.gaps = []
+
+    def mark(self):
+        now = time.perf_counter()
+        if self.first_event is None:
+            self.first_event = now - self.started
+        else:
+            self.gaps.append(now - self.last_event)
+        self.last_event = now
+        self.events += 1
+
+    @property
+    def max_gap(self):
+        return max(self.gaps) if self.gaps else 0.0
+
+    def summary(self) -> dict:
+        return {
+            "events": self.events,
+            "ttfe_ms": round(self.first_event * 1000, 3) if self.first_event is not None else None,
+            "max_gap_ms": round(self.max_gap * 1000, 3),
+        }
+
+
+class SSEReader:
+    """
+    Reads one MCP reply, JSON or event stream, and dispatches its JSON-RPC
+    messages as they arrive. Callbacks take the message dict; the responses are
+    also collected in `responses`. `started` is when the request was sent, as
+    time.perf_counter(), so the time to first event includes the wait for headers.
+    """
+
+    def __init__(self, on_response=None, on_notification=None, on_request=None, started: float = None):
+        self.on_response = on_response
+        self.on_notification = on_notification
+        self.on_request = on_request
+        self.parser = SSEParser()
+        self.timing = EventTiming(started)
+        self.responses = []
+        self.streamed = False
+        # The id of the last event, to resume the stream with Last-Event-ID
+        self.last_event_id = None
+
+    def dispatch(self, message):
+        if not isinstance(message, dict):
+            return
+        if "method" not in message:
+            self.responses.append(message)
+            if self.on_response:
+                self.on_response(message)
+        elif "id" in message:
+            if self.on_request:
+                self.on_request(message)
+        elif self.on_notification:
+            self.on_notification(message)
+
+    def _events(self, events):
+        for event in events:
+            self.timing.mark()
+            self.last_event_id = event.id
+            if event.event != "message" or not event.data:
+                continue
+            body = json.loads(event.data)
+            # An event may carry a JSON-RPC batch
+            for message in body if isinstance(body, list) else [body]:
+                self.dispatch(message)
+
+    def _json(self, content: bytes):
+        self.timing.mark()
+        if content:
+            body = json.loads(content)
+            for message in body if isinstance(body, list) else [body]:
+                self.dispatch(message)
+
+    def read(self, response):
+        """Read a requests.Response sent with stream=True"""
+        if "text/event-stream" not in response.headers.get("content-type", ""):
+            self._json(response.content)
+            return self.responses
+        self.streamed = True
+        # chunk_size=None yields data as it arrives instead of filling fixed-size chunks
+        for chunk in response.iter_content(chunk_size=None):
+            self._events(self.parser.feed(chunk))
+        return self.responses
+
+    async def aread(self, response):
+        """Read an httpx.Response opened with client.stream()"""
+        if "text/event-stream" not in response.headers.get("content-type", ""):
+            self._json(await response.aread())
+            return self.responses
+        self.streamed = True
+        async for chunk in response.aiter_bytes():
+            self._events(self.parser.feed(chunk))
+        return self.responses
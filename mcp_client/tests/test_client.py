@@ -0,0 +1,94 @@
+import json
+import asyncio
+
+import httpx
+
+from cache import MCPCache
+from client import MCPClient
+
+PAGES = {None: (["a"], "p2"), "p2": (["b"], None)}
+
+
+def mock_server(cursors):
+    """A server with two pages of tools that records the cursor of every tools/list"""
+
+    async def handler(request):
+        if request.method == "DELETE":
+            return httpx.Response(200)
+        message = json.loads(request.content)
+        if "id" not in message:
+            return httpx.Response(202)
+        if message["method"] == "tools/list":
+            cursor = (message.get("params") or {}).get("cursor")
+            cursors.append(cursor)
+            # Give the other iteration a chance to ask for the same page
+            await asyncio.sleep(0.01)
+            names, next_cursor = PAGES[cursor]
+            result = {"tools": [{"name": name} for name in names]}
+            if next_cursor:
+                result["nextCursor"] = next_cursor
+        else:
+            result = {"protocolVersion": "2025-06-18", "capabilities": {"tools": {}}}
+        return httpx.Response(200, json={"jsonrpc": "2.0", "id": message["id"], "result": result},
+                              headers={"mcp-session-id": "s1"})
+
+    return httpx.MockTransport(handler)
+
+
+def test_concurrent_listings_fetch_each_page_once():
+    cursors = []
+
+    async def run():
+        http = httpx.AsyncClient(transport=mock_server(cursors))
+        async with MCPClient("http://mcp/mcp", http=http) as mcp:
+            async def names():
+                return [tool["name"] async for tool in mcp.list("tools")]
+
+            results = await asyncio.gather(names(), names())
+            pages = mcp.listings["tools"].pages
+        await http.aclose()
+        return results, pages
+
+    results, pages = asyncio.run(run())
+    assert results == [["a", "b"], ["a", "b"]]
+    assert cursors == [None, "p2"]
+    assert pages == [[{"name": "a"}], [{"name": "b"}]]
+
+
+def test_concurrent_requests_recover_from_a_forgotten_session(tmp_path):
+    initializes = []
+
+    async def handler(request):
+        if request.method == "DELETE":
+            return httpx.Response(200)
+        message = json.loads(request.content)
+        if message["method"] == "initialize":
+            initializes.append(message["id"])
+            result = {"protocolVersion": "2025-06-18", "capabilities": {"tools": {}}}
+            return httpx.Response(200, json={"jsonrpc": "2.0", "id": message["id"], "result": result},
+                                  headers={"mcp-session-id": "new"})
+        # Both calls are in flight with the cached session before either is answered
+        await asyncio.sleep(0.01)
+        if request.headers.get("mcp-session-id") != "new":
+            return httpx.Response(404, text="unknown session")
+        if "id" not in message:
+            return httpx.Response(202)
+        return httpx.Response(200, json={"jsonrpc": "2.0", "id": message["id"], "result": {"echo": message["params"]}})
+
+    cache = MCPCache("http://mcp/mcp", "2025-06-18", directory=str(tmp_path))
+    cache.store_handshake({"protocolVersion": "2025-06-18", "capabilities": {"tools": {}}}, "old")
+
+    async def run():
+        http = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        async with MCPClient("http://mcp/mcp", http=http, cache=cache) as mcp:
+            assert mcp.resumed
+            results = await mcp.gather(("tools/call", {"n": 1}), ("tools/call", {"n": 2}))
+            session_id = mcp.session_id
+        await http.aclose()
+        return results, session_id
+
+    results, session_id = asyncio.run(run())
+    assert results == [{"echo": {"n": 1}}, {"echo": {"n": 2}}]
+    assert len(initializes) == 1
+    assert session_id == "new"
+    assert cache.handshake()[1] == "new"